@@ -0,0 +1,347 @@
+"""Columnar analytics store for chat turns.
+
+logs/chat_logs.csv stays the append-only write path. A background job
+compacts the rows appended since the last run (tracked by byte offset) into
+Parquet files partitioned as analytics/chat_turns/website_id=<id>/date=<day>/,
+classifying user turns for sales intent once at compaction time. Dashboard
+queries read only the columns and partitions they need and aggregate with
+pyarrow.compute, so they never re-parse the CSV.
+"""
+import os
+import io
+import re
+import csv
+import json
+import time
+import fcntl
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+CHAT_LOG_PATH = "logs/chat_logs.csv"
+ANALYTICS_ROOT = "analytics/chat_turns"
+STATE_FILE = "analytics/compaction_state.json"
+LOCK_FILE = "analytics/.compaction.lock"
+
+# Partitions with more files than this are merged into one
+MERGE_MIN_FILES = 8
+# Upper bound on bytes read from the CSV per compaction pass
+COMPACT_MAX_BYTES = 64 * 1024 * 1024
+# Cached query results kept per process
+QUERY_CACHE_SIZE = 128
+
+TURN_SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("s")),
+    ("user_id", pa.string()),
+    ("sender", pa.string()),
+    ("message", pa.string()),
+    ("intent", pa.string()),
+    ("sales_flag", pa.bool_()),
+])
+PARTITIONING = ds.partitioning(pa.schema([("website_id", pa.string()), ("date", pa.string())]), flavor="hive")
+
+_PARTITION_VALUE_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+_process_lock = threading.Lock()
+_query_cache = {}
+
+
+# ---------- state ----------
+
+def load_state(state_file=STATE_FILE):
+    try:
+        with open(state_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"offset": 0, "inode": None, "generation": 0}
+
+
+def _save_state(state, state_file=STATE_FILE):
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    tmp_path = state_file + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_file)
+
+
+@contextmanager
+def _compaction_lock(lock_file=LOCK_FILE):
+    """Serialize compaction across threads and processes (app and scheduler)"""
+    os.makedirs(os.path.dirname(lock_file), exist_ok=True)
+    with _process_lock, open(lock_file, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# ---------- compaction ----------
+
+@functools.lru_cache(maxsize=1)
+def load_intent_matcher():
+    """Keyword intent matcher; None if the classifier module cannot be loaded"""
+    try:
+        from sales_intent_classifier import match_sales_intents
+        return match_sales_intents
+    except Exception as e:
+        logger.warning(f"Sales intent matcher unavailable, intents will be empty: {e}")
+        return None
+
+
+def parse_rows(text):
+    """Chat log rows as dicts; accepts the old 4-column and current 5-column layouts"""
+    rows = []
+    for fields in csv.reader(io.StringIO(text)):
+        if len(fields) >= 5:
+            ts, user_id, sender, website_id, message = fields[0], fields[1], fields[2], fields[3], ",".join(fields[4:])
+        elif len(fields) == 4:
+            ts, user_id, sender, message = fields
+            website_id = "default"
+        else:
+            continue
+        try:
+            timestamp = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+        rows.append({"timestamp": timestamp, "user_id": user_id, "sender": sender,
+                     "website_id": website_id or "default", "message": message})
+    return rows
+
+
+def _write_partitions(rows, root, part_name):
+    """Write rows as one Parquet file per (website_id, date) partition"""
+    match_intents = load_intent_matcher()
+    partitions = {}
+    for row in rows:
+        intent, sales_flag = None, None
+        if row["sender"] == "user" and match_intents is not None:
+            intents = match_intents(row["message"])
+            intent = intents[0] if intents else None
+            sales_flag = bool(intents)
+        key = (_PARTITION_VALUE_RE.sub("_", row["website_id"]), row["timestamp"].strftime("%Y-%m-%d"))
+        columns = partitions.setdefault(key, {name: [] for name in TURN_SCHEMA.names})
+        for name, value in (("timestamp", row["timestamp"]), ("user_id", row["user_id"]),
+                            ("sender", row["sender"]), ("message", row["message"]),
+                            ("intent", intent), ("sales_flag", sales_flag)):
+            columns[name].append(value)
+
+    for (website_id, date), columns in partitions.items():
+        directory = os.path.join(root, f"website_id={website_id}", f"date={date}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{part_name}.parquet")
+        tmp_path = os.path.join(directory, f".{part_name}.parquet.tmp")
+        pq.write_table(pa.Table.from_pydict(columns, schema=TURN_SCHEMA), tmp_path)
+        os.replace(tmp_path, path)
+    return len(partitions)
+
+
+def compact(log_path=CHAT_LOG_PATH, root=ANALYTICS_ROOT, state_file=STATE_FILE):
+    """Move chat log rows appended since the last run into the Parquet store"""
+    started = time.perf_counter()
+    with _compaction_lock():
+        state = load_state(state_file)
+        _finish_merges(state, state_file)
+        # Every run counts as a change, so cached summaries never outlive a compaction
+        state["generation"] = state.get("generation", 0) + 1
+        if not os.path.exists(log_path):
+            _save_state(state, state_file)
+            return {"rows": 0, "partitions": 0}
+
+        stat = os.stat(log_path)
+        offset = state.get("offset", 0)
+        if state.get("inode") != stat.st_ino or stat.st_size < offset:
+            # The log was cleared or rotated; its rows start over from byte 0
+            offset = 0
+
+        with open(log_path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read(COMPACT_MAX_BYTES)
+        # Only consume complete lines; a turn being written right now waits for the next run
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            _save_state(state, state_file)
+            return {"rows": 0, "partitions": 0}
+
+        rows = parse_rows(chunk[:end].decode("utf-8", errors="replace"))
+        partitions = _write_partitions(rows, root, f"part-{stat.st_ino}-{offset:012d}") if rows else 0
+
+        state.update(offset=offset + end, inode=stat.st_ino, compacted_at=datetime.now().isoformat())
+        _save_state(state, state_file)
+
+    result = {"rows": len(rows), "partitions": partitions, "offset": offset + end,
+              "seconds": round(time.perf_counter() - started, 3)}
+    logger.info(f"Compacted chat logs into {root}: {result}")
+    return result
+
+
+def _finish_merges(state, state_file=STATE_FILE):
+    """Complete merges recorded in state; a crash mid-swap is finished on the next run"""
+    pending = state.get("pending_merges") or []
+    for merge in pending:
+        hidden = os.path.join(merge["dir"], merge["hidden"])
+        if os.path.exists(hidden):
+            for name in merge["parts"]:
+                try:
+                    os.remove(os.path.join(merge["dir"], name))
+                except FileNotFoundError:
+                    pass
+            os.replace(hidden, os.path.join(merge["dir"], merge["final"]))
+    if pending:
+        state["pending_merges"] = []
+        state["generation"] = state.get("generation", 0) + 1
+        _save_state(state, state_file)
+    return len(pending)
+
+
+def merge_small_files(root=ANALYTICS_ROOT, state_file=STATE_FILE, min_files=MERGE_MIN_FILES):
+    """Rewrite partitions made of many small incremental files as a single file.
+
+    The merged file is written under a hidden name (readers skip dot files)
+    and recorded in the state before any part is deleted, so a crash at any
+    point leaves either the parts or the merged file to finish the swap with.
+    """
+    merged = 0
+    with _compaction_lock():
+        state = load_state(state_file)
+        _finish_merges(state, state_file)
+        if not os.path.isdir(root):
+            return merged
+        pending = []
+        for dirpath, _, filenames in os.walk(root):
+            parts = sorted(name for name in filenames if name.endswith(".parquet") and not name.startswith("."))
+            if len(parts) < min_files:
+                continue
+            table = pa.concat_tables(pq.read_table(os.path.join(dirpath, name), schema=TURN_SCHEMA)
+                                     for name in parts)
+            final = f"merged-{time.time_ns()}.parquet"
+            tmp_path = os.path.join(dirpath, ".merged.parquet.tmp")
+            pq.write_table(table.sort_by("timestamp"), tmp_path)
+            os.replace(tmp_path, os.path.join(dirpath, "." + final))
+            pending.append({"dir": dirpath, "hidden": "." + final, "final": final, "parts": parts})
+        if pending:
+            state["pending_merges"] = pending
+            _save_state(state, state_file)
+            merged = _finish_merges(state, state_file)
+    return merged
+
+
+def clear(root=ANALYTICS_ROOT, state_file=STATE_FILE):
+    """Drop all compacted data, e.g. after the chat logs were cleared"""
+    import shutil
+
+    with _compaction_lock():
+        shutil.rmtree(root, ignore_errors=True)
+        state = load_state(state_file)
+        _save_state({"offset": 0, "inode": None, "generation": state.get("generation", 0) + 1}, state_file)
+    _query_cache.clear()
+
+
+# ---------- queries ----------
+
+def _since(days):
+    """First date (YYYY-MM-DD) of the last `days` days, including today; None for all time"""
+    return (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d") if days else None
+
+
+def _load_turns(root, website_id=None, days=30, columns=None, since=None):
+    """Table of chat turns for a website (or all) over the last `days` days (0 = all time)"""
+    if not os.path.isdir(root):
+        return pa.Table.from_pydict({name: [] for name in (columns or TURN_SCHEMA.names)})
+    dataset = ds.dataset(root, format="parquet", partitioning=PARTITIONING, schema=TURN_SCHEMA.append(
+        pa.field("website_id", pa.string())).append(pa.field("date", pa.string())))
+    conditions = []
+    if website_id:
+        conditions.append(ds.field("website_id") == _PARTITION_VALUE_RE.sub("_", website_id))
+    since = since or _since(days)
+    if since:
+        conditions.append(ds.field("date") >= since)
+    condition = None
+    for part in conditions:
+        condition = part if condition is None else condition & part
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def summarize(website_id=None, days=30, top_n=10, root=ANALYTICS_ROOT, state_file=STATE_FILE):
+    """Daily counts, unique users, top queries and sales-flag rate.
+
+    Results are cached until the next compaction or merge changes the store,
+    or the day changes and the window of `days` days moves with it.
+    """
+    generation = load_state(state_file).get("generation", 0)
+    since = _since(days)
+    key = (root, website_id, days, since, top_n, generation)
+    cached = _query_cache.get(key)
+    if cached is not None:
+        return cached
+
+    started = time.perf_counter()
+    table = _load_turns(root, website_id, days, since=since,
+                        columns=["date", "website_id", "user_id", "sender", "message", "sales_flag"])
+    user_turns = table.filter(pc.equal(table["sender"], "user")) if table.num_rows else table
+
+    daily = []
+    if table.num_rows:
+        by_day = table.group_by("date").aggregate([("user_id", "count"), ("user_id", "count_distinct")])
+        user_by_day = user_turns.group_by("date").aggregate([("sales_flag", "sum")])
+        flags = dict(zip(user_by_day["date"].to_pylist(), user_by_day["sales_flag_sum"].to_pylist()))
+        for row in by_day.sort_by("date").to_pylist():
+            daily.append({"date": row["date"], "messages": row["user_id_count"],
+                          "unique_users": row["user_id_count_distinct"], "sales_flags": flags.get(row["date"]) or 0})
+
+    top_queries = []
+    if user_turns.num_rows:
+        normalized = pc.utf8_lower(pc.utf8_trim_whitespace(user_turns["message"]))
+        counts = pa.table({"query": normalized}).group_by("query").aggregate([("query", "count")])
+        counts = counts.sort_by([("query_count", "descending"), ("query", "ascending")]).slice(0, top_n)
+        top_queries = [{"query": row["query"], "count": row["query_count"]} for row in counts.to_pylist()]
+
+    flagged = pc.sum(user_turns["sales_flag"]).as_py() if user_turns.num_rows else None
+    classified = pc.count(user_turns["sales_flag"]).as_py() if user_turns.num_rows else 0
+
+    websites = {}
+    if website_id is None and table.num_rows:
+        per_site = table.group_by("website_id").aggregate([("user_id", "count")])
+        websites = dict(zip(per_site["website_id"].to_pylist(), per_site["user_id_count"].to_pylist()))
+
+    summary = {
+        "website_id": website_id,
+        "days": days,
+        "since": since,
+        "total_messages": table.num_rows,
+        "user_messages": user_turns.num_rows,
+        "unique_users": pc.count_distinct(table["user_id"]).as_py() if table.num_rows else 0,
+        "sales_flags": flagged or 0,
+        "sales_flag_rate": round((flagged or 0) / classified, 4) if classified else 0.0,
+        "daily_stats": daily,
+        "top_queries": top_queries,
+        "websites": websites,
+        "generation": generation,
+        "query_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    if len(_query_cache) >= QUERY_CACHE_SIZE:
+        _query_cache.clear()
+    _query_cache[key] = summary
+    return summary
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "compact"
+    if command == "compact":
+        print(f"📦 {compact()}")
+        print(f"🧹 Merged {merge_small_files()} partitions")
+    elif command == "summary":
+        print(json.dumps(summarize(sys.argv[2] if len(sys.argv) > 2 else None, days=0), indent=2))
+    else:
+        print("Usage: python analytics_store.py [compact|summary [website_id]]")
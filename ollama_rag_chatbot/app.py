@@ -1569,6 +1569,8 @@ import re
 import shutil
 import json
 import time
+import copy
+import threading
 
 import mysql.connector
 from db_config import DB_CONFIG
@@ -1580,12 +1582,30 @@ except ImportError:
     from langchain.vectorstores import Chroma  # Fallback (legacy)
 
 from langchain_community.embeddings import HuggingFaceEmbeddings  # ✅ Updated
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
 from werkzeug.utils import secure_filename
 import hashlib
 from urllib.parse import urlparse
 
+import tracing
+import vector_index
+import numpy_store
+from knowledge_base import VersionedKnowledgeBase
+import snapshots
+import restore
+import analytics_store
+import rollups
+import tree_store
+from keyword_matcher import query_category_matcher, determine_query_categories
+import assets
+import origin_index
+import tenant_registry
+import rate_limit
+import single_flight
+import llm_router
+import http_clients
+import prompt_layout
+import csv
+
 # App setup
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "admin123")
@@ -1609,7 +1629,8 @@ SUGGESTED_MESSAGES = [
 ]
 
 # Website configuration - Enhanced with LLM-specific settings
-WEBSITE_CONFIGS = {
+# Seeds a new tenant registry; after that config/tenants.sqlite3 is authoritative
+DEFAULT_WEBSITE_CONFIGS = {
     'sourceselect.ca': {
         'name': 'SourceSelect',
         'bot_name': 'Bob',
@@ -1652,6 +1673,12 @@ WEBSITE_CONFIGS = {
     }
 }
 
+# In-memory snapshot of the tenant registry; reloads when another process changes it
+WEBSITE_CONFIGS = tenant_registry.TenantRegistry(seed=DEFAULT_WEBSITE_CONFIGS)
+
+# Rebuild whenever WEBSITE_CONFIGS changes (see on_tenants_changed)
+origin_index.index.rebuild(WEBSITE_CONFIGS)
+
 # File categories configuration
 FILE_CATEGORIES = {
     'company_details': {
@@ -1684,9 +1711,24 @@ FILE_CATEGORIES = {
 # 🔐 ENHANCED LLM CONFIGURATION MANAGEMENT
 # ================================
 
-def load_llm_config():
-    """Load global LLM configuration with fallback to environment variables"""
-    config_file = "config/llm_config.json"
+LLM_CONFIG_FILE = "config/llm_config.json"
+# How often (seconds) the config file is checked for edits made outside save_llm_config
+LLM_CONFIG_CHECK_INTERVAL = 5.0
+
+# Parsed config plus resolved per-website views; reset when the file changes
+_llm_config_cache = {"config": None, "state": None, "next_check": 0.0, "effective": {}}
+_llm_config_lock = threading.Lock()
+
+def _llm_config_file_state():
+    try:
+        stat = os.stat(LLM_CONFIG_FILE)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+def _read_llm_config():
+    """Read config/llm_config.json merged over the defaults (environment variables)"""
+    config_file = LLM_CONFIG_FILE
     
     default_config = {
         "global_provider": os.getenv("LLM_PROVIDER", "openai"),
@@ -1714,7 +1756,6 @@ def load_llm_config():
     }
     
     try:
-        os.makedirs("config", exist_ok=True)
         if os.path.exists(config_file):
             with open(config_file, 'r') as f:
                 saved_config = json.load(f)
@@ -1730,21 +1771,62 @@ def load_llm_config():
     
     return default_config
 
+def cached_llm_config():
+    """Shared, read-only LLM configuration; the file is re-checked at most every few seconds"""
+    cache = _llm_config_cache
+    now = time.monotonic()
+    if cache["config"] is not None and now < cache["next_check"]:
+        return cache["config"]
+    with _llm_config_lock:
+        if cache["config"] is None or now >= cache["next_check"]:
+            state = _llm_config_file_state()
+            if cache["config"] is None or state != cache["state"]:
+                cache["config"] = _read_llm_config()
+                cache["state"] = state
+                cache["effective"] = {}
+            cache["next_check"] = now + LLM_CONFIG_CHECK_INTERVAL
+        return cache["config"]
+
+def invalidate_llm_config(website_ids=None):
+    """Drop the cached config (or just the resolved views of some websites)"""
+    with _llm_config_lock:
+        if website_ids is None:
+            _llm_config_cache["config"] = None
+            _llm_config_cache["effective"] = {}
+        else:
+            for website_id in website_ids:
+                _llm_config_cache["effective"].pop(website_id, None)
+
+def load_llm_config():
+    """Load global LLM configuration with fallback to environment variables (a copy safe to edit)"""
+    return copy.deepcopy(cached_llm_config())
+
 def save_llm_config(config):
     """Save LLM configuration to file"""
-    config_file = "config/llm_config.json"
+    config_file = LLM_CONFIG_FILE
     try:
         os.makedirs("config", exist_ok=True)
-        with open(config_file, 'w') as f:
+        tmp_file = config_file + ".tmp"
+        with open(tmp_file, 'w') as f:
             json.dump(config, f, indent=2)
+        os.replace(tmp_file, config_file)
+        invalidate_llm_config()
         return True
     except Exception as e:
         print(f"Error saving LLM config: {e}")
         return False
 
 def get_effective_llm_config(website_id=None):
-    """Get effective LLM configuration for a specific website or global"""
-    global_config = load_llm_config()
+    """Get effective LLM configuration for a specific website or global (cached, read-only)"""
+    global_config = cached_llm_config()
+    effective_views = _llm_config_cache["effective"]
+    effective_config = effective_views.get(website_id)
+    if effective_config is None:
+        effective_config = effective_views[website_id] = resolve_llm_config(global_config, website_id)
+    return effective_config
+
+def resolve_llm_config(global_config, website_id=None):
+    """Merge global settings, per-website overrides and the website's llm_config"""
     
     # Check for website-specific override
     if website_id and website_id in global_config.get("website_overrides", {}):
@@ -1815,6 +1897,41 @@ def get_effective_llm_config(website_id=None):
     }
 
     
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+def build_backend_llm(spec):
+    """LangChain client for one routing backend from config/llm_config.json"""
+    global_config = cached_llm_config()
+    provider = spec.get("provider", "ollama")
+    provider_config = global_config.get(provider, {})
+    model = spec.get("model") or provider_config.get("default_model")
+    temperature = spec.get("temperature")
+    if temperature is None:
+        temperature = provider_config.get("models", {}).get(model, {}).get("temperature", 0.7)
+    
+    if provider == "openai":
+        from langchain_openai import ChatOpenAI
+        base_url = spec.get("base_url") or OPENAI_BASE_URL
+        return ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            openai_api_key=spec.get("api_key") or provider_config.get("api_key") or os.getenv("OPENAI_API_KEY"),
+            base_url=base_url,
+            timeout=spec.get("timeout", 60),
+            http_client=http_clients.get_client(base_url, spec.get("pool"))
+        )
+    if provider == "ollama":
+        if http_clients.PooledOllama is None:
+            raise ImportError("langchain-community is not installed")
+        return http_clients.PooledOllama(
+            model=model,
+            temperature=temperature,
+            base_url=spec.get("base_url") or provider_config.get("base_url"),
+            keep_alive=spec.get("keep_alive", prompt_layout.OLLAMA_KEEP_ALIVE),
+            pool=spec.get("pool") or {}
+        )
+    raise ValueError(f"Unknown LLM provider {provider!r}")
+
 def create_llm_instance(website_id=None):
     """Create LLM instance based on website-specific or global configuration"""
     effective_config = get_effective_llm_config(website_id)
@@ -1822,6 +1939,14 @@ def create_llm_instance(website_id=None):
     model = effective_config["model"]
     temperature = effective_config["temperature"]
     
+    # A routing policy spreads calls over a pool of backends instead of one provider
+    routing = effective_config["config"].get("routing")
+    policy = llm_router.resolve_policy(routing, website_id)
+    if policy:
+        llm_router.pool.configure(routing["backends"], build_backend_llm)
+        print(f"🔀 Routing LLM calls for {website_id or 'global'} across {', '.join(policy['backends'])} ({policy['strategy']})")
+        return llm_router.RoutedLLM(router=llm_router.Router(policy), website_id=website_id), "router"
+    
     if provider == "openai":
         try:
             from langchain_openai import ChatOpenAI
@@ -1831,11 +1956,11 @@ def create_llm_instance(website_id=None):
                 print(f"⚠️ OpenAI API key not found for website {website_id}")
                 return create_mock_llm(), "mock"
             
-            # Test the API key before creating the LLM instance
+            # Test the API key before creating the LLM instance (on the shared, pooled connection)
+            http_client = http_clients.get_client(OPENAI_BASE_URL)
             try:
                 import openai
-                openai.api_key = api_key
-                openai.models.list()  # Simple API call to test the key
+                openai.OpenAI(api_key=api_key, base_url=OPENAI_BASE_URL, http_client=http_client).models.list()
             except Exception as api_error:
                 print(f"❌ OpenAI API key validation failed: {api_error}")
                 return create_mock_llm(), "mock"
@@ -1843,7 +1968,9 @@ def create_llm_instance(website_id=None):
             llm = ChatOpenAI(
                 model=model,
                 temperature=temperature,
-                openai_api_key=api_key
+                openai_api_key=api_key,
+                base_url=OPENAI_BASE_URL,
+                http_client=http_client
             )
             print(f"🤖 Using OpenAI model: {model} for website {website_id or 'global'}")
             return llm, "openai"
@@ -1854,23 +1981,22 @@ def create_llm_instance(website_id=None):
     
     elif provider == "ollama":
         try:
-            from langchain_community.llms import Ollama
+            if http_clients.PooledOllama is None:
+                raise ImportError("langchain-community is not installed")
             base_url = effective_config["config"]["ollama"]["base_url"]
             
-            # Test Ollama connection
+            # Test Ollama connection (warms the pooled connection the LLM will use)
             try:
-                import requests
-                response = requests.get(f"{base_url}/api/tags")
-                if response.status_code != 200:
-                    raise Exception(f"Ollama connection failed: {response.status_code}")
+                http_clients.probe_ollama(base_url)
             except Exception as conn_error:
                 print(f"❌ Ollama connection test failed: {conn_error}")
                 return create_mock_llm(), "mock"
             
-            llm = Ollama(
+            llm = http_clients.PooledOllama(
                 model=model,
                 temperature=temperature,
-                base_url=base_url
+                base_url=base_url,
+                keep_alive=prompt_layout.OLLAMA_KEEP_ALIVE
             )
             print(f"🤖 Using Ollama model: {model} for website {website_id or 'global'}")
             return llm, "ollama"
@@ -1926,14 +2052,11 @@ except Exception as e:
         LLM_OPTION = "mock"
         print("🤖 Using Mock LLM (for testing only)")
 
-# 🔍 Embeddings & Vector DB setup
-embeddings = HuggingFaceEmbeddings()
+# 🔍 Embeddings & Vector DB setup (wrapped so query embedding time shows up in traces)
+embeddings = tracing.TimedEmbeddings(HuggingFaceEmbeddings())
 
-# ✅ Chroma vector store (no `.persist()` needed)
-vectorstore = Chroma(
-    persist_directory="./chroma_db",
-    embedding_function=embeddings
-)
+# ✅ Versioned global knowledge base: rebuilds publish a new version, chats keep reading the old one until it's live
+knowledge_base = VersionedKnowledgeBase("./chroma_db", embeddings)
 
 # RAG prompt template - Load from file or use default
 def load_saved_prompt():
@@ -1972,86 +2095,57 @@ User Question: {question}
 Bob's Response:
 """
 
-prompt = PromptTemplate(
-    input_variables=["context", "question"],
-    template=template_text,
-)
-
-retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-
-# QA chains cache
-qa_chains = {}
-
-def get_qa_chain_for_website(website_id):
-    """Get or create QA chain for specific website"""
-    if website_id not in qa_chains:
-        llm, provider = get_llm_for_website(website_id)
-        
-        if provider != "mock" and hasattr(llm, 'invoke'):
-            try:
-                qa_chain = RetrievalQA.from_chain_type(
-                    llm=llm,
-                    chain_type="stuff",
-                    retriever=retriever,
-                    chain_type_kwargs={"prompt": prompt}
-                )
-                qa_chains[website_id] = qa_chain
-                print(f"✅ QA Chain created for website {website_id}")
-            except Exception as e:
-                print(f"❌ QA Chain creation failed for {website_id}: {e}")
-                qa_chains[website_id] = None
-        else:
-            qa_chains[website_id] = None
-    
-    return qa_chains[website_id]
-
-def update_qa_chain():
-    """Update QA chain with current LLM and prompt"""
-    global qa_chain
-    if LLM_OPTION != "mock" and hasattr(llm, 'invoke'):
-        try:
-            qa_chain = RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=retriever,
-                chain_type_kwargs={"prompt": prompt}
-            )
-            print("✅ QA Chain updated successfully")
-        except Exception as e:
-            print(f"❌ QA Chain update failed: {e}")
-            qa_chain = None
-    else:
-        qa_chain = None
-        print("⚠️ Using mock LLM - QA chain not created")
-
-# Create default QA chain
-qa_chain = get_qa_chain_for_website('default')
+retriever = knowledge_base.as_retriever(k=5)
+# Candidates fetched when a query names a topic, reordered so its upload categories come first
+CATEGORY_CANDIDATES = 15
 
 def initialize_website_configs():
     """Initialize website configurations from database"""
     try:
         # Add your database initialization logic here if needed
+
+        # Pre-render widget assets so the first page views don't pay for it
+        with app.app_context():
+            for website_id, config in WEBSITE_CONFIGS.items():
+                assets.pipeline.website_assets(website_id, config, render_widget)
         print("✅ Website configurations initialized")
     except Exception as e:
         print(f"⚠️ Website config initialization failed: {e}")
 
+def on_tenants_changed(website_ids):
+    """Drop cached state of tenants whose configuration changed; other tenants keep theirs"""
+    origin_index.index.rebuild(WEBSITE_CONFIGS)
+    for website_id in website_ids:
+        llm_instances.pop(website_id, None)
+        invalidate_llm_config([website_id])
+        assets.pipeline.invalidate(website_id)
+        numpy_store.forget_store(numpy_store.website_store_path(website_id))
+    print(f"🔄 Website configs reloaded: {sorted(website_ids)}")
+
+WEBSITE_CONFIGS.add_listener(on_tenants_changed)
+
 def get_knowledge_base_path(website_id):
-    """Get the knowledge base path for a specific website"""
-    return f"./chroma_db_{website_id}"
+    """Get the knowledge base path for a specific website (the active rebuilt index, if any)"""
+    return vector_index.resolve_index_path(vector_index.website_base_path(website_id))
 
 def get_website_vectorstore(website_id):
-    """Get or create website-specific vector store"""
+    """Get or create website-specific vector store (exact NumPy search for small tenants)"""
     kb_path = get_knowledge_base_path(website_id)
     try:
+        numpy_path = numpy_store.website_store_path(website_id)
+        if numpy_store.use_numpy_backend(numpy_path, kb_path):
+            return numpy_store.open_store(numpy_path, embeddings)
+
         website_vectorstore = Chroma(
             persist_directory=kb_path,
-            embedding_function=embeddings
+            embedding_function=embeddings,
+            collection_metadata=vector_index.collection_metadata(vector_index.get_index_settings(website_id))
         )
         return website_vectorstore
     except Exception as e:
         print(f"Error creating vectorstore for {website_id}: {e}")
         # Fallback to global vectorstore
-        return vectorstore
+        return knowledge_base.current().vectorstore
 
 # ================================
 # 🌐 WEB UI ROUTES
@@ -2066,17 +2160,8 @@ def index():
     session.clear()
     return render_template("index.html", suggested=SUGGESTED_MESSAGES)
 
-@app.route("/widget")
-def widget_multi():
-    """Serve widget with website-specific configuration"""
-    website_id = request.args.get('website_id', 'default')
-    
-    if website_id not in WEBSITE_CONFIGS:
-        website_id = 'default'
-    
-    config = WEBSITE_CONFIGS[website_id]
-    
-    # Pass website-specific config to template
+def render_widget(website_id, config):
+    """Widget page for a website; rendered once and cached by the asset pipeline"""
     return render_template("widget.html", 
                          suggested=SUGGESTED_MESSAGES,
                          website_id=website_id,
@@ -2084,36 +2169,30 @@ def widget_multi():
                          primary_color=config.get('primary_color', '#667eea'),
                          website_name=config.get('name', 'Website'))
 
+def website_asset_response(website_id, name):
+    """Serve a pre-rendered website asset with ETag/304 and gzip/brotli negotiation"""
+    if website_id not in WEBSITE_CONFIGS:
+        website_id = 'default'
+    asset = assets.pipeline.website_assets(website_id, WEBSITE_CONFIGS[website_id], render_widget)[name]
+    return asset.response(request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding'))
+
+@app.route("/widget")
+def widget_multi():
+    """Serve widget with website-specific configuration"""
+    return website_asset_response(request.args.get('website_id', 'default'), "widget")
+
+@app.route("/assets/<path:name>")
+def serve_hashed_asset(name):
+    """Content-hashed widget assets; cacheable forever"""
+    asset = assets.pipeline.hashed_asset(name)
+    if asset is None:
+        return "Not found", 404
+    return asset.response(request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding'))
+
 @app.route("/embed.js")
 def serve_embed_script_multi():
     """Serve website-specific embed script"""
-    website_id = request.args.get('website_id', 'default')
-    
-    if website_id not in WEBSITE_CONFIGS:
-        website_id = 'default'
-    
-    config = WEBSITE_CONFIGS[website_id]
-    
-    # Generate dynamic embed script with website-specific config
-    embed_script = f"""
-(function() {{
-    window.CHATBOT_CONFIG = {{
-        apiBaseUrl: '{request.host_url.rstrip('/')}',
-        websiteId: '{website_id}',
-        botName: '{config.get('bot_name', 'Assistant')}',
-        primaryColor: '{config.get('primary_color', '#667eea')}',
-        websiteName: '{config.get('name', 'Website')}'
-    }};
-    
-    // Load the main embed script
-    const script = document.createElement('script');
-    script.src = '{request.host_url.rstrip('/')}/static/embed.js';
-    script.defer = true;
-    document.head.appendChild(script);
-}})();
-"""
-    
-    return embed_script, 200, {'Content-Type': 'application/javascript'}
+    return website_asset_response(request.args.get('website_id', 'default'), "embed")
 
 @app.route("/dashboard")
 def dashboard():
@@ -2130,14 +2209,10 @@ def get_website_config(request):
     if website_id and website_id in WEBSITE_CONFIGS:
         return website_id, WEBSITE_CONFIGS[website_id]
     
-    # Check origin/referer against allowed origins
-    for website_id, config in WEBSITE_CONFIGS.items():
-        if website_id == 'default':
-            continue
-        
-        allowed_origins = config.get('allowed_origins', [])
-        if any(allowed_origin in origin or allowed_origin in referer for allowed_origin in allowed_origins):
-            return website_id, config
+    # Check origin/referer against allowed origins (exact hosts or *.domain wildcards)
+    website_id = origin_index.index.resolve(origin, referer)
+    if website_id in WEBSITE_CONFIGS:
+        return website_id, WEBSITE_CONFIGS[website_id]
     
     # Default fallback
     return 'default', WEBSITE_CONFIGS['default']
@@ -2210,6 +2285,10 @@ def update_llm_config_api():
                     global_config["ollama"]["default_model"] = ollama_data["default_model"]
                 if "models" in ollama_data:
                     global_config["ollama"]["models"].update(ollama_data["models"])
+            
+            if "routing" in data:
+                # Backend pool and routing policies (see llm_router); empty disables routing
+                global_config["routing"] = data["routing"] or {}
         
         elif config_type == "website" and website_id:
             # Update website-specific configuration
@@ -2226,10 +2305,11 @@ def update_llm_config_api():
         
         # Save configuration
         if save_llm_config(global_config):
-            # Clear caches to force reload
-            global llm_instances, qa_chains
-            llm_instances.clear()
-            qa_chains.clear()
+            # Clear caches to force reload (only the affected website for overrides)
+            if config_type == "website" and website_id:
+                llm_instances.pop(website_id, None)
+            else:
+                llm_instances.clear()
             
             # Reinitialize default LLM
             global llm, LLM_OPTION
@@ -2242,6 +2322,18 @@ def update_llm_config_api():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/llm-router", methods=["GET"])
+def llm_router_stats():
+    """Routing policy of a website and the live latency / load of every backend"""
+    website_id = request.args.get('website_id', 'default')
+    global_config = cached_llm_config()
+    return jsonify({
+        "website_id": website_id,
+        "policy": llm_router.resolve_policy(global_config.get("routing"), website_id),
+        "backends": llm_router.pool.stats(),
+        "http_pools": http_clients.pool_stats()
+    })
+
 @app.route("/api/llm-test", methods=["POST"])
 def test_llm_api():
     """Test LLM configuration for specific website"""
@@ -2250,17 +2342,10 @@ def test_llm_api():
         website_id = data.get("website_id", "default")
         test_message = data.get("message", "Hello! Please confirm you're working.")
         
-        # Get website-specific LLM
+        # Same retrieval and prompt as /chat; the trace is never finished, so tests stay out of the metrics
         llm, provider = get_llm_for_website(website_id)
-        qa_chain = get_qa_chain_for_website(website_id)
-        
-        if qa_chain and hasattr(llm, 'invoke'):
-            response = qa_chain.invoke({"query": test_message})
-            reply = response["result"].strip()
-        elif hasattr(llm, 'invoke'):
-            reply = llm.invoke(test_message)
-        else:
-            reply = "LLM test failed - invalid configuration"
+        website_config = WEBSITE_CONFIGS.get(website_id) or WEBSITE_CONFIGS.get('default', {})
+        reply = generate_chat_reply(tracing.ChatTrace("llm_test"), [], llm, provider, website_config, test_message)
         
         effective_config = get_effective_llm_config(website_id)
         
@@ -2304,77 +2389,205 @@ def list_websites():
             website_id: {
                 "name": config["name"],
                 "bot_name": config["bot_name"], 
-                "status": "active" if os.path.exists(get_knowledge_base_path(website_id)) else "setup_required"
+                "status": "active" if os.path.exists(get_knowledge_base_path(website_id))
+                          or numpy_store.store_exists(numpy_store.website_store_path(website_id)) else "setup_required"
             }
             for website_id, config in WEBSITE_CONFIGS.items()
             if website_id != 'default'
         }
     })
 
+@app.route("/api/websites", methods=["POST"])
+def add_website():
+    """Add a new website configuration"""
+    try:
+        data = request.json or {}
+        website_id = data.get('website_id')
+        name = data.get('name')
+        bot_name = data.get('bot_name')
+        
+        if not all([website_id, name, bot_name]):
+            return jsonify({"error": "Missing required fields"}), 400
+        
+        if website_id in WEBSITE_CONFIGS:
+            return jsonify({"error": "Website ID already exists"}), 400
+        
+        allowed_origins = data.get('allowed_origins', [])
+        if isinstance(allowed_origins, str):
+            allowed_origins = [origin.strip() for origin in allowed_origins.split(',') if origin.strip()]
+        
+        WEBSITE_CONFIGS.upsert(website_id, {
+            'name': name,
+            'bot_name': bot_name,
+            'primary_color': data.get('primary_color', '#667eea'),
+            'knowledge_base': website_id,
+            'allowed_origins': allowed_origins,
+            'custom_prompt': None,
+            'features': ['basic_support']
+        })
+        
+        # Create directories for website
+        for category in FILE_CATEGORIES.keys():
+            os.makedirs(f"uploads/{website_id}/{category}", exist_ok=True)
+        
+        return jsonify({"message": f"Website {name} added successfully"})
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/websites/<website_id>", methods=["PUT"])
+def update_website(website_id):
+    """Update fields of a website configuration"""
+    try:
+        if website_id not in WEBSITE_CONFIGS:
+            return jsonify({"error": "Website not found"}), 404
+        data = request.json or {}
+        changes = {key: value for key, value in data.items() if key != 'website_id'}
+        changed = WEBSITE_CONFIGS.update(website_id, **changes)
+        return jsonify({"message": f"Website {website_id} updated", "changed": bool(changed)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/websites/<website_id>", methods=["DELETE"])
+def delete_website(website_id):
+    """Remove a website configuration (its knowledge base and uploads are kept)"""
+    if website_id == 'default':
+        return jsonify({"error": "The default website cannot be removed"}), 400
+    if website_id not in WEBSITE_CONFIGS:
+        return jsonify({"error": "Website not found"}), 404
+    WEBSITE_CONFIGS.delete(website_id)
+    return jsonify({"message": f"Website {website_id} removed"})
+
 # ================================
 # 📦 ENHANCED CHAT ENDPOINT
 # ================================
 
+def generate_chat_reply(trace, callbacks, llm, provider, website_config, user_input, name=None):
+    """Retrieval + LLM generation for one chat question.
+
+    The visitor's name only goes into the prompt's dynamic tail, after the
+    cached prefix and the context; it is part of the single_flight key.
+    """
+    # Retrieve with the question alone; persona and instructions only go into the prompt.
+    # Topic keywords (pricing, policies, ...) prefer documents uploaded under matching categories
+    categories = determine_query_categories(user_input)
+    if categories:
+        candidates = retriever.invoke(user_input, config={"callbacks": callbacks}, k=CATEGORY_CANDIDATES)
+        docs = sorted(candidates, key=lambda doc: doc.metadata.get('category', 'company_details') not in categories)
+        docs = docs[:retriever.search_kwargs["k"]]
+        trace.set(categories=",".join(categories))
+    else:
+        docs = retriever.invoke(user_input, config={"callbacks": callbacks})
+    
+    # Static prefix (persona + instructions) first, then context, then the question
+    with trace.span("prompt_build"):
+        layout = prompt_layout.layout_for(website_config.get('custom_prompt') or template_text,
+                                          website_config.get('bot_name', 'Assistant'),
+                                          website_config.get('name', 'Website'))
+        context = "\n\n".join(doc.page_content for doc in docs)
+        full_prompt = layout.render(context, user_input, name)
+    trace.set(prompt_prefix_chars=len(layout.prefix))
+    
+    if provider == "mock":
+        with trace.span("llm"):
+            reply = llm.invoke(full_prompt)
+    elif hasattr(llm, 'invoke'):
+        reply = llm.invoke(full_prompt, config={"callbacks": callbacks})
+        reply = getattr(reply, "content", reply)
+    else:
+        reply = f"Mock response for: {user_input}<br><br>What else would you like to know?"
+    return reply.strip().replace("\n", "<br>")
+
 @app.route("/chat", methods=["POST"])
 def chat_multi():
+    trace = tracing.start_trace("chat")
+    started = time.perf_counter()
     try:
         data = request.json
         user_input = data.get("message")
         user_id = data.get("user_id", "anon")
-        name = data.get("name", "visitor")
+        name = (data.get("name") or "").strip() or None
         
         # Get website configuration
-        website_id, website_config = get_website_config(request)
+        with trace.span("resolve_website"):
+            website_id, website_config = get_website_config(request)
+        trace.set(website_id=website_id)
         
         if not user_input:
+            trace.status = "bad_request"
             return jsonify({"error": "No message provided"}), 400
 
+        # Rate limits and load shedding: answer 429 right away instead of queueing for the LLM.
+        # Every request spends its visitor's token; only generations take a slot (see below)
+        rate_limits = website_config.get("rate_limits")
+        admission = rate_limit.limiter.admit_visitor(website_id, user_id, rate_limits)
+        if not admission.allowed:
+            return rate_limited(trace, admission)
+
         # Get website-specific LLM and QA chain
-        llm, provider = get_llm_for_website(website_id)
-        qa_chain = get_qa_chain_for_website(website_id)
+        with trace.span("llm_setup"):
+            llm, provider = get_llm_for_website(website_id)
+            effective_config = get_effective_llm_config(website_id)
+        trace.set(provider=provider, model=effective_config.get("model") if provider != "mock" else "mock-llm")
+        callbacks = [tracing.TraceCallbackHandler(trace)]
         
-        # Use custom prompt if available
+        # Identical questions in flight for the same knowledge base and prompt share one generation
         bot_name = website_config.get('bot_name', 'Assistant')
         website_name = website_config.get('name', 'Website')
-        
-        enhanced_query = (
-            f"You are {bot_name}, a friendly assistant at {website_name}. "
-            f"You are helping a user named {name}. "
-            f"Always answer in raw HTML (e.g., <br>, <ul>), no Markdown. "
-            f"Always end your message with a helpful follow-up question. "
-            f"Question: {user_input}"
-        )
+        flight_key = single_flight.flight_key(
+            website_id, user_input, knowledge_base.current().path,
+            single_flight.prompt_version(bot_name, website_name, website_config.get('custom_prompt') or template_text,
+                                         provider, effective_config.get("model"), effective_config.get("temperature"),
+                                         name))
+
+        def generate(emit):
+            # Only the flight's leader counts against max_concurrent; requests joining it wait for free
+            generation = rate_limit.limiter.admit_generation(website_id, rate_limits)
+            if not generation.allowed:
+                raise rate_limit.Rejected(generation)
+            try:
+                return generate_chat_reply(trace, callbacks, llm, provider, website_config, user_input, name)
+            finally:
+                generation.release()
 
-        # Use the QA chain to get response
-        if qa_chain and hasattr(llm, 'invoke'):
-            # For proper LangChain LLMs with QA chain
-            response = qa_chain.invoke({"query": enhanced_query})
-            reply = response["result"].strip().replace("\n", "<br>")
-        else:
-            # For mock LLM or when QA chain failed - manual RAG
-            docs = retriever.get_relevant_documents(user_input)
-            context = "\n\n".join(doc.page_content for doc in docs)
-            
-            # Use custom prompt if available
-            prompt_template = website_config.get('custom_prompt', template_text)
-            full_prompt = prompt_template.format(context=context, question=user_input)
-            full_prompt += f"\n\nYou are {bot_name} helping {name}. Always end with a follow-up question."
-            
-            if hasattr(llm, 'invoke'):
-                reply = llm.invoke(full_prompt)
-            else:
-                reply = f"Mock response for: {user_input}<br><br>What else would you like to know?"
+        # /chat answers in one piece, so its generations emit no chunks
+        try:
+            reply, coalesced = single_flight.group.do(flight_key, generate)
+        except rate_limit.Rejected as e:
+            return rate_limited(trace, e.admission)
+        trace.set(coalesced=coalesced)
         
         # Log the conversation with website context
-        log_chat(user_id, user_input, "user", website_id)
-        log_chat(user_id, reply, "bot", website_id)
+        with trace.span("log_chat"):
+            log_chat(user_id, user_input, "user", website_id)
+            log_chat(user_id, reply, "bot", website_id, latency=time.perf_counter() - started)
+            log_conversation_turn(user_id, user_input, reply)
         
         return jsonify({"response": reply, "website_id": website_id})
 
     except Exception as e:
+        trace.status = "error"
         print(f"Chat error: {e}")
         return jsonify({"response": "Sorry, I ran into an error. Please try again."}), 500
 
+    finally:
+        tracing.end_trace()
+
+def rate_limited(trace, admission):
+    """429 response for a chat that rate limiting or load shedding turned away"""
+    trace.status = "rate_limited"
+    trace.set(rejected=admission.reason)
+    return jsonify({
+        "error": "Too many requests, please try again shortly.",
+        "reason": admission.reason,
+        "retry_after": admission.retry_after_header,
+    }), 429, {"Retry-After": admission.retry_after_header}
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint for chat latency, stage timings and token counts"""
+    return tracing.registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 # ================================
 # 📁 FILE MANAGEMENT ENDPOINTS
 # ================================
@@ -2408,7 +2621,10 @@ def upload_file_multi():
         os.makedirs(category_dir, exist_ok=True)
         
         filepath = os.path.join(category_dir, filename)
+        is_new_file = not os.path.exists(filepath)
         file.save(filepath)
+        if is_new_file:
+            rollups.engine.adjust_gauge(website_id, "files", 1)
         
         # Process file for website-specific knowledge base
         success = process_file_for_website(filepath, filename, category, website_id)
@@ -2455,32 +2671,20 @@ def process_file_for_website(filepath, filename, category, website_id):
                 'website_id': website_id
             })
         
-        # Add to website-specific vectorstore
-        website_vectorstore = get_website_vectorstore(website_id)
-        website_vectorstore.add_documents(chunks)
-        website_vectorstore.persist()
-        
-        # Also add to global vectorstore for backward compatibility
-        global vectorstore, retriever
-        existing_docs = []
-        try:
-            existing_docs = retriever.get_relevant_documents("", k=1000)
-        except:
-            pass
-        
-        all_docs = existing_docs + chunks
-        
-        vectorstore = Chroma.from_documents(
-            all_docs,
-            embedding=embeddings,
-            persist_directory="./chroma_db"
+        # Add to website-specific vectorstore; an index rebuild in progress finishes first
+        with vector_index.write_lock(vector_index.website_base_path(website_id)):
+            website_vectorstore = get_website_vectorstore(website_id)
+            website_vectorstore.add_documents(chunks)
+            website_vectorstore.persist()
+        rollups.engine.adjust_gauge(website_id, "documents", len(chunks))
+        numpy_store.maybe_promote(
+            website_vectorstore,
+            vector_index.website_base_path(website_id),
+            vector_index.collection_metadata(vector_index.get_index_settings(website_id))
         )
-        vectorstore.persist()
         
-        # Update retriever and clear QA chains to force reload
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-        global qa_chains
-        qa_chains.clear()
+        # Also add to global vectorstore for backward compatibility (appended in place)
+        knowledge_base.append(chunks)
         
         return True
         
@@ -2533,29 +2737,8 @@ def process_url(url, max_pages=10, website_id='default'):
             chunk.metadata['crawl_time'] = datetime.now().isoformat()
             chunk.metadata['website_id'] = website_id
         
-        # Add to vector store
-        global vectorstore, retriever
-        
-        # Get existing documents
-        existing_docs = []
-        try:
-            existing_docs = retriever.get_relevant_documents("", k=1000)
-        except:
-            pass
-        
-        all_docs = existing_docs + chunks
-        
-        vectorstore = Chroma.from_documents(
-            all_docs,
-            embedding=embeddings,
-            persist_directory="./chroma_db"
-        )
-        vectorstore.persist()
-        
-        # Update retriever and QA chain
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-        global qa_chains
-        qa_chains.clear()
+        # Append to the active knowledge base version; only the new chunks are embedded
+        knowledge_base.append(chunks)
         
         return True
         
@@ -2589,23 +2772,15 @@ def manage_prompt():
 
 def update_prompt(new_prompt):
     try:
-        global template_text, prompt
+        global template_text
         
         template_text = new_prompt
-        prompt = PromptTemplate(
-            input_variables=["context", "question"],
-            template=template_text,
-        )
         
         # Save prompt to file
         os.makedirs("config", exist_ok=True)
         with open("config/prompt.txt", "w", encoding="utf-8") as f:
             f.write(new_prompt)
         
-        # Clear QA chains to force recreation with new prompt
-        global qa_chains
-        qa_chains.clear()
-        
         return True
         
     except Exception as e:
@@ -2623,8 +2798,7 @@ def knowledge_stats():
         
         # Get vector store statistics
         try:
-            test_docs = retriever.get_relevant_documents("test", k=10000)
-            doc_count = len(test_docs)
+            doc_count = knowledge_base.count()
             db_status = "active"
         except Exception as e:
             print(f"Vector DB test failed: {e}")
@@ -2659,7 +2833,7 @@ def knowledge_stats():
             "website_id": website_id,
             "total_documents": max(0, doc_count),
             "vector_store_status": db_status,
-            "vector_store_path": "./chroma_db",
+            "vector_store_path": knowledge_base.current().path,
             "embedding_model": "sentence-transformers/all-MiniLM-L6-v2",
             "llm_provider": effective_config["provider"],
             "llm_model": effective_config["model"],
@@ -2679,6 +2853,145 @@ def knowledge_stats():
             "error": str(e)
         })
 
+@app.route("/api/website/<website_id>/index", methods=["GET"])
+def get_website_index(website_id):
+    """Active index directory and HNSW settings for a website"""
+    base_path = vector_index.website_base_path(website_id)
+    settings = vector_index.get_index_settings(website_id)
+    return jsonify({
+        "website_id": website_id,
+        "active_path": vector_index.resolve_index_path(base_path),
+        "settings": settings,
+        "live_settings": vector_index.live_settings(base_path),
+        # Saved settings the live index was not built with; applied by the nightly rebuild
+        "pending_rebuild": vector_index.pending_settings(base_path, settings),
+        "versions": vector_index.index_versions(base_path)
+    })
+
+@app.route("/api/website/<website_id>/index", methods=["POST"])
+def rebuild_website_index(website_id):
+    """Rebuild a website's index with new HNSW settings, or report the recall/latency tradeoff"""
+    try:
+        data = request.json or {}
+        base_path = vector_index.website_base_path(website_id)
+        overrides = {key: data[key] for key in vector_index.DEFAULT_INDEX_SETTINGS if key in data}
+
+        if data.get("action") == "report":
+            candidates = [overrides] if overrides else vector_index.REPORT_CANDIDATES
+            k = int(data.get("k", vector_index.REPORT_K))
+            return jsonify(vector_index.evaluate_settings(base_path, candidates, k=k))
+
+        settings = vector_index.get_index_settings(website_id)
+        settings.update(overrides)
+        result = vector_index.rebuild_index(base_path, settings)
+        vector_index.save_index_settings(website_id, settings)
+        return jsonify({"message": f"Index rebuilt for {website_id}", **result})
+
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def analytics_summary(website_id=None):
+    """Aggregate from the Parquet store (the scheduler compacts new chat log rows every few minutes)"""
+    try:
+        days = int(request.args.get("days", 30))
+        top_n = int(request.args.get("top", 10))
+        return jsonify(analytics_store.summarize(website_id, days=days, top_n=top_n))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Analytics error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/analytics_data", methods=["GET"])
+def analytics_data():
+    """Hourly sales-intent rate for the analytics chart, served from the rollups"""
+    website_id = request.args.get("website_id")
+    series = rollups.engine.series(website_id, "hour", limit=int(request.args.get("hours", 168)))
+    return jsonify({
+        "timestamps": [bucket["period"] for bucket in series],
+        "sales_flags": [bucket["sales_intent_rate"] for bucket in series],
+        "messages": [bucket["messages"] for bucket in series],
+    })
+
+def website_gauge(website_id, name, compute):
+    """Gauge from the rollups, computed once and seeded when it is not known yet"""
+    value = rollups.engine.gauge(website_id, name)
+    if value is None:
+        value = compute()
+        rollups.engine.set_gauge(website_id, name, value)
+    return value
+
+def count_website_documents(website_id):
+    numpy_path = numpy_store.website_store_path(website_id)
+    if numpy_store.store_exists(numpy_path):
+        return numpy_store.open_store(numpy_path, embeddings).count
+    chroma_path = vector_index.resolve_index_path(vector_index.website_base_path(website_id))
+    if not os.path.exists(chroma_path):
+        return 0
+    return get_website_vectorstore(website_id)._collection.count()
+
+def count_website_files(website_id):
+    upload_folder = f"uploads/{website_id}"
+    return sum(len(files) for _, _, files in os.walk(upload_folder))
+
+@app.route("/api/website/<website_id>/stats", methods=["GET"])
+def website_stats(website_id):
+    """Pre-aggregated counters for the dashboard; no log scans or vector store queries"""
+    try:
+        days = int(request.args.get("days", 1))
+        return jsonify({
+            "website_id": website_id,
+            "documents": website_gauge(website_id, "documents", lambda: count_website_documents(website_id)),
+            "files": website_gauge(website_id, "files", lambda: count_website_files(website_id)),
+            "totals": rollups.engine.totals(website_id, days=days),
+            "hourly": rollups.engine.series(website_id, "hour", limit=24),
+            "daily": rollups.engine.series(website_id, "day", limit=30)
+        })
+    except Exception as e:
+        print(f"❌ Website stats error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/tree_diagram", methods=["GET"])
+def tree_diagram():
+    """Recent conversation trees grouped by topic"""
+    grouped_by_topic = tree_store.topic_forest(request.args.get("topic"), limit=int(request.args.get("limit", 50)))
+    return render_template("tree_diagram.html", grouped_by_topic=grouped_by_topic)
+
+@app.route("/api/conversations/<convo_id>/tree", methods=["GET"])
+def conversation_tree(convo_id):
+    """A whole conversation, or the subtree below ?node_id=, as nested nodes"""
+    try:
+        node_id = request.args.get("node_id", type=int)
+        return jsonify({"convo_id": convo_id, "node_id": node_id, "tree": tree_store.subtree(convo_id, node_id)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/conversation-branches", methods=["GET"])
+def conversation_branches():
+    """Drop-off and sales conversion per conversation branch"""
+    try:
+        return jsonify({"branches": tree_store.branch_stats(
+            topic=request.args.get("topic"),
+            max_depth=request.args.get("max_depth", type=int),
+            limit=request.args.get("limit", 200, type=int)
+        )})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/analytics", methods=["GET"])
+def all_website_analytics():
+    """Daily counts, unique users, top queries and sales-flag rate across websites"""
+    return analytics_summary()
+
+@app.route("/api/website/<website_id>/analytics", methods=["GET"])
+def website_analytics(website_id):
+    """Daily counts, unique users, top queries and sales-flag rate for one website"""
+    if website_id not in WEBSITE_CONFIGS:
+        return jsonify({"error": "Website not found"}), 404
+    return analytics_summary(website_id)
+
 @app.route("/api/categories", methods=["GET"])
 def get_categories():
     """Get available file categories"""
@@ -2727,32 +3040,30 @@ def bulk_website_operations():
         return jsonify({"error": str(e)}), 500
 
 def create_website_backup(website_id):
-    """Create backup for specific website"""
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_dir = f"backups/{website_id}_backup_{timestamp}"
-    os.makedirs(backup_dir, exist_ok=True)
-    
-    # Backup website-specific files and knowledge base
+    """Create an incremental snapshot for a specific website; returns the manifest path"""
+    # Backup website-specific files, knowledge base and prompt
     try:
-        upload_dir = f"uploads/{website_id}"
-        if os.path.exists(upload_dir):
-            shutil.copytree(upload_dir, f"{backup_dir}/uploads")
-        
-        kb_path = get_knowledge_base_path(website_id)
-        if os.path.exists(kb_path):
-            shutil.copytree(kb_path, f"{backup_dir}/knowledge_base")
-        
-        return backup_dir
+        numpy_path = numpy_store.website_store_path(website_id)
+        manifest = snapshots.default_store.create_snapshot({
+            "knowledge_base": get_knowledge_base_path(website_id),
+            "numpy_knowledge_base": numpy_path if numpy_store.store_exists(numpy_path) else None,
+            "uploads": f"uploads/{website_id}",
+            "prompt.txt": "config/prompt.txt"
+        }, scope=website_id, label="website")
+        
+        return snapshots.default_store.manifest_path(manifest["id"])
     except Exception as e:
         print(f"Backup error for {website_id}: {e}")
         raise e
 
 def reset_website_knowledge(website_id):
     """Reset knowledge base for a specific website"""
-    # Clear website-specific knowledge base
-    kb_path = get_knowledge_base_path(website_id)
-    if os.path.exists(kb_path):
-        shutil.rmtree(kb_path)
+    # Clear website-specific knowledge base, including rebuilt index versions
+    vector_index.drop_index(vector_index.website_base_path(website_id))
+    numpy_path = numpy_store.website_store_path(website_id)
+    if os.path.exists(numpy_path):
+        shutil.rmtree(numpy_path)
+    numpy_store.forget_store(numpy_path)
     
     # Clear website-specific uploads
     upload_path = f"uploads/{website_id}"
@@ -2762,8 +3073,7 @@ def reset_website_knowledge(website_id):
     # Clear from cache
     if website_id in llm_instances:
         del llm_instances[website_id]
-    if website_id in qa_chains:
-        del qa_chains[website_id]
+    rollups.engine.drop_gauges(website_id)
 
 @app.route("/api/refresh-session", methods=["POST"])
 def refresh_chat_session():
@@ -2784,23 +3094,19 @@ def reset_knowledge_base():
     try:
         print("🔥 Starting knowledge base reset...")
         
-        # 1. FORCE CLOSE ANY VECTOR STORE CONNECTIONS
-        global vectorstore, retriever, qa_chain, qa_chains, llm_instances
+        # 1. PUBLISH AN EMPTY KNOWLEDGE BASE VERSION (in-flight chats finish on the old one)
+        global llm_instances
         try:
-            vectorstore = None
-            retriever = None  
-            qa_chain = None
-            qa_chains.clear()
-            llm_instances.clear()
-            print("✅ Vector store connections closed")
-        except:
-            pass
-        
-        # 2. NUCLEAR DELETE OF ALL POSSIBLE VECTOR DB LOCATIONS
+            knowledge_base.reset()
+            print("✅ Empty knowledge base version published")
+        except Exception as vs_error:
+            print(f"❌ Vector store creation error: {vs_error}")
+            return handle_vector_store_corruption()
+        llm_instances.clear()
+        
+        # 2. DELETE OTHER VECTOR DB LOCATIONS (./chroma_db versions are garbage-collected)
         possible_db_paths = [
-            "./chroma_db",
             "./db", 
-            "chroma_db",
             "db",
             "./ollama_rag_chatbot/chroma_db",
             "./ollama_rag_chatbot/db"
@@ -2832,51 +3138,18 @@ def reset_knowledge_base():
                 except Exception as e:
                     print(f"❌ Failed to delete {upload_path}: {e}")
         
-        # 4. WAIT FOR FILE SYSTEM TO CATCH UP
-        time.sleep(2)
-        
-        # 5. RECREATE DIRECTORIES
-        os.makedirs("./chroma_db", exist_ok=True)
+        # 4. RECREATE DIRECTORIES
         os.makedirs(app.config.get('UPLOAD_FOLDER', 'uploads'), exist_ok=True)
         print("✅ Directories recreated")
         
-        # 6. FORCE CREATE NEW VECTOR STORE WITH ERROR HANDLING
-        try:
-            # Import here to avoid any cached references
-            from langchain_community.vectorstores import Chroma
-            
-            print("🔄 Creating new vector store...")
-            
-            # Create completely fresh vector store
-            vectorstore = Chroma(
-                persist_directory="./chroma_db",
-                embedding_function=embeddings
-            )
-            
-            # Test that it works by adding and removing a dummy document
-            test_texts = ["test document for verification"]
-            test_ids = vectorstore.add_texts(test_texts, ids=["test_id"])
-            vectorstore.delete(ids=["test_id"])
-            
-            print("✅ New vector store created and tested successfully")
-            
-            # Verify it's empty
-            test_docs = vectorstore.similarity_search("test", k=10)
-            doc_count = len(test_docs)
-            print(f"📊 Vector store verification: {doc_count} documents")
-            
-            # Recreate retriever and QA chain
-            retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-            update_qa_chain()
-            
-            return jsonify({
-                "status": "success",
-                "message": f"Knowledge base reset successfully! Vector store recreated with {doc_count} documents."
-            })
-            
-        except Exception as vs_error:
-            print(f"❌ Vector store creation error: {vs_error}")
-            return handle_vector_store_corruption()
+        # 5. VERIFY THE NEW KNOWLEDGE BASE
+        doc_count = knowledge_base.count()
+        print(f"📊 Vector store verification: {doc_count} documents")
+        
+        return jsonify({
+            "status": "success",
+            "message": f"Knowledge base reset successfully! Vector store recreated with {doc_count} documents."
+        })
             
     except Exception as e:
         print(f"❌ Knowledge reset error: {e}")
@@ -2892,29 +3165,13 @@ def handle_vector_store_corruption():
     try:
         print("🚨 Handling vector store corruption...")
         
-        # More aggressive cleanup
-        import subprocess
-        try:
-            # Try to force delete on Windows/Linux
-            if os.name == 'nt':  # Windows
-                subprocess.run(['rmdir', '/s', '/q', 'chroma_db'], shell=True, check=False)
-            else:  # Unix-like
-                subprocess.run(['rm', '-rf', 'chroma_db'], check=False)
-        except:
-            pass
-        
-        # Wait longer
-        time.sleep(5)
-        
-        # Try creating vector store again
-        os.makedirs("./chroma_db", exist_ok=True)
-        
-        global vectorstore, retriever
-        vectorstore = Chroma(
-            persist_directory="./chroma_db",
-            embedding_function=embeddings
-        )
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+        # Start over from a fresh knowledge base object; the broken version is left for inspection
+        global knowledge_base
+        fresh_path = f"./chroma_db{vector_index.VERSION_MARKER}{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        os.makedirs(fresh_path, exist_ok=True)
+        vector_index.switch_index("./chroma_db", fresh_path)
+        knowledge_base = VersionedKnowledgeBase("./chroma_db", embeddings)
+        retriever.knowledge_base = knowledge_base
         
         return jsonify({
             "status": "success",
@@ -2959,6 +3216,8 @@ def clear_chat_logs():
         # Also clear CSV logs if they exist
         if os.path.exists("logs/chat_logs.csv"):
             os.remove("logs/chat_logs.csv")
+        analytics_store.clear()
+        rollups.engine.clear()
         
         return jsonify({
             "status": "success",
@@ -2976,48 +3235,40 @@ def clear_chat_logs():
 def backup_knowledge():
     """Create a backup before reset"""
     try:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_dir = f"backups/backup_{timestamp}"
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        backup_results = {}
-        
-        # 1. Backup vector database
-        try:
-            if os.path.exists("./chroma_db"):
-                shutil.copytree("./chroma_db", f"{backup_dir}/chroma_db")
-                backup_results["vectors"] = "✅ Vector database backed up"
-        except Exception as e:
-            backup_results["vectors"] = f"❌ Error backing up vectors: {str(e)}"
-        
-        # 2. Backup uploaded files
-        try:
-            if os.path.exists(app.config['UPLOAD_FOLDER']):
-                shutil.copytree(app.config['UPLOAD_FOLDER'], f"{backup_dir}/uploads")
-                backup_results["files"] = "✅ Files backed up"
-        except Exception as e:
-            backup_results["files"] = f"❌ Error backing up files: {str(e)}"
-        
-        # 3. Backup configuration
-        try:
-            if os.path.exists("config"):
-                shutil.copytree("config", f"{backup_dir}/config")
-                backup_results["config"] = "✅ Config backed up"
-        except Exception as e:
-            backup_results["config"] = f"❌ Error backing up config: {str(e)}"
-        
-        # 4. Backup logs
-        try:
-            if os.path.exists("logs"):
-                shutil.copytree("logs", f"{backup_dir}/logs")
-                backup_results["logs"] = "✅ Logs backed up"
-        except Exception as e:
-            backup_results["logs"] = f"❌ Error backing up logs: {str(e)}"
+        # Incremental snapshot: only files changed since the last backup are copied.
+        # Every website's knowledge base goes in too, so a restore keeps vectors and uploads in line
+        website_ids = sorted(WEBSITE_CONFIGS.keys())
+        sources = {}
+        for website_id in website_ids:
+            numpy_path = numpy_store.website_store_path(website_id)
+            sources[f"websites/{website_id}/knowledge_base"] = get_knowledge_base_path(website_id)
+            sources[f"websites/{website_id}/numpy_knowledge_base"] = (
+                numpy_path if numpy_store.store_exists(numpy_path) else None)
+        with knowledge_base.lease() as version:
+            manifest = snapshots.default_store.create_snapshot({
+                "chroma_db": version.path,
+                "uploads": app.config['UPLOAD_FOLDER'],
+                "config": "config",
+                "logs": "logs",
+                **sources
+            }, scope="global", label=(request.get_json(silent=True) or {}).get("label", "manual"),
+                meta={"websites": website_ids})
+        
+        backup_path = snapshots.default_store.manifest_path(manifest["id"])
+        stats = manifest["stats"]
+        backup_results = {
+            prefix: f"✅ {sum(1 for path in manifest['entries'] if path.startswith(prefix + '/'))} files"
+            for prefix in manifest["sources"] if not prefix.startswith("websites/")
+        }
         
         return jsonify({
             "status": "success",
-            "message": f"Backup created at {backup_dir}",
-            "backup_path": backup_dir,
+            "message": f"Backup {manifest['id']} created: {stats['files']} files, "
+                       f"{stats['new_blobs']} changed ({stats['bytes_written']} bytes written)",
+            "backup_id": manifest["id"],
+            "backup_path": backup_path,
+            "backup_location": backup_path,
+            "stats": stats,
             "details": backup_results
         })
         
@@ -3027,6 +3278,72 @@ def backup_knowledge():
             "message": f"Backup failed: {str(e)}"
         }), 500
 
+@app.route("/api/list-backups", methods=["GET"])
+def list_backups():
+    """List snapshot backups, newest first (optionally for one website)"""
+    try:
+        scope = request.args.get('website_id')
+        backups = [{
+            "name": f"{summary['id']} ({summary.get('label') or summary['scope']})",
+            "id": summary["id"],
+            "path": summary["id"],
+            "scope": summary["scope"],
+            "created": datetime.fromisoformat(summary["created_at"]).strftime("%Y-%m-%d %H:%M:%S"),
+            "size": summary["stats"]["bytes_total"],
+            "files": summary["stats"]["files"]
+        } for summary in snapshots.default_store.list_manifests(scope)]
+        
+        return jsonify({"backups": backups})
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/restore-knowledge", methods=["POST"])
+def restore_knowledge():
+    """Restore from a snapshot; with website_id only that website is restored"""
+    try:
+        data = request.json or {}
+        snapshot_id = os.path.basename(data.get("backup_path") or data.get("backup_id") or "")
+        if snapshot_id.endswith(".json"):
+            snapshot_id = snapshot_id[:-5]
+        if not snapshot_id or not os.path.exists(snapshots.default_store.manifest_path(snapshot_id)):
+            return jsonify({"error": "Invalid backup path"}), 400
+        
+        website_id = data.get("website_id")
+        scope = snapshots.default_store.load_manifest(snapshot_id).get("scope")
+        if not website_id and scope != "global":
+            # A website snapshot can only be restored into its own website
+            website_id = scope
+        restore_prompt = data.get("restore_prompt", True)
+        if website_id:
+            result = restore.restore_website(snapshot_id, website_id, restore_prompt=restore_prompt)
+            rollups.engine.drop_gauges(website_id)
+        else:
+            result = restore.restore_global(snapshot_id, knowledge_base,
+                                            upload_folder=app.config['UPLOAD_FOLDER'],
+                                            restore_prompt=restore_prompt,
+                                            website_ids=list(WEBSITE_CONFIGS.keys()))
+            for restored_id in result.get("websites", {}):
+                rollups.engine.drop_gauges(restored_id)
+        
+        # Restored prompt goes live through the normal update path (clears cached chains)
+        restored_prompt = result.pop("prompt", None)
+        if restored_prompt is not None and restored_prompt != template_text:
+            update_prompt(restored_prompt)
+            result["prompt"] = "✅ Prompt restored"
+        
+        return jsonify({
+            "status": "success",
+            "message": f"Restored {website_id or 'knowledge base'} from {snapshot_id}",
+            "details": result
+        })
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"❌ Restore error: {e}")
+        return jsonify({"error": str(e)}), 500
+
 # ================================
 # 📄 TEMPLATE & LEGACY ENDPOINTS
 # ================================
@@ -3053,18 +3370,8 @@ def update_faq():
         splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
         chunks = splitter.split_documents(documents)
 
-        # Update the vector store
-        global vectorstore, retriever, qa_chains
-        vectorstore = Chroma.from_documents(
-            chunks, 
-            embedding=embeddings, 
-            persist_directory="./chroma_db"
-        )
-        vectorstore.persist()
-        
-        # Update retriever and clear QA chains
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-        qa_chains.clear()  # Force recreation with new data
+        # Publish a new version with the old FAQ chunks replaced
+        knowledge_base.publish(chunks, drop_sources={faq_file})
         
         return jsonify({"status": "FAQ updated successfully"})
     except Exception as e:
@@ -3093,23 +3400,34 @@ def health_check():
 # 💬 ENHANCED CHAT LOGGING
 # ================================
 
-def log_chat(user_id, message, sender, website_id=None):
+def log_chat(user_id, message, sender, website_id=None, latency=None):
     try:
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        # Escape commas and quotes in message for CSV safety
-        clean_message = message.replace('"', '""').replace('\n', ' ').replace('\r', ' ')
-        log_entry = f'"{now}","{user_id}","{sender}","{website_id or "default"}","{clean_message}"\n'
+        # One line per turn; analytics_store compacts complete lines only
+        clean_message = message.replace('\n', ' ').replace('\r', ' ')
         
         # Create logs directory if it doesn't exist
         os.makedirs("logs", exist_ok=True)
         
-        with open("logs/chat_logs.csv", "a", encoding="utf-8") as f:
-            f.write(log_entry)
+        with open(analytics_store.CHAT_LOG_PATH, "a", encoding="utf-8", newline="") as f:
+            csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n").writerow(
+                [now, user_id, sender, website_id or "default", clean_message])
+            
+        # Keyword intent for user turns feeds the rollups and the database row. It is a guess,
+        # so it only goes to matched_intent; intent and sales_flag stay NULL (unlabeled) and are
+        # reserved for labels the classifier trains on
+        matched_intent, sales_flag = None, None
+        match_intents = analytics_store.load_intent_matcher() if sender == "user" else None
+        if match_intents is not None:
+            intents = match_intents(message)
+            matched_intent = intents[0] if intents else None
+            sales_flag = 1 if intents else 0
+        rollups.engine.record_turn(website_id, user_id, sender, sales_flag=sales_flag, latency=latency)
             
         # Also log to database if available
         try:
             from db_model import log_chat as db_log_chat
-            db_log_chat(user_id, message, sender)
+            db_log_chat(user_id, message, sender, matched_intent=matched_intent, website_id=website_id)
         except ImportError:
             pass  # DB logging not available
         except Exception as e:
@@ -3118,6 +3436,25 @@ def log_chat(user_id, message, sender, website_id=None):
     except Exception as e:
         print(f"Logging error: {e}")
 
+def log_conversation_turn(user_id, user_input, reply):
+    """Append the user message and bot reply to the user's conversation tree in one batch"""
+    try:
+        intents = []
+        match_intents = analytics_store.load_intent_matcher()
+        if match_intents is not None:
+            intents = match_intents(user_input)
+        topics = query_category_matcher.match(user_input)
+        topic = topics[0] if topics else "general"
+        tree_store.append_turn(user_id, [
+            {"message": user_input, "sender": "user", "topic": topic,
+             "intent": intents[0] if intents else None, "sales_flag": bool(intents)},
+            {"message": reply, "sender": "bot", "topic": topic},
+        ])
+    except Exception as e:
+        print(f"❌ Conversation tree logging error for {user_id}: {e}")
+        import traceback
+        traceback.print_exc()
+
 # ================================
 # 🧪 INITIALIZATION & STARTUP
 # ================================
@@ -3146,9 +3483,6 @@ def initialize_application():
         effective_config = get_effective_llm_config()
         print(f"🤖 LLM Configuration: {effective_config['provider']} - {effective_config['model']}")
         
-        # Create default QA chain
-        update_qa_chain()
-        
         print("✅ Application initialization complete!")
         return True
         
@@ -3169,6 +3503,9 @@ if __name__ == "__main__":
     print(f"🔧 Configuration directory: ./config/")
     print(f"📦 Backup directory: ./backups/")
     
+    # Optional OTLP trace export (set OTEL_EXPORTER_OTLP_ENDPOINT)
+    tracing.configure_otlp()
+
     # Initialize application
     if initialize_application():
         print("🎉 Ready to serve requests!")
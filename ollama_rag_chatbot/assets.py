@@ -0,0 +1,189 @@
+"""Pre-rendered, pre-compressed widget assets.
+
+The embed bootstrap (/embed.js?website_id=...) and the widget page are
+rendered once per website and kept in memory together with gzip (and
+brotli, if installed) variants and a strong ETag. The bootstrap sets
+window.CHATBOT_CONFIG (API origin, website, theme) and loads the real widget
+code from a content-hashed URL under /assets/ that browsers and CDNs may
+cache forever, so repeat page views are answered from cache or with a 304.
+
+Call invalidate(website_id) when a website's configuration changes.
+"""
+import os
+import gzip
+import json
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+ASSET_URL_PREFIX = "/assets/"
+
+# Hashed URLs never change content; unhashed entry points are revalidated with their ETag
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+ENTRY_POINT_CACHE = "public, max-age=300, must-revalidate"
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 512
+
+
+class Asset:
+    """One rendered response body with its compressed variants and validators"""
+
+    def __init__(self, body, content_type, cache_control):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.etag = f'"{self.digest[:32]}"'
+        self.variants = {"identity": body}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body, quality=11)
+
+    @property
+    def short_hash(self):
+        return self.digest[:12]
+
+    def etag_for(self, encoding):
+        # Strong ETags must differ per representation
+        return self.etag if encoding == "identity" else f'"{self.digest[:32]}-{encoding}"'
+
+    def not_modified(self, if_none_match):
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return any(self.etag_for(encoding) in tags for encoding in self.variants)
+
+    def negotiate(self, accept_encoding):
+        """Best available encoding the client accepts"""
+        accepted = {}
+        for part in (accept_encoding or "").lower().split(","):
+            name, _, params = part.strip().partition(";")
+            quality = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            if name:
+                accepted[name] = quality
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return "identity"
+
+    def response(self, if_none_match=None, accept_encoding=None):
+        """(body, status, headers) for a Flask route"""
+        encoding = self.negotiate(accept_encoding)
+        headers = {
+            "Content-Type": self.content_type,
+            "Cache-Control": self.cache_control,
+            "ETag": self.etag_for(encoding),
+            "Vary": "Accept-Encoding",
+        }
+        if self.not_modified(if_none_match):
+            return b"", 304, headers
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        body = self.variants[encoding]
+        headers["Content-Length"] = str(len(body))
+        return body, 200, headers
+
+
+class AssetPipeline:
+    """Per-website rendered assets plus content-hashed static files, all held in memory"""
+
+    def __init__(self, static_folder=STATIC_FOLDER):
+        self.static_folder = static_folder
+        self._lock = threading.Lock()
+        self._hashed = {}      # "embed.<hash>.js" -> Asset
+        self._static = {}      # static filename -> hashed name
+        self._websites = {}    # website_id -> {"embed": Asset, "widget": Asset}
+
+    def hashed_asset(self, name):
+        """Asset behind an /assets/<name> URL, or None"""
+        return self._hashed.get(name)
+
+    def _add_hashed(self, asset, stem, extension):
+        name = f"{stem}.{asset.short_hash}.{extension}"
+        self._hashed[name] = asset
+        return name
+
+    def static_url(self, filename, content_type):
+        """Content-hashed URL path of a file from the static folder"""
+        with self._lock:
+            name = self._static.get(filename)
+            if name is None:
+                with open(os.path.join(self.static_folder, filename), "rb") as f:
+                    asset = Asset(f.read(), content_type, IMMUTABLE_CACHE)
+                stem, extension = filename.rsplit(".", 1)
+                name = self._static[filename] = self._add_hashed(asset, stem, extension)
+        return ASSET_URL_PREFIX + name
+
+    def website_assets(self, website_id, config, render_widget):
+        """Rendered assets of a website, built on first use after an invalidation"""
+        assets = self._websites.get(website_id)
+        if assets is None:
+            assets = self._build(website_id, config, render_widget)
+            with self._lock:
+                self._websites[website_id] = assets
+        return assets
+
+    def _build(self, website_id, config, render_widget):
+        script_url = self.static_url("embed.js", "application/javascript; charset=utf-8")
+
+        settings = {
+            "websiteId": website_id,
+            "botName": config.get("bot_name", "Assistant"),
+            "primaryColor": config.get("primary_color", "#667eea"),
+            "websiteName": config.get("name", "Website"),
+        }
+        # The API origin comes from this script's own URL, so one rendering serves every host
+        embed = f"""
+(function() {{
+    var current = document.currentScript;
+    var base = current && current.src ? new URL(current.src).origin : window.location.origin;
+    var config = {json.dumps(settings)};
+    config.apiBaseUrl = base;
+    window.CHATBOT_CONFIG = config;
+
+    // Load the main embed script
+    var script = document.createElement('script');
+    script.src = base + {json.dumps(script_url)};
+    script.defer = true;
+    document.head.appendChild(script);
+}})();
+"""
+        assets = {
+            "embed": Asset(embed, "application/javascript; charset=utf-8", ENTRY_POINT_CACHE),
+            "widget": Asset(render_widget(website_id, config), "text/html; charset=utf-8", ENTRY_POINT_CACHE),
+        }
+        logger.info(f"Rendered widget assets for {website_id}")
+        return assets
+
+    def invalidate(self, website_id=None):
+        """Drop rendered assets of one website (or all, which also re-reads the static files)"""
+        with self._lock:
+            if website_id is None:
+                self._websites.clear()
+                self._static.clear()
+                self._hashed.clear()
+            else:
+                # Website assets are not content-hashed, so nothing is left behind in _hashed
+                self._websites.pop(website_id, None)
+
+
+pipeline = AssetPipeline()
@@ -0,0 +1,325 @@
+"""End-to-end load test for /chat, /api/upload and /api/crawl.
+
+Boots the Flask app in-process against a stub OpenAI/Ollama server, replays
+conversation traces at fixed concurrency levels and writes the results as
+JSON so runs can be compared between commits:
+
+    python ollama_rag_chatbot/benchmark.py --concurrency 1 4 16 --requests 200
+    python ollama_rag_chatbot/benchmark.py --compare benchmarks/results/<previous>.json
+"""
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import resource
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from stub_llm import StubLLMServer
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+
+CONVO_TRACE = os.path.join(ROOT_DIR, "db", "convo.jsonl")
+CHAT_LOG_TRACE = os.path.join(ROOT_DIR, "logs", "chat_logs.csv")
+UPLOAD_SAMPLE = os.path.join(ROOT_DIR, "data", "faq.txt")
+
+# Latency percentiles reported per scenario
+PERCENTILES = (50, 95, 99)
+# Relative slowdown (p95 or req/s) that counts as a regression in --compare
+REGRESSION_THRESHOLD = 0.10
+
+
+# ================================
+# Conversation traces
+# ================================
+
+def load_sessions(max_sessions=None):
+    """Conversation sessions (lists of user messages) from the recorded traces"""
+    sessions = []
+
+    # Chat log turns grouped per visitor, in the order they were sent
+    if os.path.exists(CHAT_LOG_TRACE):
+        grouped = {}
+        with open(CHAT_LOG_TRACE, newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                if len(row) < 4:
+                    continue
+                user_id, sender, message = row[1], row[2], row[-1]
+                if sender == "user" and message.strip():
+                    grouped.setdefault(user_id, []).append(message.strip())
+        sessions.extend(grouped.values())
+
+    # Single-question sessions from the curated conversation set
+    if os.path.exists(CONVO_TRACE):
+        with open(CONVO_TRACE, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    question = json.loads(line).get("input", "").strip()
+                except ValueError:
+                    continue
+                if question:
+                    sessions.append([question])
+
+    if not sessions:
+        sessions = [["What services do you offer?"], ["Tell me about your pricing"]]
+    return sessions[:max_sessions] if max_sessions else sessions
+
+
+# ================================
+# Environment
+# ================================
+
+def prepare_workdir(workdir):
+    """Scratch copy of config and the vector store so benchmarks never touch live data"""
+    for name in ("config", "chroma_db", "data"):
+        src = os.path.join(ROOT_DIR, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, os.path.join(workdir, name), dirs_exist_ok=True)
+    # Saved provider settings would override the stub environment below
+    llm_config = os.path.join(workdir, "config", "llm_config.json")
+    if os.path.exists(llm_config):
+        os.remove(llm_config)
+    os.makedirs(os.path.join(workdir, "logs"), exist_ok=True)
+    return workdir
+
+
+def configure_stub_environment(stub, provider):
+    """Point every LLM client at the stub before the app is imported"""
+    os.environ["LLM_PROVIDER"] = provider
+    os.environ["OLLAMA_BASE_URL"] = stub.url
+    os.environ["OPENAI_API_KEY"] = "stub-key"
+    os.environ["OPENAI_BASE_URL"] = f"{stub.url}/v1"
+    os.environ["OPENAI_API_BASE"] = f"{stub.url}/v1"
+
+
+def boot_app():
+    """Import the Flask app and serve it on a local threaded server"""
+    from werkzeug.serving import make_server
+    import app as chatbot_app
+
+    server = make_server("127.0.0.1", 0, chatbot_app.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def memory_usage():
+    """Current and peak resident memory of this process (app + stub) in MB"""
+    usage = {"max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    usage["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return usage
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+# ================================
+# Scenarios
+# ================================
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def chat_requests(base_url, sessions, total):
+    """Requests replaying sessions round-robin; each session keeps its own user_id"""
+    requests_list = []
+    i = 0
+    while len(requests_list) < total:
+        session = sessions[i % len(sessions)]
+        user_id = f"bench_{i}"
+        for message in session:
+            if len(requests_list) >= total:
+                break
+            requests_list.append(("POST", f"{base_url}/chat", {"json": {
+                "message": message, "user_id": user_id, "name": "visitor", "website_id": "default"
+            }}))
+        i += 1
+    return requests_list
+
+
+def upload_requests(base_url, total):
+    with open(UPLOAD_SAMPLE, "rb") as f:
+        content = f.read()
+    return [("POST", f"{base_url}/api/upload", {
+        "files": {"file": (f"bench_{i}.txt", content, "text/plain")},
+        "data": {"category": "company_details", "website_id": "default"}
+    }) for i in range(total)]
+
+
+def crawl_requests(base_url, stub_url, total):
+    return [("POST", f"{base_url}/api/crawl", {"json": {
+        "url": f"{stub_url}/site/page-{i}", "max_pages": 1, "website_id": "default"
+    }}) for i in range(total)]
+
+
+def run_scenario(name, planned, concurrency):
+    """Fire planned requests with a fixed number of workers and summarize latency"""
+    import requests
+
+    local = threading.local()
+
+    def send(item):
+        method, url, kwargs = item
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=300, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, planned))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    summary = {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": errors,
+        "duration_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(results) / elapsed, 2) if elapsed else None,
+        "latency_ms": {f"p{pct}": round(percentile(latencies, pct) * 1000, 1) for pct in PERCENTILES},
+        "memory": memory_usage()
+    }
+    summary["latency_ms"]["mean"] = round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None
+    print(f"  {name:<7} c={concurrency:<3} {summary['requests_per_second']} req/s  "
+          f"p50={summary['latency_ms']['p50']}ms p95={summary['latency_ms']['p95']}ms "
+          f"p99={summary['latency_ms']['p99']}ms errors={errors}  rss={summary['memory'].get('rss_mb')}MB")
+    return summary
+
+
+# ================================
+# Comparison
+# ================================
+
+def compare(previous, current, threshold=REGRESSION_THRESHOLD):
+    """Print deltas against a previous result file; returns the number of regressions"""
+    before = {(r["scenario"], r["concurrency"]): r for r in previous.get("results", [])}
+    regressions = 0
+    print(f"\n📈 Compared with {previous.get('revision')} ({previous.get('started_at')})")
+    for result in current["results"]:
+        old = before.get((result["scenario"], result["concurrency"]))
+        if not old:
+            continue
+        old_p95, new_p95 = old["latency_ms"]["p95"], result["latency_ms"]["p95"]
+        old_rps, new_rps = old["requests_per_second"], result["requests_per_second"]
+        p95_delta = (new_p95 - old_p95) / old_p95 if old_p95 else 0.0
+        rps_delta = (new_rps - old_rps) / old_rps if old_rps else 0.0
+        regressed = p95_delta > threshold or rps_delta < -threshold
+        regressions += regressed
+        marker = "❌" if regressed else "✅"
+        print(f"  {marker} {result['scenario']:<7} c={result['concurrency']:<3} "
+              f"p95 {old_p95}→{new_p95}ms ({p95_delta:+.1%})  req/s {old_rps}→{new_rps} ({rps_delta:+.1%})")
+    return regressions
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load-test the chatbot against a stub LLM")
+    parser.add_argument("--scenarios", nargs="+", default=["chat"], choices=["chat", "upload", "crawl"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario and concurrency level")
+    parser.add_argument("--provider", default="openai", choices=["openai", "ollama"])
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed chat requests before measuring")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<time>-<rev>.json)")
+    parser.add_argument("--compare", help="Previous result file to compare against")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args(argv)
+
+    revision = git_revision()
+    workdir = prepare_workdir(tempfile.mkdtemp(prefix="chatbot-bench-"))
+    stub = StubLLMServer(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                         reply_tokens=args.reply_tokens).start()
+    configure_stub_environment(stub, args.provider)
+
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, SCRIPT_DIR)
+    server = None
+    try:
+        print(f"🚀 Booting app in {workdir} against stub LLM at {stub.url}")
+        boot_started = time.perf_counter()
+        server, base_url = boot_app()
+        boot_seconds = round(time.perf_counter() - boot_started, 2)
+
+        sessions = load_sessions()
+        import requests
+        for message in [s[0] for s in sessions[:args.warmup]]:
+            requests.post(f"{base_url}/chat", json={"message": message, "user_id": "warmup"}, timeout=300)
+
+        result = {
+            "revision": revision,
+            "started_at": datetime.now().isoformat(),
+            "boot_seconds": boot_seconds,
+            "stub": {"provider": args.provider, "latency": args.latency,
+                     "tokens_per_second": args.tokens_per_second, "reply_tokens": args.reply_tokens},
+            "sessions": len(sessions),
+            "results": []
+        }
+
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                if scenario == "chat":
+                    planned = chat_requests(base_url, sessions, args.requests)
+                elif scenario == "upload":
+                    planned = upload_requests(base_url, args.requests)
+                else:
+                    planned = crawl_requests(base_url, stub.url, args.requests)
+                result["results"].append(run_scenario(scenario, planned, concurrency))
+    finally:
+        if server is not None:
+            server.shutdown()
+        stub.stop()
+        os.chdir(original_cwd)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}-{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"💾 Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), result)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,14 +6,18 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-def log_chat(user_id, message, sender, intent=None, sales_flag=None, success_flag=None):
+def log_chat(user_id, message, sender, intent=None, sales_flag=None, success_flag=None, website_id=None,
+             matched_intent=None):
     try:
         # Convert values to native Python types
         user_id = user_id or None
         message = str(message)
         sender = str(sender)
-        intent = str(intent)
-        sales_flag = int(sales_flag) if sales_flag is not None else 0
+        website_id = str(website_id or 'default')
+        # NULL intent / sales_flag means unlabeled; retrain_classifier only trains on labels
+        intent = str(intent) if intent else None
+        matched_intent = str(matched_intent) if matched_intent else None
+        sales_flag = int(sales_flag) if sales_flag is not None else None
         # Classify the message if intent not provided
         # if intent is None:
         #     label, sales = classify_message(message)
@@ -48,10 +52,12 @@ def log_chat(user_id, message, sender, intent=None, sales_flag=None, success_fla
 
         # Parameterized insert
         query = """
-            INSERT INTO chat_logs (timestamp, user_id, message, sender, intent, sales_flag, success_flag)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO chat_logs (timestamp, user_id, website_id, message, sender, intent, matched_intent,
+                                   sales_flag, success_flag)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
-        cursor.execute(query, (timestamp, user_id, message, sender, intent, sales_flag, success_flag))
+        cursor.execute(query, (timestamp, user_id, website_id, message, sender, intent, matched_intent,
+                               sales_flag, success_flag))
         connection.commit()
 
         print("✅ Chat logged successfully!")
@@ -94,51 +100,25 @@ def get_or_create_user(name, email, phone):
 
 def log_conversation_node(convo_id, node_id, parent_id, user_id, message, sender,
                           topic=None, intent=None, sales_flag=False, success_flag=False):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Cast all string fields to native Python str
-    convo_id = str(convo_id)
-    user_id = str(user_id)
-    message = str(message)
-    sender = str(sender)
-    topic = str(topic) if topic is not None else None
-    intent = str(intent) if intent is not None else None
-
-    # Ensure booleans are native Python bool
-    sales_flag = bool(sales_flag)
-    success_flag = bool(success_flag)
-
-    sql = """
-    INSERT INTO conversation_nodes (
-        convo_id, node_id, parent_id, user_id, message, sender,
-        topic, intent, sales_flag, success_flag
-    ) 
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """
-
-    values = (
-        convo_id,
-        node_id,
-        parent_id if parent_id != 0 else None,
-        user_id,
-        message,
-        sender,
-        topic,
-        intent,
-        sales_flag,
-        success_flag
-    )
+    # tree_store fills in the materialized path, depth and branch of the node
+    from tree_store import insert_nodes
+
+    node = {
+        "node_id": node_id,
+        "parent_id": parent_id if parent_id != 0 else None,
+        "user_id": str(user_id),
+        "message": str(message),
+        "sender": str(sender),
+        "topic": str(topic) if topic is not None else None,
+        "intent": str(intent) if intent is not None else None,
+        "sales_flag": bool(sales_flag),
+        "success_flag": bool(success_flag),
+    }
 
     try:
-        print(values)  # Debug log
-        cursor.execute(sql, values)
-        conn.commit()
+        insert_nodes(str(convo_id), [node])
     except mysql.connector.Error as err:
         print(f"❌ Error: {err}")
-    finally:
-        cursor.close()
-        conn.close()
 
 
     
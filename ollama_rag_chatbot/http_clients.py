@@ -0,0 +1,139 @@
+"""Shared, pooled HTTP clients for the LLM backends.
+
+One httpx.Client per origin (scheme://host:port) keeps its connections
+alive and is shared by every LLM instance, health probe and routing backend
+talking to that origin. Rebuilding LLM instances after a config save
+therefore reuses warm connections instead of opening new ones. HTTP/2 is
+negotiated with HTTPS origins when the h2 package is installed.
+"""
+import atexit
+import json
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    from langchain_community.llms import Ollama
+    from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+except ImportError:
+    Ollama = None
+
+logger = logging.getLogger(__name__)
+
+# Connections per origin; a routing backend may override these with a "pool" entry
+DEFAULT_POOL = {"max_connections": 32, "max_keepalive_connections": 16, "keepalive_expiry": 120.0}
+# LLM responses can take minutes to generate; connecting should not
+DEFAULT_TIMEOUT = httpx.Timeout(connect=5.0, read=300.0, write=30.0, pool=10.0)
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def origin_of(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def get_client(url, pool=None):
+    """Pooled client for the origin of url; `pool` only applies when the client is first created"""
+    origin = origin_of(url)
+    client = _clients.get(origin)
+    if client is None:
+        with _lock:
+            client = _clients.get(origin)
+            if client is None:
+                settings = {**DEFAULT_POOL, **(pool or {})}
+                client = _clients[origin] = httpx.Client(
+                    limits=httpx.Limits(**settings),
+                    timeout=DEFAULT_TIMEOUT,
+                    http2=HTTP2_AVAILABLE and origin.startswith("https://"),
+                )
+                logger.info(f"Opened HTTP pool for {origin} ({settings['max_connections']} connections)")
+    return client
+
+
+def pool_stats():
+    """Open and idle connections per origin"""
+    stats = {}
+    for origin, client in list(_clients.items()):
+        connections = getattr(getattr(client._transport, "_pool", None), "connections", [])
+        stats[origin] = {
+            "connections": len(connections),
+            "idle": sum(1 for connection in connections if connection.is_idle()),
+        }
+    return stats
+
+
+@atexit.register
+def close_all():
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+if Ollama is not None:
+    class PooledOllama(Ollama):
+        """langchain_community's Ollama LLM sending its requests through the shared pool"""
+
+        pool: dict = {}
+
+        def _create_stream(self, api_url, payload, stop=None, **kwargs):
+            # Same request as Ollama._create_stream, which uses a new requests connection each time
+            if self.stop is not None and stop is not None:
+                raise ValueError("`stop` found in both the input and default params.")
+            elif self.stop is not None:
+                stop = self.stop
+
+            params = self._default_params
+            for key in self._default_params:
+                if key in kwargs:
+                    params[key] = kwargs[key]
+            if "options" in kwargs:
+                params["options"] = kwargs["options"]
+            else:
+                params["options"] = {
+                    **params["options"],
+                    "stop": stop,
+                    **{k: v for k, v in kwargs.items() if k not in self._default_params},
+                }
+            if payload.get("messages"):
+                request_payload = {"messages": payload.get("messages", []), **params}
+            else:
+                request_payload = {"prompt": payload.get("prompt"), "images": payload.get("images", []), **params}
+
+            client = get_client(api_url, self.pool)
+            timeout = httpx.Timeout(self.timeout, connect=DEFAULT_TIMEOUT.connect) if self.timeout else DEFAULT_TIMEOUT
+            with client.stream("POST", api_url, json=request_payload, timeout=timeout,
+                               headers=self.headers if isinstance(self.headers, dict) else None,
+                               auth=self.auth) as response:
+                if response.status_code != 200:
+                    response.read()
+                    if response.status_code == 404:
+                        raise OllamaEndpointNotFoundError(
+                            "Ollama call failed with status code 404. "
+                            f"Maybe your model is not found and you should pull the model with `ollama pull {self.model}`."
+                        )
+                    raise ValueError(f"Ollama call failed with status code {response.status_code}. "
+                                     f"Details: {response.text}")
+                for line in response.iter_lines():
+                    if line:
+                        yield line
+else:
+    PooledOllama = None
+
+
+def probe_ollama(base_url, timeout=5.0):
+    """Models of an Ollama server from /api/tags (on a pooled connection); raises if it doesn't answer"""
+    response = get_client(base_url).get(f"{base_url.rstrip('/')}/api/tags", timeout=timeout)
+    if response.status_code != 200:
+        raise Exception(f"Ollama connection failed: {response.status_code}")
+    return json.loads(response.content or b"{}")
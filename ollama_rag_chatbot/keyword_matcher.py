@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import time
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Optional overrides: {"<section>": {"<label>": ["keyword", ...]}}
+INTENT_KEYWORDS_FILE = "config/intent_keywords.json"
+
+# How often (seconds) the config file is checked for changes
+RELOAD_CHECK_INTERVAL = 5.0
+
+# Keyword lists used to route a query to knowledge base file categories
+QUERY_CATEGORY_KEYWORDS = {
+    # Sales-related keywords
+    'sales': [
+        'price', 'cost', 'pricing', 'quote', 'buy', 'purchase', 'interested',
+        'hire', 'contract', 'deal', 'discount', 'budget', 'payment', 'invoice',
+        'proposal', 'consultation', 'estimate'
+    ],
+    # Product/service keywords
+    'product': [
+        'service', 'product', 'feature', 'specification', 'capability',
+        'what do you offer', 'what can you do', 'portfolio', 'work'
+    ],
+    # Company info keywords
+    'company': [
+        'about', 'who', 'team', 'history', 'location', 'contact', 'address',
+        'phone', 'email', 'hours', 'founded', 'mission', 'vision'
+    ],
+    # Legal/policy keywords
+    'legal': [
+        'terms', 'privacy', 'policy', 'legal', 'contract', 'agreement',
+        'refund', 'cancellation', 'guarantee', 'liability'
+    ]
+}
+
+# File categories to prioritize for each matched keyword group, in priority order
+QUERY_CATEGORY_ROUTES = [
+    ('sales', ['sales_training', 'product_info']),
+    ('product', ['product_info', 'company_details']),
+    ('company', ['company_details']),
+    ('legal', ['policies_legal']),
+]
+
+_QUOTES = str.maketrans({"’": "'", "‘": "'", "“": '"', "”": '"'})
+_NON_WORD_RE = re.compile(r"[^a-z0-9']+")
+
+
+def normalize_text(text):
+    """Lowercase, unify quotes and collapse punctuation so keywords match on word starts"""
+    text = _NON_WORD_RE.sub(" ", str(text).lower().translate(_QUOTES)).strip()
+    return f" {text} "
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over labeled keyword lists.
+
+    One pass over the normalized text returns every label whose keywords
+    occur in it. Keywords match at the start of a word, so "service"
+    matches "services" but "about" does not match "roundabout".
+    """
+
+    def __init__(self, keyword_groups):
+        self.keyword_groups = {label: list(keywords) for label, keywords in keyword_groups.items()}
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        for label, keywords in self.keyword_groups.items():
+            for keyword in keywords:
+                pattern = normalize_text(keyword).rstrip()
+                if pattern.strip():
+                    self._add(pattern, (label, keyword))
+        self._build_failure_links()
+
+    def _add(self, pattern, entry):
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._goto[state][ch] = next_state
+            state = next_state
+        self._output[state] = self._output[state] + (entry,)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fallback = self._goto[fail].get(ch, 0)
+                self._fail[next_state] = fallback if fallback != next_state else 0
+                # Inherit matches that end at the failure state
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter_matches(self, text):
+        """Yield (label, keyword) for every keyword occurrence in text"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for ch in normalize_text(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                yield from output[state]
+
+    def match(self, text):
+        """Labels matched in text, in order of first occurrence"""
+        labels = {}
+        for label, _ in self.iter_matches(text):
+            labels.setdefault(label, None)
+        return list(labels)
+
+
+class ReloadableMatcher:
+    """KeywordMatcher built from defaults plus a config section, rebuilt when the file changes"""
+
+    def __init__(self, section, defaults, config_file=INTENT_KEYWORDS_FILE,
+                 check_interval=RELOAD_CHECK_INTERVAL):
+        self.section = section
+        self.defaults = {label: list(keywords) for label, keywords in defaults.items()}
+        self.config_file = config_file
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._matcher = KeywordMatcher(self._load_groups())
+
+    def _load_groups(self):
+        groups = {label: list(keywords) for label, keywords in self.defaults.items()}
+        try:
+            if os.path.exists(self.config_file):
+                self._mtime = os.path.getmtime(self.config_file)
+                with open(self.config_file, 'r', encoding='utf-8') as f:
+                    overrides = json.load(f).get(self.section, {})
+                # Config lists replace the in-code list for the same label
+                for label, keywords in overrides.items():
+                    groups[label] = list(keywords)
+            else:
+                self._mtime = None
+        except Exception as e:
+            logger.warning(f"Could not load keyword config {self.config_file}: {e}")
+        return groups
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                mtime = os.path.getmtime(self.config_file) if os.path.exists(self.config_file) else None
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                self.reload()
+
+    def reload(self):
+        """Rebuild the automaton from defaults and the current config file"""
+        self._matcher = KeywordMatcher(self._load_groups())
+        logger.info(f"Reloaded keyword matcher '{self.section}'")
+
+    def match(self, text):
+        self._maybe_reload()
+        return self._matcher.match(text)
+
+    def iter_matches(self, text):
+        self._maybe_reload()
+        return self._matcher.iter_matches(text)
+
+
+query_category_matcher = ReloadableMatcher("query_categories", QUERY_CATEGORY_KEYWORDS)
+
+
+def determine_query_categories(user_input):
+    """Determine which file categories to prioritize based on query content"""
+    matched = set(query_category_matcher.match(user_input))
+
+    unique_categories = []
+    for group, categories in QUERY_CATEGORY_ROUTES:
+        if group in matched:
+            for category in categories:
+                if category not in unique_categories:
+                    unique_categories.append(category)
+
+    return unique_categories if unique_categories else None
@@ -0,0 +1,305 @@
+"""Versioned global knowledge base.
+
+Uploads and crawls append their chunks to the active Chroma directory in
+place, at a cost proportional to the new chunks only. Destructive changes
+(FAQ replacement, reset) write a new Chroma directory next to ./chroma_db and
+then switch the pointer file (see vector_index.switch_index) in one atomic
+rename. Retrievals lease the version that was current when they started, so
+a rebuild never hands a chat a half-built or deleted store. Every process
+that opens a version leaves a holder file in it; a retired version is
+deleted only once its last lease ends, a short grace period has passed and
+no other live process still holds it.
+"""
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any
+
+from langchain_core.retrievers import BaseRetriever
+
+import vector_index
+
+logger = logging.getLogger(__name__)
+
+try:
+    from langchain_community.vectorstores import Chroma
+except ImportError:
+    from langchain.vectorstores import Chroma
+
+# Retired versions are kept at least this long so other processes can move off them
+GC_GRACE_SECONDS = 60
+# How often readers re-check the pointer file for versions published by other processes
+POINTER_CHECK_INTERVAL = 1.0
+# Per-process holder files inside each version directory
+HOLDERS_DIR = ".holders"
+
+
+def _release_chroma_client(path):
+    """Drop Chroma's cached client for a directory that is about to be deleted"""
+    try:
+        from chromadb.api.shared_system_client import SharedSystemClient
+        system = SharedSystemClient._identifier_to_system.pop(path, None)
+        if system is not None:
+            system.stop()
+    except Exception as e:
+        logger.debug(f"Could not release Chroma client for {path}: {e}")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _hold(path):
+    holders = os.path.join(path, HOLDERS_DIR)
+    os.makedirs(holders, exist_ok=True)
+    open(os.path.join(holders, str(os.getpid())), "w").close()
+
+
+def _release_hold(path):
+    try:
+        os.remove(os.path.join(path, HOLDERS_DIR, str(os.getpid())))
+    except OSError:
+        pass
+
+
+def _other_holders(path):
+    """Live processes other than this one that have the version open (dead holders are cleared)"""
+    holders_dir = os.path.join(path, HOLDERS_DIR)
+    try:
+        names = os.listdir(holders_dir)
+    except OSError:
+        return []
+    live = []
+    for name in names:
+        if not name.isdigit() or int(name) == os.getpid():
+            continue
+        if _pid_alive(int(name)):
+            live.append(int(name))
+        else:
+            try:
+                os.remove(os.path.join(holders_dir, name))
+            except OSError:
+                pass
+    return live
+
+
+class KnowledgeVersion:
+    """One immutable knowledge base directory and its open vector store"""
+
+    def __init__(self, path, vectorstore):
+        self.path = path
+        self.vectorstore = vectorstore
+        self.leases = 0
+        self.retired_at = None
+
+    def count(self):
+        return self.vectorstore._collection.count()
+
+
+class VersionedKnowledgeBase:
+    """Atomically swapped knowledge base versions with leases and garbage collection"""
+
+    def __init__(self, base_path, embedding_function, collection_name=vector_index.COLLECTION_NAME):
+        self.base_path = base_path
+        self.embedding_function = embedding_function
+        self.collection_name = collection_name
+        self._lock = threading.Lock()
+        self._publish_lock = threading.RLock()
+        self._retired = []
+        self._next_pointer_check = 0.0
+        self._current = self._open(vector_index.resolve_index_path(base_path))
+        self._remove_stale_versions()
+
+    # ---------- reading ----------
+
+    def _open(self, path):
+        os.makedirs(path, exist_ok=True)
+        _hold(path)
+        vectorstore = Chroma(
+            persist_directory=path,
+            embedding_function=self.embedding_function,
+            collection_name=self.collection_name,
+            collection_metadata=vector_index.collection_metadata(vector_index.get_index_settings())
+        )
+        return KnowledgeVersion(path, vectorstore)
+
+    def _follow_pointer(self):
+        """Pick up versions published by other processes"""
+        now = time.monotonic()
+        if now < self._next_pointer_check:
+            return
+        self._next_pointer_check = now + POINTER_CHECK_INTERVAL
+        path = vector_index.resolve_index_path(self.base_path)
+        if os.path.normpath(path) != os.path.normpath(self._current.path):
+            with self._publish_lock:
+                if os.path.normpath(path) != os.path.normpath(self._current.path):
+                    self._activate(self._open(path), write_pointer=False)
+
+    def current(self):
+        self._follow_pointer()
+        return self._current
+
+    @contextmanager
+    def lease(self):
+        """Hold the current version for the duration of a read"""
+        self._follow_pointer()
+        with self._lock:
+            version = self._current
+            version.leases += 1
+        try:
+            yield version
+        finally:
+            with self._lock:
+                version.leases -= 1
+            if self._retired:
+                self.collect_garbage()
+
+    def count(self):
+        with self.lease() as version:
+            return version.count()
+
+    def as_retriever(self, **search_kwargs):
+        return VersionedRetriever(knowledge_base=self, search_kwargs=search_kwargs or {"k": 5})
+
+    # ---------- publishing ----------
+
+    def _activate(self, version, write_pointer=True):
+        with self._lock:
+            previous = self._current
+            self._current = version
+            if write_pointer:
+                vector_index.switch_index(self.base_path, version.path)
+            previous.retired_at = time.monotonic()
+            self._retired.append(previous)
+        self.collect_garbage()
+
+    def append(self, documents):
+        """Add documents to the active version in place; only they are embedded"""
+        documents = list(documents)
+        if not documents:
+            return self.current()
+        started = time.perf_counter()
+        # Embed outside the lock so concurrent uploads only serialize on the write
+        texts = [document.page_content for document in documents]
+        embeddings = self.embedding_function.embed_documents(texts)
+        with self._publish_lock, vector_index.write_lock(self.base_path):
+            version = self.current()
+            version.vectorstore._collection.add(
+                ids=[str(uuid.uuid4()) for _ in documents],
+                embeddings=embeddings,
+                documents=texts,
+                metadatas=[document.metadata or None for document in documents])
+        logger.info(f"Appended {len(documents)} records to knowledge base {version.path} "
+                    f"in {time.perf_counter() - started:.2f}s")
+        return version
+
+    def publish(self, documents=(), keep_existing=True, drop_sources=()):
+        """Build a new version and switch to it (for destructive changes).
+
+        keep_existing copies the current records (with their stored
+        embeddings) except those whose metadata "source" is in
+        drop_sources; only the new documents are embedded. Without
+        drop_sources nothing is removed, so the documents are appended in
+        place instead.
+        """
+        drop_sources = set(drop_sources)
+        if keep_existing and not drop_sources:
+            return self.append(documents)
+        with self._publish_lock, vector_index.write_lock(self.base_path):
+            started = time.perf_counter()
+            source = self.current()
+            version_path = (f"{os.path.normpath(self.base_path)}{vector_index.VERSION_MARKER}"
+                            f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+            try:
+                version = self._open(version_path)
+                target = version.vectorstore._collection
+                copied = 0
+                if keep_existing:
+                    for batch in vector_index.iter_records(source.vectorstore._collection):
+                        keep = [i for i, metadata in enumerate(batch["metadatas"])
+                                if not drop_sources or (metadata or {}).get("source") not in drop_sources]
+                        if keep:
+                            target.add(ids=[batch["ids"][i] for i in keep],
+                                       embeddings=[batch["embeddings"][i] for i in keep],
+                                       documents=[batch["documents"][i] for i in keep],
+                                       metadatas=[batch["metadatas"][i] for i in keep])
+                            copied += len(keep)
+                documents = list(documents)
+                if documents:
+                    version.vectorstore.add_documents(documents)
+            except Exception:
+                _release_chroma_client(version_path)
+                shutil.rmtree(version_path, ignore_errors=True)
+                raise
+
+            self._activate(version)
+            logger.info(f"Published knowledge base {version_path}: {copied} kept, {len(documents)} added "
+                        f"in {time.perf_counter() - started:.2f}s")
+            return version
+
+    def publish_directory(self, path):
+        """Switch to an already built directory, e.g. one restored from a snapshot"""
+        with self._publish_lock, vector_index.write_lock(self.base_path):
+            version = self._open(path)
+            self._activate(version)
+            logger.info(f"Published knowledge base {path} ({version.count()} records)")
+            return version
+
+    def reset(self):
+        """Publish an empty version"""
+        return self.publish(keep_existing=False)
+
+    # ---------- garbage collection ----------
+
+    def collect_garbage(self, grace_seconds=GC_GRACE_SECONDS):
+        """Delete retired versions with no leases once the grace period is over and no other process holds them"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [v for v in self._retired
+                       if v.leases == 0 and now - v.retired_at >= grace_seconds
+                       and os.path.normpath(v.path) != os.path.normpath(self._current.path)]
+            self._retired = [v for v in self._retired if v not in expired]
+        removed = []
+        for version in expired:
+            version.vectorstore = None
+            _release_chroma_client(version.path)
+            _release_hold(version.path)
+            if _other_holders(version.path):
+                continue  # the last process to let go deletes it
+            shutil.rmtree(version.path, ignore_errors=True)
+            removed.append(version.path)
+            logger.info(f"Removed retired knowledge base {version.path}")
+        return removed
+
+    def _remove_stale_versions(self):
+        """Delete versioned directories left behind by earlier runs"""
+        active = os.path.normpath(self._current.path)
+        cutoff = time.time() - GC_GRACE_SECONDS
+        for path in vector_index.index_versions(self.base_path):
+            if (os.path.normpath(path) != active and os.path.getmtime(path) < cutoff
+                    and not _other_holders(path)):
+                shutil.rmtree(path, ignore_errors=True)
+                logger.info(f"Removed stale knowledge base {path}")
+
+
+class VersionedRetriever(BaseRetriever):
+    """Retriever that searches whichever version is current when the query starts"""
+
+    knowledge_base: Any
+    search_kwargs: dict = {}
+
+    def _get_relevant_documents(self, query, *, run_manager=None, **kwargs):
+        search_kwargs = {**self.search_kwargs, **kwargs}
+        with self.knowledge_base.lease() as version:
+            return version.vectorstore.similarity_search(query, **search_kwargs)
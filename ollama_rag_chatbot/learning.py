@@ -1,8 +1,12 @@
 import os
+import json
+import html
+import hashlib
+import time
 from db_model import get_connection
 from langchain_community.vectorstores import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
 
 # Get the current working directory (the folder where the script is located)
@@ -15,59 +19,260 @@ print(f"Directoryxxxx {VECTORSTORE_DIR} created.")
 # Create the directory if it doesn't exist
 if not os.path.exists(VECTORSTORE_DIR):
     os.makedirs(VECTORSTORE_DIR)
-  
+
+# Learner state: high-water mark of processed chat_logs rows and run history
+LEARNING_STATE_FILE = os.path.join(VECTORSTORE_DIR, "learning_state.json")
+LEARNING_RUNS_FILE = os.path.join(VECTORSTORE_DIR, "learning_runs.jsonl")
+
+# Conversations (users) whose new rows are fetched and learned from per batch
+USERS_PER_BATCH = 200
+# Q&A pairs deduped and embedded per vector store write
+EMBED_BATCH_SIZE = 256
+# A trailing user message this recent may still get its bot reply; it stays above the watermark
+REPLY_GRACE = timedelta(minutes=15)
+
 
 embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
 
-def fetch_unsuccessful_sales():
+def load_watermark():
+    """Load the last processed chat_logs id/timestamp"""
+    try:
+        if os.path.exists(LEARNING_STATE_FILE):
+            with open(LEARNING_STATE_FILE, "r", encoding="utf-8") as f:
+                state = json.load(f)
+                return {
+                    "last_id": int(state.get("last_id", 0)),
+                    "last_timestamp": state.get("last_timestamp")
+                }
+    except Exception as e:
+        print(f"⚠️ Could not read learning state, starting from scratch: {e}")
+    return {"last_id": 0, "last_timestamp": None}
+
+def save_watermark(last_id, last_timestamp):
+    """Persist the high-water mark atomically so a crash never loses or rewinds it"""
+    state = {
+        "last_id": last_id,
+        "last_timestamp": last_timestamp,
+        "updated_at": datetime.now().isoformat()
+    }
+    tmp_file = LEARNING_STATE_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, LEARNING_STATE_FILE)
+
+def record_run(stats):
+    """Append run statistics to the learning run log"""
+    try:
+        with open(LEARNING_RUNS_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(stats, default=str) + "\n")
+    except Exception as e:
+        print(f"⚠️ Could not record learning run: {e}")
+
+def fetch_unsuccessful_sales(last_id=0, users_per_batch=USERS_PER_BATCH):
+    """Yield lists of rows newer than last_id from conversations with an unsuccessful sales turn.
+
+    Sales turns are user messages the keyword matcher recognized
+    (matched_intent), so conversations (users) are selected by those turns
+    and then all of their new rows are returned, ordered by (user_id,
+    timestamp). Users are paged by keyset on user_id, so neither the user
+    list nor a result set stays in memory or open while the caller embeds
+    and writes. Each user's last row at or below last_id comes first, so a
+    question just below the watermark still pairs with its reply above it.
+    """
     conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT * FROM chat_logs
-        WHERE sales_flag = 1 AND (success_flag = 0 OR success_flag IS NULL)
-        ORDER BY timestamp ASC
-    """)
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return results
+    try:
+        after_user = None
+        while True:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    SELECT DISTINCT n.user_id FROM chat_logs n
+                    WHERE n.id > %s AND n.user_id IS NOT NULL AND (%s IS NULL OR n.user_id > %s)
+                    AND EXISTS (
+                        SELECT 1 FROM chat_logs s
+                        WHERE s.matched_intent IS NOT NULL AND s.success_flag = 'No' AND s.user_id = n.user_id
+                    )
+                    ORDER BY n.user_id ASC
+                    LIMIT %s
+                """, (last_id, after_user, after_user, users_per_batch))
+                batch = [row[0] for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+            if not batch:
+                break
+            after_user = batch[-1]
+
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute(f"""
+                    SELECT c.id, c.timestamp, c.user_id, c.message, c.sender FROM chat_logs c
+                    JOIN (
+                        SELECT user_id, MAX(id) AS id FROM chat_logs
+                        WHERE id <= %s AND user_id IN ({placeholders})
+                        GROUP BY user_id
+                    ) previous ON c.id = previous.id
+                    UNION ALL
+                    SELECT id, timestamp, user_id, message, sender FROM chat_logs
+                    WHERE id > %s AND user_id IN ({placeholders})
+                    ORDER BY user_id ASC, timestamp ASC, id ASC
+                """, (last_id, *batch, last_id, *batch))
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+            if rows:
+                yield rows
+            if len(batch) < users_per_batch:
+                break
+    finally:
+        conn.close()
+
+def awaiting_reply(rows, now=None):
+    """Ids of recent user messages that end their conversation in rows, i.e. have no reply yet"""
+    cutoff = (now or datetime.now()) - REPLY_GRACE
+    waiting = []
+    for index, row in enumerate(rows):
+        last_of_user = index + 1 == len(rows) or rows[index + 1]["user_id"] != row["user_id"]
+        if last_of_user and row["sender"] == "user" and row["timestamp"] and row["timestamp"] >= cutoff:
+            waiting.append(row["id"])
+    return waiting
+
+# Compiled once: block-level tags become line breaks, everything else is dropped
+_BREAK_TAG_RE = re.compile(r"<\s*(?:br|/p|/li|/div)\s*/?\s*>", re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r"<[^>]*>")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
 
 def clean_text(text):
-    text = re.sub(r"<.*?>", "", text)  # remove HTML tags
-    return text.strip()
+    if not text:
+        return ""
+    if "<" in text:
+        text = _BREAK_TAG_RE.sub("\n", text)
+        text = _HTML_TAG_RE.sub("", text)  # remove HTML tags
+    if "&" in text:
+        text = html.unescape(text)
+    return _BLANK_LINES_RE.sub("\n", text).strip()
 
 def build_qa_pairs(logs):
-    qa_pairs = []
-    grouped = {}
+    """Yield (question, answer) pairs from rows ordered by (user_id, timestamp).
 
+    Only the previous row is kept, so memory stays constant no matter how
+    much history is streamed through.
+    """
+    previous = None
     for entry in logs:
-        user_id = entry['user_id']
-        grouped.setdefault(user_id, []).append(entry)
-
-    for conv in grouped.values():
-        for i in range(len(conv)-1):
-            if conv[i]["sender"] == "user" and conv[i+1]["sender"] == "bot":
-                question = clean_text(conv[i]["message"])
-                answer = clean_text(conv[i+1]["message"])
-                if question and answer:
-                    qa_pairs.append((question, answer))
-    return qa_pairs
-
-def add_to_vectorstore(qa_pairs):
+        if (previous is not None
+                and previous["user_id"] == entry["user_id"]
+                and previous["sender"] == "user"
+                and entry["sender"] == "bot"):
+            question = clean_text(previous["message"])
+            answer = clean_text(entry["message"])
+            if question and answer:
+                yield question, answer
+        previous = entry
+
+def qa_pair_id(question, answer):
+    """Stable content hash used as the vector store id of a Q&A pair"""
+    normalized = f"{' '.join(question.lower().split())}\n{' '.join(answer.lower().split())}"
+    return "qa_" + hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def add_to_vectorstore(qa_pairs, batch_size=EMBED_BATCH_SIZE):
+    """Embed only Q&A pairs that are not already in the store; returns the number added"""
     # Use the dynamic path for the vector store
     db = Chroma(persist_directory=VECTORSTORE_DIR, embedding_function=embedding_model)
+
+    added = 0
+    skipped = 0
+    pending = {}
+
+    def flush():
+        nonlocal added, skipped
+        # Dedupe against what is already stored before paying for embeddings
+        existing = set(db.get(ids=list(pending.keys()), include=[])["ids"])
+        new_ids = [doc_id for doc_id in pending if doc_id not in existing]
+        if new_ids:
+            texts = [f"Q: {pending[doc_id][0]}\nA: {pending[doc_id][1]}" for doc_id in new_ids]
+            metadatas = [{"source": "learning", "learned_at": datetime.now().isoformat()} for _ in new_ids]
+            db.add_texts(texts, metadatas=metadatas, ids=new_ids)
+        added += len(new_ids)
+        skipped += len(pending) - len(new_ids)
+        pending.clear()
+
     for question, answer in qa_pairs:
-        doc = f"Q: {question}\nA: {answer}"
-        db.add_texts([doc])
-    print(f"✅ Added {len(qa_pairs)} Q&A pairs to vector store.")
+        doc_id = qa_pair_id(question, answer)
+        if doc_id in pending:
+            skipped += 1
+            continue
+        pending[doc_id] = (question, answer)
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+
+    print(f"✅ Added {added} Q&A pairs to vector store ({skipped} duplicates skipped).")
+    return added, skipped
 
 def main():
-    logs = fetch_unsuccessful_sales()
-    if not logs:
+    started = time.perf_counter()
+    watermark = load_watermark()
+
+    progress = {
+        "rows_fetched": 0,
+        "max_id": watermark["last_id"],
+        "max_timestamp": watermark["last_timestamp"],
+        "waiting": []
+    }
+
+    def tracked_rows():
+        for rows in fetch_unsuccessful_sales(watermark["last_id"]):
+            # Rows at or below the watermark only pair with the first new reply of their user
+            progress["rows_fetched"] += sum(1 for row in rows if row["id"] > watermark["last_id"])
+            for row in rows:
+                if row["id"] > progress["max_id"]:
+                    progress["max_id"] = row["id"]
+                    progress["max_timestamp"] = str(row["timestamp"])
+            progress["waiting"].extend(awaiting_reply(rows))
+            yield from rows
+
+    qa_count = 0
+
+    def counted_pairs():
+        nonlocal qa_count
+        for pair in build_qa_pairs(tracked_rows()):
+            qa_count += 1
+            yield pair
+
+    added, skipped = add_to_vectorstore(counted_pairs())
+
+    # The watermark goes to the last fully paired row: the max id seen, except that it stays
+    # below user messages still waiting for their reply. Rows above it are read again next
+    # run; their pairs are already stored and are skipped as duplicates. A reply that comes
+    # after REPLY_GRACE still pairs, since each user's last row below the watermark is re-read.
+    last_id, last_timestamp = progress["max_id"], progress["max_timestamp"]
+    if progress["waiting"]:
+        last_id = min(last_id, min(progress["waiting"]) - 1)
+        last_timestamp = None  # the row at a held-back watermark was not tracked
+
+    stats = {
+        "run_at": datetime.now().isoformat(),
+        "from_id": watermark["last_id"],
+        "to_id": last_id,
+        "rows_fetched": progress["rows_fetched"],
+        "awaiting_reply": len(progress["waiting"]),
+        "qa_pairs": qa_count,
+        "qa_pairs_added": added,
+        "qa_pairs_skipped": skipped,
+        "duration_seconds": round(time.perf_counter() - started, 3)
+    }
+
+    if not progress["rows_fetched"]:
         print("No new logs to learn from.")
-        return
-    qa_pairs = build_qa_pairs(logs)
-    add_to_vectorstore(qa_pairs)
+    elif last_id > watermark["last_id"]:
+        # Only advance the watermark once the rows are safely embedded
+        save_watermark(last_id, last_timestamp)
+
+    record_run(stats)
+    print(f"📊 Learning run: {stats}")
+    return stats
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,326 @@
+"""Latency-aware routing across a pool of LLM backends.
+
+Backends (several Ollama hosts, OpenAI models) are declared once under
+"routing" in config/llm_config.json and shared by every website:
+
+    "routing": {
+        "backends": {
+            "ollama-a": {"provider": "ollama", "base_url": "http://10.0.0.5:11434", "model": "llama3.1:8b"},
+            "ollama-b": {"provider": "ollama", "base_url": "http://10.0.0.6:11434", "model": "llama3.1:8b"},
+            "gpt-mini": {"provider": "openai", "model": "gpt-4o-mini"}
+        },
+        "default_policy": {"backends": ["ollama-a", "ollama-b"], "strategy": "ewma", "hedge_after": 4.0},
+        "websites": {"sourceselect": {"backends": ["ollama-a", "ollama-b", "gpt-mini"], "max_attempts": 3}}
+    }
+
+Each backend tracks an EWMA of its latency and error rate plus its number of
+requests in flight. A policy's strategy picks a backend by lowest expected
+wait ("ewma"), fewest requests in flight ("least_loaded") or list order
+("ordered"). When the first backend has not answered after hedge_after
+seconds, the next one is asked too and whichever answers first wins. Hedges
+run in their own small pool, at most MAX_HEDGES_PER_BACKEND per backend, so
+slow losers cannot starve first attempts. Failed calls fail over to the next
+backend. Backends that fail repeatedly sit out a cooldown.
+
+The chosen backend is reported on the request's trace, and the backend's
+token usage is passed through in the LLMResult so the request's callbacks
+record it.
+"""
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, List, Optional
+
+from langchain_core.language_models.llms import BaseLLM
+from langchain_core.outputs import Generation, LLMResult
+from langchain_core.prompt_values import StringPromptValue
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("ewma", "least_loaded", "ordered")
+DEFAULT_POLICY = {
+    "backends": [],
+    "strategy": "ewma",
+    "hedge_after": None,     # seconds; None hedges at HEDGE_LATENCY_FACTOR x the backend's usual latency
+    "max_attempts": 2,       # backends tried (hedges included) before giving up
+    "timeout": 120.0,
+}
+HEDGE_LATENCY_FACTOR = 3.0
+MIN_HEDGE_AFTER = 1.0
+
+EWMA_ALPHA = 0.2
+INITIAL_LATENCY = 1.0        # optimistic guess so new backends get traffic
+FAILURES_BEFORE_COOLDOWN = 3
+COOLDOWN_SECONDS = 30.0
+
+# Threads for first attempts and failovers
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-router")
+# Threads for hedges; a losing hedge keeps running until its backend answers
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+MAX_HEDGES_PER_BACKEND = 2
+
+llm_backend_requests_total = tracing.registry.counter(
+    "llm_backend_requests_total", "LLM calls routed to each backend",
+    ("backend", "status"))
+llm_backend_duration = tracing.registry.histogram(
+    "llm_backend_duration_seconds", "Latency of LLM calls per backend",
+    ("backend",))
+llm_hedged_requests_total = tracing.registry.counter(
+    "llm_hedged_requests_total", "Hedge requests sent because the first backend was slow",
+    ("backend",))
+
+
+class Backend:
+    """One LLM endpoint with live latency, error rate and in-flight count"""
+
+    def __init__(self, name, spec, factory):
+        self.name = name
+        self.spec = dict(spec)
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.hedges = 0
+        self.latency = INITIAL_LATENCY
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory(self.spec)
+        return self._client
+
+    def available(self, now=None):
+        return (now or time.monotonic()) >= self.cooldown_until
+
+    def expected_wait(self):
+        """Latency to expect if a request were sent now, penalized for errors"""
+        return self.latency * (self.inflight + 1) * (1 + 4 * self.error_rate)
+
+    def call(self, prompt, stop=None):
+        """(generation, llm_output) of the backend's response, usage included"""
+        with self._lock:
+            self.inflight += 1
+            self.requests += 1
+        started = time.monotonic()
+        try:
+            # generate_prompt works for LLMs and chat models and keeps the provider's usage report
+            result = self.client.generate_prompt([StringPromptValue(text=prompt)], stop=stop)
+        except Exception:
+            self._record(time.monotonic() - started, ok=False)
+            raise
+        self._record(time.monotonic() - started, ok=True)
+        return result.generations[0][0], result.llm_output
+
+    def try_hedge(self):
+        """Reserve a hedge slot; False if this backend already has MAX_HEDGES_PER_BACKEND running"""
+        with self._lock:
+            if self.hedges >= MAX_HEDGES_PER_BACKEND:
+                return False
+            self.hedges += 1
+            return True
+
+    def end_hedge(self, _future=None):
+        with self._lock:
+            self.hedges -= 1
+
+    def _record(self, duration, ok):
+        with self._lock:
+            self.inflight -= 1
+            self.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+            if ok:
+                self.latency += EWMA_ALPHA * (duration - self.latency)
+                self.consecutive_failures = 0
+            else:
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= FAILURES_BEFORE_COOLDOWN:
+                    self.cooldown_until = time.monotonic() + COOLDOWN_SECONDS
+                    logger.warning(f"LLM backend {self.name} failed {self.consecutive_failures}x, "
+                                   f"cooling down for {COOLDOWN_SECONDS:.0f}s")
+        llm_backend_requests_total.inc(backend=self.name, status="ok" if ok else "error")
+        if ok:
+            llm_backend_duration.observe(duration, backend=self.name)
+
+    def stats(self):
+        return {
+            "provider": self.spec.get("provider"),
+            "model": self.spec.get("model"),
+            "base_url": self.spec.get("base_url"),
+            "inflight": self.inflight,
+            "hedges": self.hedges,
+            "ewma_latency": round(self.latency, 3),
+            "error_rate": round(self.error_rate, 3),
+            "requests": self.requests,
+            "available": self.available(),
+        }
+
+
+class BackendPool:
+    """Backends by name; reconfiguring keeps the live stats of unchanged backends"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backends = {}
+
+    def configure(self, specs, factory):
+        with self._lock:
+            backends = {}
+            for name, spec in (specs or {}).items():
+                current = self._backends.get(name)
+                backends[name] = current if current and current.spec == spec else Backend(name, spec, factory)
+            self._backends = backends
+
+    def get(self, name):
+        return self._backends.get(name)
+
+    def names(self):
+        return list(self._backends)
+
+    def stats(self):
+        return {name: backend.stats() for name, backend in self._backends.items()}
+
+
+pool = BackendPool()
+
+
+def resolve_policy(routing, website_id=None):
+    """Routing policy for a website (DEFAULT_POLICY < default_policy < websites[website_id]), or None"""
+    if not routing or not routing.get("backends"):
+        return None
+    policy = {**DEFAULT_POLICY, **routing.get("default_policy", {})}
+    policy.update((routing.get("websites") or {}).get(website_id, {}))
+    if not policy["backends"]:
+        return None
+    if policy["strategy"] not in STRATEGIES:
+        logger.warning(f"Unknown routing strategy {policy['strategy']!r}, using ewma")
+        policy["strategy"] = "ewma"
+    return policy
+
+
+class Router:
+    """Picks backends for a policy and runs calls with hedging and failover"""
+
+    def __init__(self, policy, backend_pool=pool):
+        self.policy = policy
+        self.pool = backend_pool
+
+    def candidates(self):
+        """Backends of the policy, best first; all of them if every one is cooling down"""
+        backends = [self.pool.get(name) for name in self.policy["backends"]]
+        backends = [backend for backend in backends if backend is not None]
+        now = time.monotonic()
+        ready = [backend for backend in backends if backend.available(now)] or backends
+        strategy = self.policy["strategy"]
+        if strategy == "ewma":
+            ready.sort(key=lambda backend: backend.expected_wait())
+        elif strategy == "least_loaded":
+            ready.sort(key=lambda backend: (backend.inflight, backend.latency))
+        return ready
+
+    def hedge_after(self, backend):
+        hedge_after = self.policy.get("hedge_after")
+        if hedge_after is None:
+            return max(MIN_HEDGE_AFTER, HEDGE_LATENCY_FACTOR * backend.latency)
+        return float(hedge_after) if hedge_after else None
+
+    def call(self, prompt, stop=None):
+        """((generation, llm_output), backend_name) from the first backend to answer"""
+        candidates = self.candidates()[:max(1, int(self.policy.get("max_attempts") or 1))]
+        if not candidates:
+            raise RuntimeError("No LLM backends configured for this routing policy")
+        deadline = time.monotonic() + float(self.policy.get("timeout") or DEFAULT_POLICY["timeout"])
+        pending, errors = {}, []
+        queue = list(candidates)
+
+        def launch():
+            backend = queue.pop(0)
+            pending[_executor.submit(backend.call, prompt, stop)] = backend
+            return backend
+
+        def hedge():
+            for index, backend in enumerate(queue):
+                if backend.try_hedge():
+                    queue.pop(index)
+                    future = _hedge_executor.submit(backend.call, prompt, stop)
+                    future.add_done_callback(backend.end_hedge)
+                    pending[future] = backend
+                    return backend
+            return None
+
+        primary = launch()
+        hedge_after = self.hedge_after(primary)
+        hedge_at = time.monotonic() + hedge_after if hedge_after else None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wait_until = min(deadline, hedge_at) if hedge_at and queue else deadline
+            done, _ = wait(list(pending), timeout=max(0.0, wait_until - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    return future.result(), backend.name
+                except Exception as e:
+                    errors.append(f"{backend.name}: {e}")
+                    logger.warning(f"LLM backend {backend.name} failed: {e}")
+            if queue and not pending:
+                launch()
+                hedge_at = time.monotonic() + hedge_after if hedge_after and queue else None
+            elif queue and hedge_at and time.monotonic() >= hedge_at:
+                backend = hedge()
+                if backend is not None:
+                    llm_hedged_requests_total.inc(backend=backend.name)
+                    logger.info(f"Hedging slow LLM request to {backend.name}")
+                # Backends with no hedge slot free are tried again after another hedge_after
+                hedge_at = time.monotonic() + hedge_after if queue else None
+        if pending:
+            raise TimeoutError(f"LLM backends timed out: {', '.join(backend.name for backend in pending.values())}")
+        raise RuntimeError(f"All LLM backends failed: {'; '.join(errors)}")
+
+
+class RoutedLLM(BaseLLM):
+    """LangChain LLM that sends each call through a Router.
+
+    Instances are shared by concurrent requests, so the backend that answered
+    is only reported on the request's trace and in the generation_info.
+    """
+
+    router: Any
+    website_id: Optional[str] = None
+
+    @property
+    def _llm_type(self):
+        return "routed"
+
+    @property
+    def model_name(self):
+        return "router"
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs) -> LLMResult:
+        generations, usage = [], {}
+        for prompt in prompts:
+            (generation, llm_output), backend = self.router.call(prompt, stop=stop)
+            trace = tracing.current_trace()
+            if trace is not None:
+                trace.set(backend=backend)
+            info = dict(generation.generation_info or {})
+            info["backend"] = backend
+            generations.append([Generation(text=generation.text, generation_info=info)])
+            for key, value in ((llm_output or {}).get("token_usage") or {}).items():
+                if isinstance(value, (int, float)):
+                    usage[key] = usage.get(key, 0) + value
+                elif isinstance(value, dict):
+                    details = usage.setdefault(key, {})
+                    for name, count in value.items():
+                        if isinstance(count, (int, float)):
+                            details[name] = details.get(name, 0) + count
+        return LLMResult(generations=generations, llm_output={"token_usage": usage} if usage else None)
@@ -0,0 +1,360 @@
+"""Versioned schema migrations for the MySQL chat database.
+
+Each migration runs once and is recorded in schema_migrations. MySQL
+commits DDL implicitly, so every step checks information_schema first and
+can be re-run safely after a partial failure.
+
+chat_logs and conversation_nodes are range-partitioned by month on
+timestamp. maintain_partitions() (run daily by scheduler.py) adds upcoming
+months and drops months older than CHAT_LOG_RETENTION_MONTHS.
+"""
+import os
+import logging
+from datetime import date, datetime
+
+from db_model import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Months of chat history kept; 0 keeps everything
+RETENTION_MONTHS = int(os.getenv("CHAT_LOG_RETENTION_MONTHS", "24"))
+# Empty monthly partitions kept ready ahead of the current month
+MONTHS_AHEAD = 3
+
+PARTITIONED_TABLES = ("chat_logs", "conversation_nodes")
+CATCH_ALL_PARTITION = "pmax"
+
+
+# ---------- introspection ----------
+
+def _scalar(cursor, sql, params=()):
+    cursor.execute(sql, params)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def column_exists(cursor, table, column):
+    return bool(_scalar(cursor, """
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column)))
+
+
+def index_exists(cursor, table, index):
+    return bool(_scalar(cursor, """
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index)))
+
+
+def partitions(cursor, table):
+    """Partition names of a table in order; empty if it is not partitioned"""
+    cursor.execute("""
+        SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def add_index(cursor, table, index, columns):
+    if not index_exists(cursor, table, index):
+        cursor.execute(f"ALTER TABLE {table} ADD INDEX {index} ({columns})")
+
+
+# ---------- monthly partitions ----------
+
+def _month(day):
+    return date(day.year, day.month, 1)
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def _partition_month(name):
+    return datetime.strptime(name[1:], "%Y%m").date()
+
+
+def _partition_definitions(months):
+    return ", ".join(f"PARTITION {partition_name(month)} VALUES LESS THAN (TO_DAYS('{_add_months(month, 1)}'))"
+                     for month in months)
+
+
+def partition_by_month(cursor, table, months_ahead=MONTHS_AHEAD):
+    """Range-partition a table by month of timestamp.
+
+    MySQL requires the partitioning column in every unique key, so the
+    primary key becomes (id, timestamp) and timestamp becomes NOT NULL.
+    """
+    if partitions(cursor, table):
+        return
+    cursor.execute(f"UPDATE {table} SET timestamp = CURRENT_TIMESTAMP WHERE timestamp IS NULL")
+    cursor.execute(f"""
+        ALTER TABLE {table}
+        MODIFY timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        DROP PRIMARY KEY,
+        ADD PRIMARY KEY (id, timestamp)
+    """)
+    oldest = _scalar(cursor, f"SELECT MIN(timestamp) FROM {table}")
+    first = _month(oldest or date.today())
+    last = _add_months(_month(date.today()), months_ahead)
+    months = []
+    month = first
+    while month <= last:
+        months.append(month)
+        month = _add_months(month, 1)
+    cursor.execute(f"""
+        ALTER TABLE {table} PARTITION BY RANGE (TO_DAYS(timestamp)) (
+            {_partition_definitions(months)},
+            PARTITION {CATCH_ALL_PARTITION} VALUES LESS THAN MAXVALUE
+        )
+    """)
+
+
+def maintain_partitions(conn=None, months_ahead=MONTHS_AHEAD, retention_months=RETENTION_MONTHS):
+    """Create upcoming monthly partitions and drop the ones past retention"""
+    own_connection = conn is None
+    conn = conn or get_connection()
+    cursor = conn.cursor()
+    result = {}
+    try:
+        this_month = _month(date.today())
+        for table in PARTITIONED_TABLES:
+            names = [name for name in partitions(cursor, table) if name != CATCH_ALL_PARTITION]
+            if not names:
+                continue
+            added, dropped = [], []
+
+            newest = _partition_month(names[-1])
+            upcoming = []
+            month = _add_months(newest, 1)
+            while month <= _add_months(this_month, months_ahead):
+                upcoming.append(month)
+                month = _add_months(month, 1)
+            if upcoming:
+                # Splitting the catch-all only moves rows dated in the future, normally none
+                cursor.execute(f"""
+                    ALTER TABLE {table} REORGANIZE PARTITION {CATCH_ALL_PARTITION} INTO (
+                        {_partition_definitions(upcoming)},
+                        PARTITION {CATCH_ALL_PARTITION} VALUES LESS THAN MAXVALUE
+                    )
+                """)
+                added = [partition_name(month) for month in upcoming]
+
+            if retention_months > 0:
+                cutoff = _add_months(this_month, -retention_months)
+                dropped = [name for name in names if _partition_month(name) < cutoff]
+                if dropped:
+                    cursor.execute(f"ALTER TABLE {table} DROP PARTITION {', '.join(dropped)}")
+
+            result[table] = {"added": added, "dropped": dropped}
+            if added or dropped:
+                logger.info(f"Partitions for {table}: added {added}, dropped {dropped}")
+        return result
+    finally:
+        cursor.close()
+        if own_connection:
+            conn.close()
+
+
+# ---------- migrations ----------
+
+def create_base_tables(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS chat_logs (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        user_id VARCHAR(100),
+        message TEXT NOT NULL,
+        sender ENUM('user', 'bot') NOT NULL,
+        sales_flag VARCHAR(50),
+        success_flag ENUM('Yes', 'No') DEFAULT 'No',
+        intent VARCHAR(50),
+        context_snapshot TEXT
+    )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_nodes (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            convo_id VARCHAR(64),
+            node_id INT,
+            parent_id INT,
+            user_id VARCHAR(255),
+            message TEXT,
+            sender VARCHAR(10),
+            topic VARCHAR(100),
+            intent VARCHAR(100),
+            sales_flag BOOLEAN,
+            success_flag BOOLEAN,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100),
+            email VARCHAR(100) UNIQUE,
+            phone VARCHAR(20),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    if not column_exists(cursor, "chat_logs", "success_flag"):
+        cursor.execute("ALTER TABLE chat_logs ADD COLUMN success_flag ENUM('Yes', 'No') DEFAULT 'No'")
+
+
+def add_website_id(cursor):
+    if not column_exists(cursor, "chat_logs", "website_id"):
+        cursor.execute("""
+            ALTER TABLE chat_logs
+            ADD COLUMN website_id VARCHAR(100) NOT NULL DEFAULT 'default' AFTER user_id
+        """)
+
+
+def numeric_sales_flag(cursor):
+    """sales_flag was VARCHAR; comparing it to 1 forced a cast per row and skipped indexes"""
+    cursor.execute("""
+        UPDATE chat_logs SET sales_flag = '0'
+        WHERE sales_flag IS NULL OR sales_flag NOT IN ('0', '1')
+    """)
+    cursor.execute("ALTER TABLE chat_logs MODIFY sales_flag TINYINT(1) NOT NULL DEFAULT 0")
+
+
+def add_query_indexes(cursor):
+    # learning.fetch_unsuccessful_sales: users with a sales_flag = 1 AND success_flag = 'No' (ENUM) turn
+    add_index(cursor, "chat_logs", "idx_chat_logs_sales_user_time", "sales_flag, success_flag, user_id, timestamp")
+    # Per-website analytics over a time range
+    add_index(cursor, "chat_logs", "idx_chat_logs_website_time", "website_id, timestamp")
+    # retrain_classifier: user messages streamed in id order
+    add_index(cursor, "chat_logs", "idx_chat_logs_sender_id", "sender, id")
+    add_index(cursor, "conversation_nodes", "idx_nodes_convo_node", "convo_id, node_id")
+    add_index(cursor, "conversation_nodes", "idx_nodes_parent", "parent_id")
+    add_index(cursor, "conversation_nodes", "idx_nodes_sales_time", "sales_flag, success_flag, timestamp")
+
+
+def partition_tables(cursor):
+    for table in PARTITIONED_TABLES:
+        partition_by_month(cursor, table)
+
+
+def conversation_tree_paths(cursor):
+    """Materialized paths for tree_store: subtree and branch queries become index range scans"""
+    import tree_store
+
+    for column, definition in (("path", "VARCHAR(2048) NOT NULL DEFAULT ''"),
+                               ("depth", "SMALLINT NOT NULL DEFAULT 0"),
+                               ("branch", "VARCHAR(255) NOT NULL DEFAULT ''"),
+                               ("child_count", "INT NOT NULL DEFAULT 0")):
+        if not column_exists(cursor, "conversation_nodes", column):
+            cursor.execute(f"ALTER TABLE conversation_nodes ADD COLUMN {column} {definition}")
+    add_index(cursor, "conversation_nodes", "idx_nodes_convo_path", "convo_id, path(255)")
+    add_index(cursor, "conversation_nodes", "idx_nodes_topic_branch", "topic, branch, depth")
+    tree_store.backfill_paths(cursor)
+
+
+def conversation_user_index(cursor):
+    """tree_store.append_turn finds (and locks) a user's latest node by user and time"""
+    add_index(cursor, "conversation_nodes", "idx_nodes_user_time", "user_id, timestamp")
+
+
+def matched_intent_column(cursor):
+    """Keyword-matcher guesses get their own column; chat_logs.intent holds training labels only"""
+    if not column_exists(cursor, "chat_logs", "matched_intent"):
+        cursor.execute("ALTER TABLE chat_logs ADD COLUMN matched_intent VARCHAR(50) NULL AFTER intent")
+
+
+def chat_logs_user_index(cursor):
+    """learning.fetch_unsuccessful_sales reads whole conversations by user in time order"""
+    add_index(cursor, "chat_logs", "idx_chat_logs_user_time", "user_id, timestamp")
+
+
+def nullable_labels(cursor):
+    """NULL marks an unlabeled turn; sales_flag defaulted to 0 and intent held the string 'None'.
+
+    Rows without an explicit intent only carry that default or a keyword
+    match, neither of which is a label, so their sales_flag becomes NULL.
+    """
+    cursor.execute("ALTER TABLE chat_logs MODIFY sales_flag TINYINT(1) NULL DEFAULT NULL")
+    cursor.execute("UPDATE chat_logs SET intent = NULL WHERE intent IN ('', 'None', 'none')")
+    cursor.execute("UPDATE chat_logs SET sales_flag = NULL WHERE intent IS NULL")
+
+
+# (version, name, step) in the order they are applied; never renumber or edit applied steps
+MIGRATIONS = [
+    (1, "create_base_tables", create_base_tables),
+    (2, "chat_logs_website_id", add_website_id),
+    (3, "chat_logs_numeric_sales_flag", numeric_sales_flag),
+    (4, "query_indexes", add_query_indexes),
+    (5, "monthly_partitions", partition_tables),
+    (6, "conversation_tree_paths", conversation_tree_paths),
+    (7, "conversation_nodes_user_index", conversation_user_index),
+    (8, "chat_logs_matched_intent", matched_intent_column),
+    (9, "chat_logs_user_index", chat_logs_user_index),
+    (10, "chat_logs_nullable_labels", nullable_labels),
+]
+
+
+def applied_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(target=None):
+    """Apply pending migrations up to target (default: all); returns the names applied"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    applied = []
+    try:
+        done = applied_versions(cursor)
+        for version, name, step in MIGRATIONS:
+            if version in done or (target is not None and version > target):
+                continue
+            print(f"⏫ Applying migration {version:03d} {name}...")
+            step(cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            conn.commit()
+            applied.append(name)
+        return applied
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def status():
+    """(version, name, applied) for every known migration"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        done = applied_versions(cursor)
+        return [(version, name, version in done) for version, name, _ in MIGRATIONS]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if command == "migrate":
+        applied = migrate()
+        print(f"✅ Applied {len(applied)} migrations" if applied else "✅ Schema is up to date")
+    elif command == "status":
+        for version, name, done in status():
+            print(f"{'✅' if done else '⏳'} {version:03d} {name}")
+    elif command == "maintain":
+        print(maintain_partitions())
+    else:
+        print("Usage: python migrations.py [migrate|status|maintain]")
@@ -0,0 +1,375 @@
+"""Exact-search vector store for small knowledge bases.
+
+Normalized float32 embeddings live in one memory-mapped file per website
+(vectors.f32) and texts/metadata in a JSON sidecar (docs.json). A query is a
+single matrix-vector product, so there is no SQLite client, HNSW index or
+background thread per tenant. Stores that grow past NUMPY_STORE_MAX_VECTORS
+are promoted to Chroma, and Chroma knowledge bases at or under it can be
+demoted to NumPy (demote_small_tenants, run nightly by scheduler.py).
+"""
+import os
+import json
+import uuid
+import shutil
+import logging
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+import vector_index
+
+logger = logging.getLogger(__name__)
+
+# Tenants up to this many chunks stay on the NumPy backend
+NUMPY_STORE_MAX_VECTORS = int(os.getenv("NUMPY_STORE_MAX_VECTORS", "5000"))
+
+VECTORS_FILE = "vectors.f32"
+SIDECAR_FILE = "docs.json"
+
+
+def website_store_path(website_id):
+    return f"./numpy_db_{website_id}"
+
+
+def store_exists(path):
+    return os.path.exists(os.path.join(path, SIDECAR_FILE))
+
+
+def use_numpy_backend(numpy_path, chroma_path):
+    """Existing NumPy stores stay put; new tenants start on NumPy; Chroma tenants stay on Chroma
+    until demote_from_chroma moves them over"""
+    if store_exists(numpy_path):
+        return True
+    return NUMPY_STORE_MAX_VECTORS > 0 and not os.path.exists(chroma_path)
+
+
+_open_stores = {}
+_open_stores_lock = threading.Lock()
+
+
+def open_store(path, embedding_function):
+    """Shared store instance per directory, so the sidecar is parsed once per process"""
+    with _open_stores_lock:
+        store = _open_stores.get(path)
+        if store is None:
+            store = _open_stores[path] = NumpyVectorStore(path, embedding_function)
+        return store
+
+
+def forget_store(path):
+    """Drop the cached instance after its directory is removed or promoted"""
+    with _open_stores_lock:
+        _open_stores.pop(path, None)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+_COMPARISONS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+}
+
+
+def matches_filter(metadata, where):
+    """Evaluate a Chroma-style metadata filter ({"category": "faq"}, {"$and": [...]}, {"n": {"$gt": 1}})"""
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            results = (matches_filter(metadata, clause) for clause in condition)
+            if not (all(results) if key == "$and" else any(results)):
+                return False
+            continue
+        if key.startswith("$"):
+            raise ValueError(f"Unsupported filter operator {key!r}")
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            compare = _COMPARISONS.get(operator)
+            if compare is None:
+                raise ValueError(f"Unsupported filter operator {operator!r}")
+            if not compare(value, operand):
+                return False
+    return True
+
+
+class NumpyVectorStore(VectorStore):
+    """LangChain vector store doing exact cosine top-k over a memory-mapped matrix"""
+
+    def __init__(self, persist_directory, embedding_function):
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self._lock = threading.RLock()
+        self._dim = None
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._load()
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    @property
+    def count(self):
+        return len(self._ids)
+
+    # ---------- persistence ----------
+
+    def _path(self, name):
+        return os.path.join(self.persist_directory, name)
+
+    def _load(self):
+        if not store_exists(self.persist_directory):
+            return
+        with open(self._path(SIDECAR_FILE), "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+        self._dim = sidecar["dim"]
+        self._ids = sidecar["ids"]
+        self._texts = sidecar["texts"]
+        self._metadatas = sidecar["metadatas"]
+        self._map_vectors()
+
+    def _map_vectors(self):
+        # The sidecar is authoritative; bytes past its count are an interrupted append
+        if self._ids:
+            self._vectors = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode="r",
+                                      shape=(len(self._ids), self._dim))
+        else:
+            self._vectors = np.zeros((0, self._dim or 0), dtype=np.float32)
+
+    def _write_sidecar(self):
+        tmp_path = self._path(SIDECAR_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self._dim, "ids": self._ids, "texts": self._texts,
+                       "metadatas": self._metadatas}, f, separators=(",", ":"))
+        os.replace(tmp_path, self._path(SIDECAR_FILE))
+
+    def _append_vectors(self, matrix):
+        os.makedirs(self.persist_directory, exist_ok=True)
+        path = self._path(VECTORS_FILE)
+        valid_bytes = len(self._ids) * (self._dim or 0) * 4
+        with open(path, "ab") as f:
+            f.truncate(valid_bytes)
+            f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+
+    def _rewrite_vectors(self, matrix):
+        os.makedirs(self.persist_directory, exist_ok=True)
+        tmp_path = self._path(VECTORS_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        os.replace(tmp_path, self._path(VECTORS_FILE))
+
+    def persist(self):
+        """Writes are persisted as they happen; kept for Chroma compatibility"""
+
+    # ---------- writes ----------
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        return self.add_embeddings(ids, self.embedding_function.embed_documents(texts), texts, metadatas)
+
+    def add_embeddings(self, ids, embeddings, texts, metadatas):
+        """Store records whose embeddings are already computed (e.g. moved from Chroma)"""
+        ids, texts = list(ids), list(texts)
+        if not ids:
+            return []
+        metadatas = [dict(metadata or {}) for metadata in metadatas]
+        matrix = _normalize(np.asarray(embeddings, dtype=np.float32))
+
+        with self._lock:
+            if self._dim is None:
+                self._dim = matrix.shape[1]
+            elif matrix.shape[1] != self._dim:
+                raise ValueError(f"Embedding dimension {matrix.shape[1]} does not match store dimension {self._dim}")
+            self._append_vectors(matrix)
+            self._ids.extend(ids)
+            self._texts.extend(texts)
+            self._metadatas.extend(metadatas)
+            self._write_sidecar()
+            self._map_vectors()
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return False
+        with self._lock:
+            drop = set(ids)
+            keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in drop]
+            if len(keep) == len(self._ids):
+                return False
+            matrix = np.array(self._vectors[keep], dtype=np.float32)
+            self._vectors = np.zeros((0, self._dim), dtype=np.float32)  # release the old mapping
+            self._rewrite_vectors(matrix)
+            self._ids = [self._ids[i] for i in keep]
+            self._texts = [self._texts[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            self._write_sidecar()
+            self._map_vectors()
+        return True
+
+    def get(self, ids=None, include=None, **kwargs):
+        """Chroma-style lookup of stored records"""
+        with self._lock:
+            wanted = None if ids is None else set(ids)
+            rows = [i for i, doc_id in enumerate(self._ids) if wanted is None or doc_id in wanted]
+            return {
+                "ids": [self._ids[i] for i in rows],
+                "documents": [self._texts[i] for i in rows],
+                "metadatas": [self._metadatas[i] for i in rows],
+            }
+
+    # ---------- search ----------
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, **kwargs):
+        """Exact top-k; `filter` takes Chroma's metadata filter syntax, other search options are rejected"""
+        unsupported = sorted(key for key, value in kwargs.items() if value is not None)
+        if unsupported:
+            raise ValueError(f"NumpyVectorStore does not support {', '.join(unsupported)}")
+        with self._lock:
+            vectors, texts, metadatas = self._vectors, self._texts, self._metadatas
+        if not len(texts):
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        rows = None
+        if filter:
+            rows = np.array([i for i, metadata in enumerate(metadatas) if matches_filter(metadata, filter)],
+                            dtype=np.int64)
+            if not len(rows):
+                return []
+            scores = vectors[rows] @ query
+        else:
+            scores = vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        # Cosine distance, matching Chroma's lower-is-closer convention
+        return [(Document(page_content=texts[i], metadata=dict(metadatas[i])), 1.0 - float(score))
+                for i, score in zip(top if rows is None else rows[top], scores[top])]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k=k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k, **kwargs)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return lambda distance: 1.0 - distance
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, **kwargs):
+        store = cls(persist_directory or website_store_path("default"), embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    # ---------- promotion ----------
+
+    def export_records(self):
+        """Ids, embeddings, documents and metadatas for moving into another store"""
+        with self._lock:
+            return {"ids": list(self._ids), "embeddings": np.array(self._vectors).tolist(),
+                    "documents": list(self._texts), "metadatas": list(self._metadatas)}
+
+
+def promote_to_chroma(store, chroma_path, collection_metadata=None, collection_name="langchain"):
+    """Move a NumPy store into a Chroma collection and remove its files"""
+    import chromadb
+
+    records = store.export_records()
+    collection = chromadb.PersistentClient(path=chroma_path).get_or_create_collection(
+        collection_name, metadata=collection_metadata)
+    batch_size = 1000
+    for start in range(0, len(records["ids"]), batch_size):
+        end = start + batch_size
+        # Chroma rejects empty metadata dicts
+        metadatas = [metadata or None for metadata in records["metadatas"][start:end]]
+        collection.add(ids=records["ids"][start:end], embeddings=records["embeddings"][start:end],
+                       documents=records["documents"][start:end], metadatas=metadatas)
+    shutil.rmtree(store.persist_directory, ignore_errors=True)
+    forget_store(store.persist_directory)
+    logger.info(f"Promoted {len(records['ids'])} vectors from {store.persist_directory} to {chroma_path}")
+    return len(records["ids"])
+
+
+def maybe_promote(store, chroma_path, collection_metadata=None, max_vectors=NUMPY_STORE_MAX_VECTORS):
+    """Promote a NumPy store to Chroma once it outgrows the exact-search threshold"""
+    if isinstance(store, NumpyVectorStore) and store.count > max_vectors:
+        promote_to_chroma(store, chroma_path, collection_metadata)
+        return True
+    return False
+
+
+def demote_from_chroma(chroma_base_path, numpy_path, max_vectors=NUMPY_STORE_MAX_VECTORS,
+                       collection_name=vector_index.COLLECTION_NAME):
+    """Move a Chroma knowledge base with at most max_vectors records into a NumPy store.
+
+    Stored embeddings are reused. The NumPy store is built in a staging
+    directory and renamed into place before the Chroma index is dropped,
+    so readers see either store, complete. Returns the number of vectors
+    moved, or None if the knowledge base stays on Chroma.
+    """
+    import chromadb
+
+    source_path = vector_index.resolve_index_path(chroma_base_path)
+    if max_vectors <= 0 or store_exists(numpy_path) or not os.path.isdir(source_path):
+        return None
+    try:
+        collection = chromadb.PersistentClient(path=source_path).get_collection(collection_name)
+    except Exception as e:
+        logger.warning(f"Not demoting {source_path}: {e}")
+        return None
+    if collection.count() > max_vectors:
+        return None
+
+    staging = f"{numpy_path}.demote"
+    shutil.rmtree(staging, ignore_errors=True)
+    store = NumpyVectorStore(staging, None)
+    moved = 0
+    for batch in vector_index.iter_records(collection):
+        store.add_embeddings(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+        moved += len(batch["ids"])
+    if collection.count() != moved:
+        # Written to while copying; try again on the next run
+        shutil.rmtree(staging, ignore_errors=True)
+        return None
+    if moved:
+        os.rename(staging, numpy_path)
+    forget_store(numpy_path)
+    # An empty tenant without a Chroma directory starts on NumPy by itself
+    vector_index.drop_index(chroma_base_path)
+    logger.info(f"Demoted {moved} vectors from {source_path} to {numpy_path}")
+    return moved
+
+
+def demote_small_tenants(website_ids, max_vectors=NUMPY_STORE_MAX_VECTORS):
+    """{website_id: vectors moved} for every Chroma tenant small enough for the NumPy backend"""
+    demoted = {}
+    for website_id in website_ids:
+        try:
+            moved = demote_from_chroma(vector_index.website_base_path(website_id),
+                                       website_store_path(website_id), max_vectors)
+        except Exception as e:
+            logger.warning(f"Could not demote {website_id} to NumPy: {e}")
+            continue
+        if moved is not None:
+            demoted[website_id] = moved
+    return demoted
@@ -0,0 +1,106 @@
+"""Origin/Referer to website resolution.
+
+allowed_origins entries are compiled into an exact host map
+("www.sourceselect.ca" -> "sourceselect.ca") and a trie of reversed domain
+labels for wildcard entries ("*.example.com"). A lookup is one dict probe
+plus a walk over the request host's labels, independent of the number of
+websites, and recent (origin, referer) pairs are answered from an LRU cache.
+Hosts must match exactly, so "sourceselect.ca.evil.com" no longer passes
+for "sourceselect.ca".
+"""
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+LRU_SIZE = 4096
+
+_WILDCARD = "*"
+_MATCH = object()   # trie key holding the website_id of a wildcard entry
+
+
+def normalize_host(value):
+    """Lowercase host[:port] of an origin, URL or bare host; '' if there is none"""
+    if not value:
+        return ""
+    value = value.strip()
+    parts = urlsplit(value if "//" in value else f"//{value}")
+    host = (parts.hostname or "").rstrip(".")
+    if not host:
+        return ""
+    default_port = {"http": 80, "https": 443}.get(parts.scheme)
+    try:
+        port = parts.port
+    except ValueError:
+        return ""
+    return f"{host}:{port}" if port and port != default_port else host
+
+
+class OriginIndex:
+    """Exact host map plus wildcard suffix trie, rebuilt whenever website configs change"""
+
+    def __init__(self, configs=None):
+        self._lock = threading.Lock()
+        self._exact = {}
+        self._trie = {}
+        self._cache = OrderedDict()
+        self._generation = 0
+        if configs:
+            self.rebuild(configs)
+
+    def rebuild(self, configs):
+        exact, trie = {}, {}
+        for website_id, config in configs.items():
+            for allowed in config.get("allowed_origins", []) or []:
+                allowed = (allowed or "").strip().lower()
+                if not allowed or allowed == _WILDCARD:
+                    continue  # catch-all entries are the default fallback, not a match
+                wildcard = "://*." in allowed or allowed.startswith("*.")
+                host = normalize_host(allowed.replace("*.", "", 1) if wildcard else allowed)
+                if not host:
+                    continue
+                if wildcard:
+                    node = trie
+                    for label in reversed(host.split(".")):
+                        node = node.setdefault(label, {})
+                    node.setdefault(_MATCH, website_id)
+                else:
+                    exact.setdefault(host, website_id)
+        with self._lock:
+            self._exact, self._trie = exact, trie
+            self._generation += 1
+            self._cache.clear()
+
+    def _match_host(self, host):
+        website_id = self._exact.get(host)
+        if website_id is not None or not host:
+            return website_id
+        # Deepest wildcard entry that is a proper suffix of the host
+        node, best = self._trie, None
+        labels = host.split(":")[0].split(".")
+        for depth, label in enumerate(reversed(labels), start=1):
+            node = node.get(label)
+            if node is None:
+                break
+            if _MATCH in node and depth < len(labels):
+                best = node[_MATCH]
+        return best
+
+    def resolve(self, origin="", referer=""):
+        """website_id whose allowed origins match Origin (preferred) or Referer, else None"""
+        key = (origin or "", referer or "")
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            generation = self._generation
+        website_id = self._match_host(normalize_host(origin)) or self._match_host(normalize_host(referer))
+        with self._lock:
+            if generation != self._generation:
+                return website_id  # rebuilt meanwhile; don't cache a stale answer
+            self._cache[key] = website_id
+            if len(self._cache) > LRU_SIZE:
+                self._cache.popitem(last=False)
+        return website_id
+
+
+index = OriginIndex()
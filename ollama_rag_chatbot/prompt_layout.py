@@ -0,0 +1,68 @@
+"""Chat prompts laid out for provider-side prefix caching.
+
+Ollama reuses the KV cache of the longest prompt prefix it has already
+evaluated, and OpenAI bills and serves repeated prefixes from its prompt
+cache. Both only help if requests share a byte-identical beginning, so chat
+prompts are assembled as:
+
+    1. static      the website's persona + the prompt template's instructions
+    2. semi-static the retrieved context
+    3. dynamic     the visitor's name and question
+
+The static prefix is built once per (template, persona) and reused verbatim.
+Ollama models are kept loaded for OLLAMA_KEEP_ALIVE so their cache survives
+quiet periods between chats.
+"""
+import os
+import re
+from functools import lru_cache
+
+# How long Ollama keeps a model (and its prompt cache) loaded after a request
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+PERSONA = (
+    "You are {bot_name}, a friendly assistant at {website_name}. "
+    "Always answer in raw HTML (e.g., <br>, <ul>), no Markdown. "
+    "Always end your message with a helpful follow-up question."
+)
+# Used when a template has neither {context} nor {question}
+DEFAULT_TAIL = "\n\nRelevant Info:\n{context}\n\nUser Question: {question}\n\nResponse:"
+_FIELDS = re.compile(r"(\{context\}|\{question\})")
+# Goes on its own line right before the line with {question}, or at the end without one
+NAME_LINE = "You are helping a user named {name}.\n"
+
+
+class PromptLayout:
+    """A prompt template split into its cacheable prefix and its per-request tail"""
+
+    def __init__(self, template, bot_name="Assistant", website_name="Website"):
+        if not isinstance(template, str):
+            # A website without a custom prompt (None) gets the persona and DEFAULT_TAIL
+            template = DEFAULT_TAIL.lstrip("\n")
+        positions = [index for index in (template.find("{context}"), template.find("{question}")) if index >= 0]
+        split = min(positions) if positions else len(template)
+        # The template is a str.format string; its prefix has no fields left, only escaped braces
+        static = template[:split].replace("{{", "{").replace("}}", "}")
+        self.prefix = PERSONA.format(bot_name=bot_name, website_name=website_name) + "\n\n" + static.lstrip("\n")
+        self.tail = template[split:] if positions else DEFAULT_TAIL
+        question_at = self.tail.find("{question}")
+        self.name_at = self.tail.rfind("\n", 0, question_at) + 1 if question_at >= 0 else len(self.tail)
+
+    def render(self, context, question, name=None):
+        # Only {context} and {question} are filled in; any other {field} in a custom prompt
+        # stays as written instead of failing the chat, and braces in the context are never parsed
+        values = {"{context}": context, "{question}": question}
+
+        def fill(text):
+            return "".join(values.get(part, part.replace("{{", "{").replace("}}", "}"))
+                           for part in _FIELDS.split(text))
+
+        head = self.prefix + fill(self.tail[:self.name_at])
+        if name:
+            head += ("" if head.endswith("\n") else "\n") + NAME_LINE.replace("{name}", name)
+        return head + fill(self.tail[self.name_at:])
+
+
+@lru_cache(maxsize=256)
+def layout_for(template, bot_name="Assistant", website_name="Website"):
+    return PromptLayout(template, bot_name, website_name)
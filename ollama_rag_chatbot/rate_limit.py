@@ -0,0 +1,281 @@
+"""Rate limiting and admission control for /chat.
+
+A chat request is admitted only while the number of chats in flight, for
+its website and for the whole process, stays under a cap, and only if it can
+take a token from two buckets: the visitor's (website_id + user_id) and the
+website's. Buckets refill continuously at `rate` tokens per second up to
+`burst`. Everything else gets an immediate 429 with a Retry-After instead of
+queueing behind the LLM.
+
+/chat admits in two steps so coalesced requests (see single_flight) are not
+shed: admit_visitor() takes the visitor's token for every request, and
+admit_generation() reserves the in-flight slot and takes the website's token
+only for requests that actually run a generation.
+
+Buckets live in process memory. When RATE_LIMIT_REDIS_URL is set (Redis or
+any server speaking its protocol, e.g. Valkey/KeyDB) and the redis package
+is installed, they are kept there instead so that several app nodes share
+one budget. Limits can be overridden per website with a "rate_limits" entry
+in its config, e.g. {"user": {"rate": 0.2, "burst": 3}, "max_concurrent": 4}.
+"""
+import os
+import math
+import time
+import logging
+import threading
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+DEFAULT_LIMITS = {
+    "user": {"rate": 0.5, "burst": 5},         # one visitor: a message every 2s, bursts of 5
+    "website": {"rate": 10.0, "burst": 30},    # all visitors of one website
+    "max_concurrent": 8,                       # chats of one website in flight at once
+}
+# Chats in flight across all websites before new ones are shed
+MAX_INFLIGHT = int(os.getenv("CHAT_MAX_INFLIGHT", "32"))
+REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+REDIS_KEY_PREFIX = "ratelimit:"
+
+# Idle buckets are dropped from memory once they would be full again anyway
+PRUNE_INTERVAL = 60.0
+# Initial guess of a chat's duration, used for Retry-After when shedding
+DEFAULT_SERVICE_TIME = 2.0
+
+chat_rejected_total = tracing.registry.counter(
+    "chat_rejected_total", "Chat requests rejected by rate limiting or load shedding",
+    ("website_id", "reason"))
+
+
+def resolve_limits(overrides=None):
+    """DEFAULT_LIMITS merged with a website's "rate_limits" config"""
+    limits = {
+        "user": dict(DEFAULT_LIMITS["user"]),
+        "website": dict(DEFAULT_LIMITS["website"]),
+        "max_concurrent": DEFAULT_LIMITS["max_concurrent"],
+    }
+    for key, value in (overrides or {}).items():
+        if key in ("user", "website") and isinstance(value, dict):
+            limits[key].update(value)
+        elif key == "max_concurrent":
+            limits[key] = value
+    return limits
+
+
+# ================================
+# Token bucket stores
+# ================================
+
+class MemoryBucketStore:
+    """Token buckets in a dict, for a single process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}   # key -> [tokens, updated, full_after]
+        self._next_prune = time.monotonic() + PRUNE_INTERVAL
+
+    def take(self, key, rate, burst, cost=1):
+        """(allowed, retry_after_seconds) after trying to take `cost` tokens"""
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_prune:
+                self._prune(now)
+            bucket = self._buckets.get(key)
+            tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                allowed, retry_after = True, 0.0
+            else:
+                allowed, retry_after = False, (cost - tokens) / rate
+            self._buckets[key] = [tokens, now, now + (burst - tokens) / rate]
+        return allowed, retry_after
+
+    def _prune(self, now):
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        self._next_prune = now + PRUNE_INTERVAL
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# Refill and take in one round trip, atomically for all nodes
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed, retry_after = 0, 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+
+class RedisBucketStore:
+    """Token buckets shared by several nodes through a Redis-compatible server"""
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+        # Used while the server is unreachable, so an outage degrades to per-node limits
+        self.fallback = MemoryBucketStore()
+
+    def take(self, key, rate, burst, cost=1):
+        try:
+            allowed, retry_after = self._take(keys=[REDIS_KEY_PREFIX + key], args=[rate, burst, time.time(), cost])
+            return bool(int(allowed)), float(retry_after)
+        except redis.RedisError as e:
+            logger.warning(f"Rate limit store unavailable, limiting locally: {e}")
+            return self.fallback.take(key, rate, burst, cost)
+
+    def clear(self):
+        self.fallback.clear()
+        try:
+            for key in self.client.scan_iter(REDIS_KEY_PREFIX + "*"):
+                self.client.delete(key)
+        except redis.RedisError as e:
+            logger.warning(f"Could not clear rate limit store: {e}")
+
+
+def create_store(url=REDIS_URL):
+    if url:
+        if redis is not None:
+            logger.info(f"Rate limit buckets shared via {url}")
+            return RedisBucketStore(url)
+        logger.warning("RATE_LIMIT_REDIS_URL is set but the redis package is not installed; limiting per node")
+    return MemoryBucketStore()
+
+
+# ================================
+# Admission control
+# ================================
+
+class Admission:
+    """Outcome of ChatLimiter.admit(); call release() when an admitted chat finishes"""
+
+    def __init__(self, limiter, website_id, allowed, reason=None, retry_after=0.0, holds_slot=True):
+        self.limiter = limiter
+        self.website_id = website_id
+        self.allowed = allowed
+        self.reason = reason
+        self.retry_after = retry_after
+        self._started = time.monotonic() if allowed and holds_slot else None
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+    def release(self):
+        if self._started is not None:
+            self.limiter._release(self.website_id, time.monotonic() - self._started)
+            self._started = None
+
+
+class Rejected(Exception):
+    """Raised inside a generation that admit_generation() shed; carries the Admission"""
+
+    def __init__(self, admission):
+        super().__init__(f"Chat rejected: {admission.reason}")
+        self.admission = admission
+
+
+class ChatLimiter:
+    """Per-user and per-website token buckets plus in-flight caps"""
+
+    def __init__(self, store=None, max_inflight=MAX_INFLIGHT):
+        self.store = store or create_store()
+        self.max_inflight = max_inflight
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._inflight_by_website = {}
+        self._service_time = DEFAULT_SERVICE_TIME   # EWMA of admitted chat durations
+
+    def admit(self, website_id, user_id, overrides=None):
+        """Slot, visitor token and website token for a chat that always runs its own generation"""
+        return self._admit(website_id, resolve_limits(overrides), user_id)
+
+    def admit_visitor(self, website_id, user_id, overrides=None):
+        """Only the visitor's token; holds no slot, so release() is a no-op"""
+        limits = resolve_limits(overrides)
+        allowed, retry_after = self.store.take(f"user:{website_id}:{user_id}",
+                                               limits["user"]["rate"], limits["user"]["burst"])
+        if not allowed:
+            return self._reject(website_id, "user_rate", retry_after)
+        return Admission(self, website_id, True, holds_slot=False)
+
+    def admit_generation(self, website_id, overrides=None):
+        """Slot and website token for a generation whose visitor passed admit_visitor()"""
+        return self._admit(website_id, resolve_limits(overrides))
+
+    def _admit(self, website_id, limits, user_id=None):
+        # Reserve an in-flight slot first, so shed requests don't spend anyone's tokens
+        with self._lock:
+            website_inflight = self._inflight_by_website.get(website_id, 0)
+            if self._inflight >= self.max_inflight:
+                shed = ("overloaded", self._inflight, self.max_inflight)
+            elif website_inflight >= limits["max_concurrent"]:
+                shed = ("website_busy", website_inflight, limits["max_concurrent"])
+            else:
+                shed = None
+                self._inflight += 1
+                self._inflight_by_website[website_id] = website_inflight + 1
+            service_time = self._service_time
+        if shed:
+            reason, depth, capacity = shed
+            # Roughly when a slot frees up if the chats ahead finish at the usual pace
+            return self._reject(website_id, reason, service_time * (depth - capacity + 1) / max(1, capacity))
+
+        # The visitor's own bucket first, so one visitor cannot drain the website's budget
+        buckets = [("website_rate", f"website:{website_id}", limits["website"])]
+        if user_id is not None:
+            buckets.insert(0, ("user_rate", f"user:{website_id}:{user_id}", limits["user"]))
+        for reason, key, bucket in buckets:
+            allowed, retry_after = self.store.take(key, bucket["rate"], bucket["burst"])
+            if not allowed:
+                self._release(website_id)
+                return self._reject(website_id, reason, retry_after)
+        return Admission(self, website_id, True)
+
+    def _reject(self, website_id, reason, retry_after):
+        chat_rejected_total.inc(website_id=website_id, reason=reason)
+        return Admission(self, website_id, False, reason, retry_after)
+
+    def _release(self, website_id, duration=None):
+        with self._lock:
+            self._inflight = max(0, self._inflight - 1)
+            remaining = self._inflight_by_website.get(website_id, 1) - 1
+            if remaining > 0:
+                self._inflight_by_website[website_id] = remaining
+            else:
+                self._inflight_by_website.pop(website_id, None)
+            if duration is not None:
+                self._service_time += 0.2 * (duration - self._service_time)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "inflight": self._inflight,
+                "max_inflight": self.max_inflight,
+                "inflight_by_website": dict(self._inflight_by_website),
+                "avg_service_time": round(self._service_time, 3),
+            }
+
+
+limiter = ChatLimiter()
@@ -0,0 +1,217 @@
+"""Point-in-time restore from snapshot manifests (see snapshots.py).
+
+Vector stores are restored into a fresh versioned directory and switched in
+through the index pointer, so running chats keep their current store until
+the restored one is complete. Upload folders are synced file by file:
+files whose content already matches the snapshot are left alone.
+
+Global snapshots list the websites they cover in meta["websites"] and hold
+each one's knowledge base under websites/<website_id>/, so a global restore
+brings every website's vectors back in line with the restored uploads.
+Older global snapshots have no per-website knowledge bases; restoring one
+leaves them as they are and reports them in "websites_not_restored".
+"""
+import os
+import shutil
+import hashlib
+import logging
+from datetime import datetime
+
+import snapshots
+import vector_index
+import numpy_store
+
+logger = logging.getLogger(__name__)
+
+
+def _entries_under(manifest, prefix):
+    """{relative path: entry} for manifest entries below a logical prefix"""
+    prefix = prefix.rstrip("/") + "/"
+    return {path[len(prefix):]: entry for path, entry in manifest["entries"].items() if path.startswith(prefix)}
+
+
+def _matches(path, entry):
+    """True if the file at path already has the entry's content"""
+    try:
+        if os.path.getsize(path) != entry["size"]:
+            return False
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(snapshots.HASH_CHUNK), b""):
+                digest.update(chunk)
+        return digest.hexdigest() == entry["sha256"]
+    except OSError:
+        return False
+
+
+def materialize(store, entries, destination):
+    """Write entries into a new directory; returns bytes restored"""
+    restored = 0
+    for rel, entry in entries.items():
+        store.copy_blob(entry["sha256"], os.path.join(destination, *rel.split("/")))
+        restored += entry["size"]
+    return restored
+
+
+def sync_directory(store, entries, destination):
+    """Make destination match entries, rewriting only files whose content differs"""
+    stats = {"written": 0, "unchanged": 0, "removed": 0}
+    wanted = set()
+    for rel, entry in entries.items():
+        target = os.path.join(destination, *rel.split("/"))
+        wanted.add(os.path.normpath(target))
+        if _matches(target, entry):
+            stats["unchanged"] += 1
+        else:
+            store.copy_blob(entry["sha256"], target)
+            stats["written"] += 1
+    if os.path.isdir(destination):
+        for dirpath, _, filenames in os.walk(destination):
+            for name in filenames:
+                path = os.path.normpath(os.path.join(dirpath, name))
+                if path not in wanted:
+                    os.remove(path)
+                    stats["removed"] += 1
+    return stats
+
+
+def restore_vector_index(store, entries, base_path):
+    """Restore a Chroma directory as a new index version and switch readers to it"""
+    version_path = (f"{os.path.normpath(base_path)}{vector_index.VERSION_MARKER}"
+                    f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+    try:
+        restored = materialize(store, entries, version_path)
+    except Exception:
+        shutil.rmtree(version_path, ignore_errors=True)
+        raise
+    # A rebuild running now would switch back to its copy of the old index
+    with vector_index.write_lock(base_path):
+        vector_index.switch_index(base_path, version_path)
+    vector_index.prune_versions(base_path, keep=1)
+    return {"path": version_path, "files": len(entries), "bytes": restored}
+
+
+def restore_directory_swap(store, entries, path):
+    """Restore a small directory next to the live one and rename it into place"""
+    staging = f"{path}.restore"
+    retired = f"{path}.old"
+    shutil.rmtree(staging, ignore_errors=True)
+    materialize(store, entries, staging)
+    if os.path.exists(path):
+        shutil.rmtree(retired, ignore_errors=True)
+        os.rename(path, retired)
+    os.rename(staging, path)
+    shutil.rmtree(retired, ignore_errors=True)
+    return {"path": path, "files": len(entries)}
+
+
+def retire_directory(path):
+    """Remove a store directory, renaming it first so readers never see it half deleted"""
+    if not os.path.exists(path):
+        return False
+    retired = f"{path}.old"
+    shutil.rmtree(retired, ignore_errors=True)
+    os.rename(path, retired)
+    shutil.rmtree(retired, ignore_errors=True)
+    return True
+
+
+def restore_website(snapshot_id, website_id, restore_prompt=True, store=None):
+    """Restore one website's knowledge base, uploads and prompt from a snapshot.
+
+    Website snapshots (scope == website_id) and global snapshots (which
+    contain uploads/<website_id>) are both accepted. A website snapshot, or
+    a global one listing its websites, holds the website's whole knowledge
+    base, so store types it does not contain are removed: a NumPy store
+    left behind would otherwise keep being preferred over a restored Chroma
+    index. Returns a result dict; the caller applies result["prompt"] and
+    drops cached chains.
+    """
+    store = store or snapshots.default_store
+    manifest = store.load_manifest(snapshot_id)
+    result = {"snapshot_id": snapshot_id, "website_id": website_id}
+
+    if manifest.get("scope") == website_id:
+        kb_entries = _entries_under(manifest, "knowledge_base")
+        numpy_entries = _entries_under(manifest, "numpy_knowledge_base")
+        upload_entries = _entries_under(manifest, "uploads")
+        prompt_entry = manifest["entries"].get("prompt.txt")
+        complete = True
+    elif manifest.get("scope") == "global":
+        kb_entries = _entries_under(manifest, f"websites/{website_id}/knowledge_base")
+        numpy_entries = _entries_under(manifest, f"websites/{website_id}/numpy_knowledge_base")
+        upload_entries = _entries_under(manifest, f"uploads/{website_id}")
+        prompt_entry = manifest["entries"].get("config/prompt.txt")
+        complete = "websites" in manifest.get("meta", {})
+    else:
+        raise ValueError(f"Snapshot {snapshot_id} belongs to {manifest.get('scope')}, not {website_id}")
+
+    if kb_entries:
+        result["knowledge_base"] = restore_vector_index(store, kb_entries, vector_index.website_base_path(website_id))
+    if numpy_entries:
+        numpy_path = numpy_store.website_store_path(website_id)
+        result["numpy_knowledge_base"] = restore_directory_swap(store, numpy_entries, numpy_path)
+        numpy_store.forget_store(numpy_path)
+    if complete:
+        retired = []
+        if not numpy_entries:
+            numpy_path = numpy_store.website_store_path(website_id)
+            if retire_directory(numpy_path):
+                retired.append("numpy_knowledge_base")
+            numpy_store.forget_store(numpy_path)
+        if not kb_entries:
+            base_path = vector_index.website_base_path(website_id)
+            if os.path.exists(vector_index.resolve_index_path(base_path)) or vector_index.index_versions(base_path):
+                vector_index.drop_index(base_path)
+                retired.append("knowledge_base")
+        result["retired"] = retired
+    if upload_entries or complete:
+        result["uploads"] = sync_directory(store, upload_entries, f"uploads/{website_id}")
+    if restore_prompt and prompt_entry:
+        result["prompt"] = snapshots.read_text(store, prompt_entry["sha256"])
+
+    logger.info(f"Restored {website_id} from {snapshot_id}: "
+                f"{ {key: value for key, value in result.items() if key != 'prompt'} }")
+    return result
+
+
+def restore_global(snapshot_id, knowledge_base, upload_folder="uploads", restore_prompt=True, store=None,
+                   website_ids=()):
+    """Restore the global knowledge base, all uploads and the websites' knowledge bases.
+
+    website_ids are the websites configured now; those the snapshot does not
+    cover lose their knowledge base along with their uploads.
+    """
+    store = store or snapshots.default_store
+    manifest = store.load_manifest(snapshot_id)
+    if manifest.get("scope") != "global":
+        raise ValueError(f"Snapshot {snapshot_id} is a {manifest.get('scope')} snapshot; restore it per website")
+    result = {"snapshot_id": snapshot_id}
+
+    kb_entries = _entries_under(manifest, "chroma_db")
+    if kb_entries:
+        version_path = (f"{os.path.normpath(knowledge_base.base_path)}{vector_index.VERSION_MARKER}"
+                        f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+        try:
+            restored = materialize(store, kb_entries, version_path)
+            knowledge_base.publish_directory(version_path)
+        except Exception:
+            shutil.rmtree(version_path, ignore_errors=True)
+            raise
+        result["knowledge_base"] = {"path": version_path, "files": len(kb_entries), "bytes": restored}
+
+    result["uploads"] = sync_directory(store, _entries_under(manifest, "uploads"), upload_folder)
+
+    snapshot_websites = manifest.get("meta", {}).get("websites")
+    if snapshot_websites is None:
+        result["websites_not_restored"] = sorted(website_ids)
+    else:
+        result["websites"] = {
+            website_id: restore_website(snapshot_id, website_id, restore_prompt=False, store=store)
+            for website_id in sorted(set(snapshot_websites) | set(website_ids))
+        }
+
+    prompt_entry = manifest["entries"].get("config/prompt.txt")
+    if restore_prompt and prompt_entry:
+        result["prompt"] = snapshots.read_text(store, prompt_entry["sha256"])
+    return result
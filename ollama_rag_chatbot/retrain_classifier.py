@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import zlib
+import logging
+from datetime import datetime
+
+import joblib
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import Pipeline
+from sklearn.metrics import accuracy_score, f1_score, recall_score
+
+from db_model import get_connection
+from sales_intent_classifier import MODEL_PATH, load_seed_training_data
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = "sales_classifier.metrics.json"
+
+# Rows streamed from MySQL and fed to partial_fit per step
+CHUNK_SIZE = 2000
+# Every row whose id hashes into this bucket goes to the holdout set
+HOLDOUT_PERCENT = 10
+# Upper bound on holdout rows kept in memory for evaluation
+MAX_HOLDOUT_ROWS = 20000
+# Quality gates for swapping the live model. Accuracy is not one of them: with a dominant
+# class a model that always predicts it scores well, so every class must also be recalled
+MIN_MACRO_F1 = 0.5
+MAX_MACRO_F1_DROP = 0.02
+MIN_CLASS_RECALL = 0.3
+
+# Label for logged messages explicitly labeled as not sales intent (sales_flag = 0, no intent)
+NON_SALES_LABEL = "none"
+
+
+def build_vectorizer():
+    """Stateless hashing vectorizer; no vocabulary has to fit in memory"""
+    return HashingVectorizer(
+        n_features=2 ** 18,
+        ngram_range=(1, 2),
+        alternate_sign=False,  # MultinomialNB needs non-negative features
+        lowercase=True,
+    )
+
+
+def row_label(row):
+    """Map a chat_logs row to a training label, or None if it is unlabeled.
+
+    Only explicit labels count: NULL intent and sales_flag (migration 10) mean
+    unlabeled, and keyword matches live in matched_intent, which is ignored.
+    """
+    intent = (row.get("intent") or "").strip().lower()
+    if intent and intent != "none":
+        return intent
+    # sales_flag is TINYINT since migration 3; older dumps may still carry strings
+    sales_flag = row.get("sales_flag")
+    if isinstance(sales_flag, str):
+        sales_flag = sales_flag.strip()
+    if sales_flag in (0, False, "0", "false", "False"):
+        return NON_SALES_LABEL
+    return None
+
+
+def is_holdout(row_id):
+    """Deterministic split so the same rows are held out on every run"""
+    return zlib.crc32(str(row_id).encode("utf-8")) % 100 < HOLDOUT_PERCENT
+
+
+def fetch_label_classes():
+    """Distinct labels present in the logs; partial_fit needs them up front"""
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT DISTINCT intent, sales_flag FROM chat_logs
+            WHERE sender = 'user' AND (intent IS NOT NULL OR sales_flag IS NOT NULL)
+        """)
+        return {label for label in (row_label(row) for row in cursor.fetchall()) if label}
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def stream_labeled_chunks(chunk_size=CHUNK_SIZE):
+    """Yield lists of labeled user messages from an unbuffered cursor"""
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True, buffered=False)
+    try:
+        cursor.execute("""
+            SELECT id, message, intent, sales_flag FROM chat_logs
+            WHERE sender = 'user' AND message IS NOT NULL AND (intent IS NOT NULL OR sales_flag IS NOT NULL)
+            ORDER BY id ASC
+        """)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunk = []
+            for row in rows:
+                label = row_label(row)
+                if label:
+                    chunk.append((row["id"], str(row["message"]), label))
+            if chunk:
+                yield chunk
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def evaluate(model, holdout):
+    """Accuracy, macro F1 and per-class recall of a model on the holdout set"""
+    if not holdout:
+        return None
+    texts, labels = zip(*holdout)
+    predicted = model.predict(list(texts))
+    classes = sorted(set(labels))
+    recalls = recall_score(labels, predicted, labels=classes, average=None, zero_division=0)
+    return {
+        "accuracy": round(float(accuracy_score(labels, predicted)), 4),
+        "macro_f1": round(float(f1_score(labels, predicted, average="macro", zero_division=0)), 4),
+        "recall": {label: round(float(recall), 4) for label, recall in zip(classes, recalls)},
+        "holdout_rows": len(holdout)
+    }
+
+
+def quality_gate(candidate_metrics, live_metrics):
+    """Reason the candidate must not replace the live model, or None if it may"""
+    if candidate_metrics is None:
+        return "no holdout rows to evaluate on"
+    if candidate_metrics["macro_f1"] < MIN_MACRO_F1:
+        return f"macro F1 {candidate_metrics['macro_f1']} below {MIN_MACRO_F1}"
+    weak = {label: recall for label, recall in candidate_metrics["recall"].items() if recall < MIN_CLASS_RECALL}
+    if weak:
+        return f"recall below {MIN_CLASS_RECALL} for {weak}"
+    if live_metrics and candidate_metrics["macro_f1"] < live_metrics["macro_f1"] - MAX_MACRO_F1_DROP:
+        return f"macro F1 {candidate_metrics['macro_f1']} worse than live {live_metrics['macro_f1']}"
+    return None
+
+
+def swap_live_model(model, metrics):
+    """Atomically replace the live model file and record its metrics"""
+    tmp_path = MODEL_PATH + ".tmp"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, MODEL_PATH)
+
+    tmp_metrics = METRICS_PATH + ".tmp"
+    with open(tmp_metrics, "w", encoding="utf-8") as f:
+        json.dump(metrics, f, indent=2)
+    os.replace(tmp_metrics, METRICS_PATH)
+
+
+def retrain(chunk_size=CHUNK_SIZE, dry_run=False, allow_new_classes=False):
+    """Stream labeled chat logs into an out-of-core model and swap it in if quality holds.
+
+    A candidate whose label set differs from the live model's (or the seed
+    data's, before the first swap) is only swapped in with allow_new_classes.
+    """
+    started = time.perf_counter()
+
+    seed = load_seed_training_data()
+    classes = sorted({label for _, label in seed} | fetch_label_classes())
+
+    vectorizer = build_vectorizer()
+    classifier = MultinomialNB(alpha=0.1)
+
+    # Seed examples keep the hand-written keyword knowledge in every model
+    seed_texts, seed_labels = zip(*seed)
+    classifier.partial_fit(vectorizer.transform(seed_texts), list(seed_labels), classes=classes)
+
+    holdout = []
+    trained_rows = 0
+    for chunk in stream_labeled_chunks(chunk_size):
+        train_texts, train_labels = [], []
+        for row_id, text, label in chunk:
+            if is_holdout(row_id):
+                if len(holdout) < MAX_HOLDOUT_ROWS:
+                    holdout.append((text, label))
+            else:
+                train_texts.append(text)
+                train_labels.append(label)
+        if train_texts:
+            classifier.partial_fit(vectorizer.transform(train_texts), train_labels)
+            trained_rows += len(train_texts)
+
+    candidate = Pipeline([("vectorizer", vectorizer), ("classifier", classifier)])
+
+    candidate_metrics = evaluate(candidate, holdout)
+    live_metrics = None
+    known_classes = sorted({label for _, label in seed})
+    if os.path.exists(MODEL_PATH):
+        try:
+            live_model = joblib.load(MODEL_PATH)
+            known_classes = sorted(str(label) for label in live_model.classes_)
+            live_metrics = evaluate(live_model, holdout)
+        except Exception as e:
+            logger.warning(f"Could not evaluate live classifier: {e}")
+
+    added = sorted(set(classes) - set(known_classes))
+    removed = sorted(set(known_classes) - set(classes))
+    reason = quality_gate(candidate_metrics, live_metrics)
+    if reason is None and (added or removed) and not allow_new_classes:
+        reason = f"label set changed (added {added}, removed {removed}); rerun with --allow-new-classes"
+    if reason is not None:
+        swapped = False
+    else:
+        swapped, reason = not dry_run, "dry run" if dry_run else "quality gates passed"
+
+    result = {
+        "trained_at": datetime.now().isoformat(),
+        "classes": classes,
+        "classes_added": added,
+        "classes_removed": removed,
+        "seed_rows": len(seed),
+        "trained_rows": trained_rows,
+        "candidate": candidate_metrics,
+        "live": live_metrics,
+        "swapped": swapped,
+        "reason": reason,
+        "duration_seconds": round(time.perf_counter() - started, 3)
+    }
+
+    if swapped:
+        swap_live_model(candidate, result)
+        logger.info(f"Sales classifier swapped: {result}")
+    else:
+        logger.info(f"Sales classifier kept: {result}")
+    print(f"📊 Classifier retrain: {result}")
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Retrain the sales intent classifier from chat logs")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Evaluate without swapping the live model")
+    parser.add_argument("--allow-new-classes", action="store_true",
+                        help="Swap in a model whose label set differs from the live model's")
+    args = parser.parse_args()
+
+    retrain(chunk_size=args.chunk_size, dry_run=args.dry_run, allow_new_classes=args.allow_new_classes)
@@ -0,0 +1,235 @@
+"""Retrieval quality and speed across chunking and k settings.
+
+Builds a throwaway Chroma index from a fixed corpus for every
+(chunk_size, chunk_overlap) pair, runs the labeled query set against it and
+reports recall@k, MRR, index size, build time and query latency:
+
+    python ollama_rag_chatbot/retrieval_benchmark.py
+    python ollama_rag_chatbot/retrieval_benchmark.py --chunks 500:50 1000:200 --k 3 5 8
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+
+# Fixed corpus so numbers are comparable between runs
+CORPUS = [
+    os.path.join(ROOT_DIR, "data", "faq.txt"),
+    os.path.join(ROOT_DIR, "db", "ssdetails.txt"),
+    os.path.join(SCRIPT_DIR, "your_docs", "file-sample_150kB.pdf"),
+]
+
+# {"query": "...", "expected": ["substring that marks a relevant chunk", ...]}
+QUERY_SET = os.path.join(SCRIPT_DIR, "data", "retrieval_queries.jsonl")
+
+# Settings currently used by ingest.py, uploads/crawls and the FAQ editor
+DEFAULT_CHUNK_SETTINGS = [(500, 50), (1000, 100), (1000, 200), (750, 100), (1500, 200)]
+DEFAULT_K_VALUES = [1, 3, 5, 8]
+
+
+class CachedEmbeddings:
+    """Embeddings wrapper that embeds each distinct text once per run.
+
+    Chunks repeat across splitter settings and queries repeat across
+    indexes, so the model only runs on texts it has not seen yet.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self._cache = {}
+        self.embedded_texts = 0
+
+    def embed_documents(self, texts):
+        missing = [text for text in dict.fromkeys(texts) if text not in self._cache]
+        if missing:
+            for text, vector in zip(missing, self.embeddings.embed_documents(missing)):
+                self._cache[text] = vector
+            self.embedded_texts += len(missing)
+        return [self._cache[text] for text in texts]
+
+    def embed_query(self, text):
+        key = ("query", text)
+        if key not in self._cache:
+            self._cache[key] = self.embeddings.embed_query(text)
+        return self._cache[key]
+
+
+def load_corpus(paths=CORPUS):
+    """Load the corpus files as LangChain documents"""
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader
+
+    documents = []
+    for path in paths:
+        if not os.path.exists(path):
+            logger.warning(f"Corpus file missing, skipped: {path}")
+            continue
+        loader = PyPDFLoader(path) if path.lower().endswith(".pdf") else TextLoader(path, encoding="utf-8")
+        documents.extend(loader.load())
+    return documents
+
+
+def load_queries(path=QUERY_SET):
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                queries.append(json.loads(line))
+    return queries
+
+
+def _normalize(text):
+    return " ".join(text.lower().split())
+
+
+def is_relevant(chunk_text, expected):
+    """A chunk is relevant if it contains any of the expected passages"""
+    chunk_text = _normalize(chunk_text)
+    return any(_normalize(passage) in chunk_text for passage in expected)
+
+
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def evaluate_setting(documents, queries, embeddings, chunk_size, chunk_overlap, k_values):
+    """Build one index and score every k against the query set"""
+    try:
+        from langchain_community.vectorstores import Chroma
+    except ImportError:
+        from langchain.vectorstores import Chroma
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = splitter.split_documents(documents)
+
+    # Embed first, so build_seconds covers indexing only; embed_seconds is the model time for
+    # this setting's chunks that earlier settings had not embedded already
+    started = time.perf_counter()
+    embeddings.embed_documents([chunk.page_content for chunk in chunks])
+    embed_seconds = time.perf_counter() - started
+
+    persist_dir = tempfile.mkdtemp(prefix="retrieval-bench-")
+    try:
+        started = time.perf_counter()
+        store = Chroma.from_documents(chunks, embeddings, persist_directory=persist_dir,
+                                      collection_name="retrieval_benchmark")
+        build_seconds = time.perf_counter() - started
+        index_bytes = directory_size(persist_dir)
+
+        max_k = max(k_values)
+        ranks = []
+        latencies = {k: [] for k in k_values}
+        for query in queries:
+            vector = embeddings.embed_query(query["query"])
+            for k in k_values:
+                started = time.perf_counter()
+                results = store.similarity_search_by_vector(vector, k=k)
+                latencies[k].append(time.perf_counter() - started)
+                if k == max_k:
+                    rank = next((i + 1 for i, doc in enumerate(results)
+                                 if is_relevant(doc.page_content, query["expected"])), None)
+                    ranks.append(rank)
+
+        answerable = sum(1 for query in queries
+                         if any(is_relevant(chunk.page_content, query["expected"]) for chunk in chunks))
+        by_k = {}
+        for k in k_values:
+            hits = sum(1 for rank in ranks if rank is not None and rank <= k)
+            reciprocal = sum(1.0 / rank for rank in ranks if rank is not None and rank <= k)
+            timings = sorted(latencies[k])
+            by_k[str(k)] = {
+                "recall": round(hits / len(queries), 4) if queries else None,
+                "mrr": round(reciprocal / len(queries), 4) if queries else None,
+                "query_ms_p50": round(percentile(timings, 50) * 1000, 3),
+                "query_ms_p95": round(percentile(timings, 95) * 1000, 3),
+            }
+
+        return {
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "chunks": len(chunks),
+            # Queries whose expected passage survived chunking intact at all
+            "answerable_queries": answerable,
+            "embed_seconds": round(embed_seconds, 3),
+            "build_seconds": round(build_seconds, 3),
+            "index_bytes": index_bytes,
+            "k": by_k,
+        }
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+
+def run_benchmark(chunk_settings=DEFAULT_CHUNK_SETTINGS, k_values=DEFAULT_K_VALUES,
+                  query_set=QUERY_SET, corpus=CORPUS):
+    """Evaluate every chunk setting; returns the full result dict"""
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    documents = load_corpus(corpus)
+    queries = load_queries(query_set)
+    embeddings = CachedEmbeddings(HuggingFaceEmbeddings())
+    k_values = sorted(set(k_values))
+
+    print(f"📚 Corpus: {len(documents)} documents, {len(queries)} labeled queries")
+    results = []
+    for chunk_size, chunk_overlap in chunk_settings:
+        result = evaluate_setting(documents, queries, embeddings, chunk_size, chunk_overlap, k_values)
+        results.append(result)
+        scores = "  ".join(f"R@{k}={result['k'][str(k)]['recall']:.2f}" for k in k_values)
+        best = result["k"][str(k_values[-1])]
+        print(f"  {chunk_size:>5}/{chunk_overlap:<4} chunks={result['chunks']:<5} {scores}  "
+              f"MRR={best['mrr']:.3f}  embed={result['embed_seconds']}s  build={result['build_seconds']}s  "
+              f"size={result['index_bytes'] // 1024}KB  p50={best['query_ms_p50']}ms")
+
+    return {
+        "started_at": datetime.now().isoformat(),
+        "corpus": [os.path.relpath(path, ROOT_DIR) for path in corpus],
+        "queries": len(queries),
+        "k_values": k_values,
+        "results": results,
+    }
+
+
+def _parse_chunk_setting(value):
+    size, _, overlap = value.partition(":")
+    return int(size), int(overlap or 0)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality for chunking and k settings")
+    parser.add_argument("--chunks", nargs="+", type=_parse_chunk_setting,
+                        default=DEFAULT_CHUNK_SETTINGS, help="chunk_size:chunk_overlap pairs")
+    parser.add_argument("--k", nargs="+", type=int, default=DEFAULT_K_VALUES)
+    parser.add_argument("--queries", default=QUERY_SET)
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/retrieval-<time>.json)")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.chunks, args.k, args.queries)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"retrieval-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"💾 Results written to {output}")
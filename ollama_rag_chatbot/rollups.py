@@ -0,0 +1,344 @@
+"""Pre-aggregated per-website counters for the dashboards.
+
+Every logged turn updates an hourly and a daily bucket for its website
+(messages, unique users, sales intents, bot latency), and upload/reset code
+keeps a few gauges (documents, files) current. Dashboard endpoints read
+these buckets directly instead of scanning logs or counting vector store
+records.
+
+Buckets live in a small SQLite database (analytics/rollups.sqlite3) shared
+by every worker process. Each process counts turns in memory and a
+background thread adds them to the stored buckets every FLUSH_INTERVAL
+seconds and on exit, as increments (counter = counter + delta), so workers
+never overwrite each other's counts. Unique users are kept as one row per
+(bucket, user).
+"""
+import os
+import json
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_DB = "analytics/rollups.sqlite3"
+# Written by older versions, one file per process overwriting the others; imported once
+LEGACY_ROLLUP_FILE = "analytics/rollups.json"
+FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", "30"))
+PRUNE_INTERVAL = 3600.0
+
+# Bucket key formats and how long buckets of each granularity are kept
+GRANULARITIES = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d"}
+RETENTION = {"hour": timedelta(days=7), "day": timedelta(days=400)}
+
+COUNTERS = ("messages", "user_messages", "bot_messages", "sales_intents", "latency_sum", "latency_count")
+
+
+def _new_bucket():
+    bucket = {name: 0 for name in COUNTERS}
+    bucket["users"] = set()
+    return bucket
+
+
+def _public(key, bucket, unique_users):
+    """JSON view of a bucket with derived unique user count and average latency"""
+    view = {"period": key, **{name: bucket[name] for name in COUNTERS if not name.startswith("latency")}}
+    view["unique_users"] = unique_users
+    view["avg_latency"] = round(bucket["latency_sum"] / bucket["latency_count"], 3) if bucket["latency_count"] else None
+    view["sales_intent_rate"] = round(bucket["sales_intents"] / bucket["user_messages"], 4) \
+        if bucket["user_messages"] else 0.0
+    return view
+
+
+class RollupEngine:
+    """Hourly/daily counters per website, buffered in memory and added to SQLite periodically"""
+
+    def __init__(self, path=ROLLUP_DB, flush_interval=FLUSH_INTERVAL, legacy_file=LEGACY_ROLLUP_FILE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}   # (website_id, granularity, period) -> bucket counted since the last flush
+        self._next_prune = 0.0
+        self._flusher = None
+        self._init_store(legacy_file)
+
+    # ---------- storage ----------
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _init_store(self, legacy_file):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS rollups (
+                        website_id TEXT NOT NULL,
+                        granularity TEXT NOT NULL,
+                        period TEXT NOT NULL,
+                        {', '.join(f'{name} REAL NOT NULL DEFAULT 0' if name == 'latency_sum'
+                                   else f'{name} INTEGER NOT NULL DEFAULT 0' for name in COUNTERS)},
+                        PRIMARY KEY (website_id, granularity, period)
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS rollup_users (
+                        website_id TEXT NOT NULL,
+                        granularity TEXT NOT NULL,
+                        period TEXT NOT NULL,
+                        user_id TEXT NOT NULL,
+                        PRIMARY KEY (website_id, granularity, period, user_id)
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_rollups_period ON rollups (granularity, period)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_rollup_users_period ON rollup_users (granularity, period)")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS gauges (
+                        website_id TEXT NOT NULL,
+                        name TEXT NOT NULL,
+                        value INTEGER NOT NULL,
+                        PRIMARY KEY (website_id, name)
+                    )
+                """)
+            if legacy_file and os.path.exists(legacy_file):
+                self._import_legacy(conn, legacy_file)
+        finally:
+            conn.close()
+
+    def _import_legacy(self, conn, legacy_file):
+        # Claimed by renaming first, so only one of several starting workers imports it
+        claimed = f"{legacy_file}.{os.getpid()}"
+        try:
+            os.replace(legacy_file, claimed)
+        except OSError:
+            return
+        try:
+            with open(claimed, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable rollup file {legacy_file}: {e}")
+            return
+        buckets = {}
+        for website_id, granularities in saved.get("buckets", {}).items():
+            for granularity, periods in granularities.items():
+                for period, stored in periods.items():
+                    bucket = _new_bucket()
+                    bucket.update({name: stored.get(name, 0) for name in COUNTERS})
+                    bucket["users"] = set(stored.get("users", []))
+                    buckets[(website_id, granularity, period)] = bucket
+        with conn:
+            self._add(conn, buckets)
+            for website_id, gauges in saved.get("gauges", {}).items():
+                for name, value in gauges.items():
+                    conn.execute("INSERT OR REPLACE INTO gauges VALUES (?, ?, ?)", (website_id, name, value))
+        os.replace(claimed, legacy_file + ".imported")
+
+    def _add(self, conn, buckets):
+        """Add bucket deltas to the stored buckets (caller commits)"""
+        columns = ", ".join(COUNTERS)
+        conn.executemany(f"""
+            INSERT INTO rollups (website_id, granularity, period, {columns})
+            VALUES (?, ?, ?, {', '.join(['?'] * len(COUNTERS))})
+            ON CONFLICT(website_id, granularity, period) DO UPDATE SET
+            {', '.join(f'{name} = {name} + excluded.{name}' for name in COUNTERS)}
+        """, [(*key, *(bucket[name] for name in COUNTERS)) for key, bucket in buckets.items()])
+        conn.executemany("INSERT OR IGNORE INTO rollup_users VALUES (?, ?, ?, ?)",
+                         [(*key, str(user_id)) for key, bucket in buckets.items() for user_id in bucket["users"]])
+
+    def _prune(self, conn, now):
+        for granularity, fmt in GRANULARITIES.items():
+            cutoff = (now - RETENTION[granularity]).strftime(fmt)
+            for table in ("rollups", "rollup_users"):
+                conn.execute(f"DELETE FROM {table} WHERE granularity = ? AND period < ?", (granularity, cutoff))
+
+    def flush(self):
+        """Add the turns counted since the last flush to the stored buckets"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            prune = time.monotonic() >= self._next_prune
+            if not pending and not prune:
+                return False
+            conn = self._connect()
+            try:
+                with conn:
+                    self._add(conn, pending)
+                    if prune:
+                        self._prune(conn, datetime.now())
+                        self._next_prune = time.monotonic() + PRUNE_INTERVAL
+            except Exception:
+                # Keep the counts for the next attempt
+                with self._lock:
+                    for key, bucket in pending.items():
+                        current = self._pending.setdefault(key, _new_bucket())
+                        for name in COUNTERS:
+                            current[name] += bucket[name]
+                        current["users"] |= bucket["users"]
+                raise
+            finally:
+                conn.close()
+            return bool(pending)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Rollup flush failed: {e}")
+
+    def start(self):
+        """Start the background flusher (once per process)"""
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="rollup-flush", daemon=True)
+            self._flusher.start()
+        atexit.register(self.flush)
+
+    # ---------- updates ----------
+
+    def record_turn(self, website_id, user_id, sender, sales_flag=None, latency=None, timestamp=None):
+        """Count one chat turn in its website's hourly and daily buckets"""
+        if self._flusher is None:
+            self.start()
+        timestamp = timestamp or datetime.now()
+        website_id = website_id or "default"
+        with self._lock:
+            for granularity, fmt in GRANULARITIES.items():
+                key = (website_id, granularity, timestamp.strftime(fmt))
+                bucket = self._pending.get(key)
+                if bucket is None:
+                    bucket = self._pending[key] = _new_bucket()
+                bucket["messages"] += 1
+                if sender == "user":
+                    bucket["user_messages"] += 1
+                    bucket["users"].add(user_id)
+                else:
+                    bucket["bot_messages"] += 1
+                if sales_flag:
+                    bucket["sales_intents"] += 1
+                if latency is not None:
+                    bucket["latency_sum"] += latency
+                    bucket["latency_count"] += 1
+
+    def set_gauge(self, website_id, name, value):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO gauges VALUES (?, ?, ?)", (website_id, name, value))
+        finally:
+            conn.close()
+
+    def adjust_gauge(self, website_id, name, delta):
+        """Add delta to a gauge that has already been seeded; unknown gauges stay unknown"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("UPDATE gauges SET value = value + ? WHERE website_id = ? AND name = ?",
+                             (delta, website_id, name))
+        finally:
+            conn.close()
+
+    def drop_gauges(self, website_id):
+        """Forget a website's gauges so the next read recomputes them (after a reset or restore)"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM gauges WHERE website_id = ?", (website_id,))
+        finally:
+            conn.close()
+
+    def gauge(self, website_id, name):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM gauges WHERE website_id = ? AND name = ?",
+                               (website_id, name)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def clear(self, website_id=None):
+        """Drop counters for one website, or all of them (e.g. after the chat logs are cleared)"""
+        with self._lock:
+            self._pending = {key: bucket for key, bucket in self._pending.items()
+                             if website_id is not None and key[0] != website_id}
+        where, params = ("WHERE website_id = ?", (website_id,)) if website_id is not None else ("", ())
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(f"DELETE FROM rollups {where}", params)
+                conn.execute(f"DELETE FROM rollup_users {where}", params)
+        finally:
+            conn.close()
+
+    # ---------- reads ----------
+
+    def _query(self, website_id, granularity, since=None, limit=None):
+        """({period: (bucket, unique_users)}, unique users over all of them) for one website,
+        or summed over all websites when website_id is None"""
+        # This process's counts since the last flush are included by flushing them first
+        self.flush()
+        conditions, params = ["granularity = ?"], [granularity]
+        if website_id is not None:
+            conditions.append("website_id = ?")
+            params.append(website_id)
+        if since is not None:
+            conditions.append("period >= ?")
+            params.append(since)
+        where = " AND ".join(conditions)
+        conn = self._connect()
+        try:
+            rows = conn.execute(f"""
+                SELECT period, {', '.join(f'SUM({name})' for name in COUNTERS)} FROM rollups
+                WHERE {where} GROUP BY period ORDER BY period DESC {'LIMIT ?' if limit else ''}
+            """, (*params, *((int(limit),) if limit else ()))).fetchall()
+            if not rows:
+                return {}, 0
+            users = dict(conn.execute(f"""
+                SELECT period, COUNT(DISTINCT user_id) FROM rollup_users
+                WHERE {where} AND period >= ? GROUP BY period
+            """, (*params, rows[-1][0])).fetchall())
+            total_users = conn.execute(f"""
+                SELECT COUNT(DISTINCT user_id) FROM rollup_users WHERE {where} AND period >= ?
+            """, (*params, rows[-1][0])).fetchone()[0]
+        finally:
+            conn.close()
+        periods = {}
+        for period, *values in rows:
+            periods[period] = (dict(zip(COUNTERS, (value or 0 for value in values))), users.get(period, 0))
+        return periods, total_users
+
+    def series(self, website_id=None, granularity="hour", limit=None):
+        """Buckets oldest first, optionally only the last `limit` periods"""
+        periods, _ = self._query(website_id, granularity, limit=limit)
+        return [_public(key, *periods[key]) for key in sorted(periods)]
+
+    def totals(self, website_id=None, days=1):
+        """Counters summed over the last `days` daily buckets (unique users are de-duplicated)"""
+        since = (datetime.now() - timedelta(days=days - 1)).strftime(GRANULARITIES["day"])
+        periods, unique_users = self._query(website_id, "day", since=since)
+        total = {name: 0 for name in COUNTERS}
+        for bucket, _ in periods.values():
+            for name in COUNTERS:
+                total[name] += bucket[name]
+        return _public(f"last_{days}_days", total, unique_users)
+
+    def websites(self):
+        self.flush()
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT website_id FROM rollups UNION SELECT website_id FROM gauges").fetchall()
+            return sorted(row[0] for row in rows)
+        finally:
+            conn.close()
+
+
+engine = RollupEngine()
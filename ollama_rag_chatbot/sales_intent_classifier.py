@@ -4,26 +4,38 @@ from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import make_pipeline
 import joblib
 import os
+import threading
 import logging
 
+from keyword_matcher import ReloadableMatcher
+
 logger = logging.getLogger(__name__)
 
 MODEL_PATH = "sales_classifier.joblib"
-CSV_PATH = '/home/jan-israel/dev/chatbot/ollama_rag_chatbot/data/convo_data.csv'
+CSV_PATH = os.getenv(
+    "SALES_TRAINING_CSV",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "convo_data.csv")
+)
+
+# Labels that mark a message as sales intent
+SALES_LABELS = ["interest", "inquiry", "objection"]
 
 # ========== 1. Load CSV Training Data ==========
-if not os.path.exists(CSV_PATH):
-    raise FileNotFoundError(f"Training data not found at {CSV_PATH}")
+def load_csv_training_data(csv_path=CSV_PATH):
+    """Load (text, label) seed examples from the conversation CSV"""
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"Training data not found at {csv_path}")
 
-df = pd.read_csv(CSV_PATH)
+    df = pd.read_csv(csv_path)
 
-# Ensure the 'sales_flag' column exists
-if 'sales_flag' not in df.columns:
-    raise KeyError("The 'sales_flag' column is missing in the CSV file.")
+    # Ensure the 'sales_flag' column exists
+    if 'sales_flag' not in df.columns:
+        raise KeyError("The 'sales_flag' column is missing in the CSV file.")
 
-# Extract texts and labels from the CSV
-texts = df["message"].astype(str).tolist()
-labels = df["sales_flag"].astype(str).tolist()
+    # Extract texts and labels from the CSV
+    texts = df["message"].astype(str).tolist()
+    labels = df["sales_flag"].astype(str).tolist()
+    return list(zip(texts, labels))
 
 # ========== 2. Define Sales Keywords ==========
 sales_keywords_interest = [
@@ -68,40 +80,78 @@ sales_keywords_objection = [
     "Do you offer a trial?", "What if we’re not happy?"
 ]
 
+# Compiled once at import; config/intent_keywords.json ("sales_intents") can extend it live
+sales_intent_matcher = ReloadableMatcher("sales_intents", {
+    "interest": sales_keywords_interest,
+    "inquiry": sales_keywords_inquiry,
+    "objection": sales_keywords_objection,
+})
+
 # ========== 3. Merge Sales Keywords into Training Data ==========
-training_data = [
-    # Interest Keywords
-    *[(text, "interest") for text in sales_keywords_interest],
-    
-    # Inquiry Keywords
-    *[(text, "inquiry") for text in sales_keywords_inquiry],
-    
-    # Objection Keywords
-    *[(text, "objection") for text in sales_keywords_objection],
-    
-    # Original data from CSV
-    *[(text, label) for text, label in zip(texts, labels)],
-]
+def load_seed_training_data(csv_path=CSV_PATH):
+    """Keyword examples plus the CSV examples, used to bootstrap and retrain the model"""
+    return [
+        # Interest Keywords
+        *[(text, "interest") for text in sales_keywords_interest],
 
-# Prepare and train the model
-texts, labels = zip(*training_data)
-model = make_pipeline(CountVectorizer(), MultinomialNB())
-model.fit(texts, labels)
+        # Inquiry Keywords
+        *[(text, "inquiry") for text in sales_keywords_inquiry],
 
-# Save the trained model
-joblib.dump(model, MODEL_PATH)
+        # Objection Keywords
+        *[(text, "objection") for text in sales_keywords_objection],
+
+        # Original data from CSV
+        *load_csv_training_data(csv_path),
+    ]
+
+def train_seed_model():
+    """Train the bootstrap model from the seed data and save it"""
+    texts, labels = zip(*load_seed_training_data())
+    model = make_pipeline(CountVectorizer(), MultinomialNB())
+    model.fit(texts, labels)
+    joblib.dump(model, MODEL_PATH)
+    return model
+
+# Only bootstrap when no model exists yet; retrain_classifier.py swaps in
+# models learned from chat logs and must not be overwritten on import.
+if not os.path.exists(MODEL_PATH):
+    train_seed_model()
 
 # ========== 4. Classifier Function with Sales Intent ==========
-def classify_message(message):
-    """Classifies the message into one of the sales intents"""
+_model_lock = threading.Lock()
+_model_cache = {"mtime": None, "model": None}
+
+def load_model():
+    """Return the live model, reloading only when the file on disk was swapped"""
     if not os.path.exists(MODEL_PATH):
         raise FileNotFoundError(f"Classifier model not found at {MODEL_PATH}")
-    
-    clf = joblib.load(MODEL_PATH)
+
+    mtime = os.path.getmtime(MODEL_PATH)
+    if _model_cache["mtime"] != mtime:
+        with _model_lock:
+            if _model_cache["mtime"] != mtime:
+                _model_cache["model"] = joblib.load(MODEL_PATH)
+                _model_cache["mtime"] = mtime
+    return _model_cache["model"]
+
+def match_sales_intents(message):
+    """Sales intents whose keyword phrases occur in the message (fast path, no model)"""
+    return sales_intent_matcher.match(message)
+
+def classify_message(message):
+    """Classifies the message into one of the sales intents"""
+    # Unambiguous keyword hits skip the model entirely
+    matched = match_sales_intents(message)
+    if len(matched) == 1:
+        label = matched[0]
+        logger.info(f"flag and label {label} (keyword match)")
+        return label, 1
+
+    clf = load_model()
     label = clf.predict([message])[0]
 
     # Sales flag indicates if the label is 'interest', 'inquiry', or 'objection'
-    sales_flag = 1 if label in ["interest", "inquiry", "objection"] else 0
+    sales_flag = 1 if label in SALES_LABELS else 0
 
     logger.info(f"flag and label {label}")
     return label, sales_flag
@@ -1,6 +1,13 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 import os
 from learning import main
+from retrain_classifier import retrain
+import analytics_store
+import numpy_store
+import snapshots
+import tenant_registry
+import vector_index
+from migrations import maintain_partitions
 
 from subprocess import Popen, PIPE
 import time
@@ -23,19 +30,111 @@ def run_learner():
     # print("[Scheduler] Running learner.py...")
     # process = Popen(["python3", learner_path], stdout=PIPE, stderr=PIPE)
     # stdout, stderr = process.communicate()
-    stdout = main()
-    if stdout:
+    try:
+        stats = main()
+        with open(log_file_path, "a") as f:
+            f.write(f"[{datetime.now().isoformat()}] {stats}\n")
+    except Exception as e:
         with open(log_file_path, "a") as f:
-            f.write("[Error] ")
+            f.write(f"[Error] {e}\n")
     # if stderr:
     #     print("[Error]", stderr.decode())
 
+def run_classifier_retrain():
+    try:
+        result = retrain()
+        with open(log_file_path, "a") as f:
+            f.write(f"[{datetime.now().isoformat()}] classifier {result}\n")
+    except Exception as e:
+        with open(log_file_path, "a") as f:
+            f.write(f"[Error] classifier retrain: {e}\n")
+
+def run_analytics_compaction():
+    try:
+        result = analytics_store.compact()
+        if result["rows"]:
+            with open(log_file_path, "a") as f:
+                f.write(f"[{datetime.now().isoformat()}] analytics {result}\n")
+    except Exception as e:
+        with open(log_file_path, "a") as f:
+            f.write(f"[Error] analytics compaction: {e}\n")
+
+def run_analytics_merge():
+    try:
+        merged = analytics_store.merge_small_files()
+        with open(log_file_path, "a") as f:
+            f.write(f"[{datetime.now().isoformat()}] analytics merged {merged} partitions\n")
+    except Exception as e:
+        with open(log_file_path, "a") as f:
+            f.write(f"[Error] analytics merge: {e}\n")
+
+def run_partition_maintenance():
+    try:
+        result = maintain_partitions()
+        with open(log_file_path, "a") as f:
+            f.write(f"[{datetime.now().isoformat()}] partitions {result}\n")
+    except Exception as e:
+        with open(log_file_path, "a") as f:
+            f.write(f"[Error] partition maintenance: {e}\n")
+
+def run_numpy_demotion():
+    try:
+        website_ids = list(tenant_registry.TenantRegistry(watch=False))
+        demoted = numpy_store.demote_small_tenants(website_ids)
+        if demoted:
+            with open(log_file_path, "a") as f:
+                f.write(f"[{datetime.now().isoformat()}] demoted to NumPy {demoted}\n")
+    except Exception as e:
+        with open(log_file_path, "a") as f:
+            f.write(f"[Error] NumPy demotion: {e}\n")
+
+def run_index_rebuilds():
+    try:
+        website_ids = list(tenant_registry.TenantRegistry(watch=False))
+        rebuilt = vector_index.rebuild_pending(website_ids)
+        if rebuilt:
+            with open(log_file_path, "a") as f:
+                f.write(f"[{datetime.now().isoformat()}] rebuilt indexes {rebuilt}\n")
+    except Exception as e:
+        with open(log_file_path, "a") as f:
+            f.write(f"[Error] index rebuilds: {e}\n")
+
+def run_snapshot_prune():
+    try:
+        result = snapshots.default_store.prune()
+        with open(log_file_path, "a") as f:
+            f.write(f"[{datetime.now().isoformat()}] snapshots pruned {result}\n")
+    except Exception as e:
+        with open(log_file_path, "a") as f:
+            f.write(f"[Error] snapshot prune: {e}\n")
+
 def start():
     scheduler = BackgroundScheduler()
 
     # Run every day at 1:00 AM
     scheduler.add_job(run_learner, 'cron', hour=1, minute=0)
 
+    # Retrain the sales classifier after the learner has run
+    scheduler.add_job(run_classifier_retrain, 'cron', hour=1, minute=30)
+
+    # Move new chat log rows into the Parquet analytics store
+    scheduler.add_job(run_analytics_compaction, 'interval', minutes=5)
+
+    # Fold the day's small incremental files into one per partition
+    scheduler.add_job(run_analytics_merge, 'cron', hour=2, minute=0)
+
+    # Keep monthly chat log partitions ahead of time and drop expired ones
+    scheduler.add_job(run_partition_maintenance, 'cron', hour=3, minute=0)
+
+    # Apply saved HNSW settings that the live indexes were not built with
+    scheduler.add_job(run_index_rebuilds, 'cron', hour=3, minute=30)
+
+    # Move small Chroma knowledge bases onto exact NumPy search
+    scheduler.add_job(run_numpy_demotion, 'cron', hour=4, minute=0)
+
+    # Apply snapshot retention (SNAPSHOT_KEEP / SNAPSHOT_MAX_AGE_DAYS) and free unreferenced blobs
+    scheduler.add_job(run_snapshot_prune, 'cron', hour=4, minute=30)
+
     # 🔁 Run immediately once for testing
     scheduler.add_job(run_learner, 'date', run_date=datetime.now() + timedelta(seconds=2))
 
@@ -0,0 +1,160 @@
+"""Coalescing of identical concurrent chat generations.
+
+When many visitors ask the same question at the same moment (e.g. a
+suggested chip on a busy homepage), only the first request runs retrieval
+and the LLM. Requests with the same key arriving while it is in flight wait
+for its result instead. Nothing is cached once the flight lands, so answers
+never outlive the knowledge base or prompt they were generated from.
+
+Keys combine the website, the normalized question and the versions of the
+knowledge base and prompt. The result goes to every visitor in the flight,
+so anything visitor-specific that shapes the prompt, such as their name,
+belongs in the prompt version. A generation may also emit chunks while it runs; subscribe()
+replays the chunks emitted so far and then follows live ones, so streaming
+clients can join a flight late. /chat answers in one piece and only uses
+do(); stream() is there for a streaming route.
+"""
+import re
+import hashlib
+import logging
+import threading
+import unicodedata
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Followers give up waiting on a flight after this many seconds
+WAIT_TIMEOUT = 120.0
+
+chat_coalesced_total = tracing.registry.counter(
+    "chat_coalesced_total", "Chat requests answered by an identical in-flight generation",
+    ("website_id",))
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.,;:]+$")
+
+
+def normalize_question(text):
+    """Case, Unicode form, whitespace and trailing punctuation don't change the question"""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _TRAILING_PUNCTUATION.sub("", _SPACES.sub(" ", text).strip())
+
+
+def prompt_version(*parts):
+    """Short hash of everything besides the question that shapes the prompt"""
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def flight_key(website_id, question, knowledge_version, prompt_version):
+    return (website_id, normalize_question(question), str(knowledge_version), prompt_version)
+
+
+class Flight:
+    """One in-flight generation and everyone waiting on it"""
+
+    def __init__(self, key):
+        self.key = key
+        self.waiters = 0
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self._cond = threading.Condition()
+
+    def emit(self, chunk):
+        """Publish a partial result to streaming subscribers"""
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def _finish(self, result=None, error=None):
+        with self._cond:
+            self.result, self.error, self.done = result, error, True
+            self._cond.notify_all()
+
+    def wait(self, timeout=WAIT_TIMEOUT):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.done, timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight generation {self.key[:2]}")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def subscribe(self, timeout=WAIT_TIMEOUT):
+        """Yield every chunk of the generation, from the first one, until it finishes"""
+        position = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self.done or len(self.chunks) > position, timeout):
+                    raise TimeoutError(f"Timed out waiting for in-flight generation {self.key[:2]}")
+                chunks, position = self.chunks[position:], len(self.chunks)
+                finished, error = self.done, self.error
+            yield from chunks
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """Runs at most one generation per key at a time; concurrent callers share its outcome"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def _join(self, key):
+        """(flight, is_leader)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight(key)
+                return flight, True
+            flight.waiters += 1
+            return flight, False
+
+    def _run(self, flight, generate):
+        try:
+            result = generate(flight.emit)
+        except BaseException as e:
+            flight._finish(error=e)
+            raise
+        else:
+            flight._finish(result=result)
+            return result
+        finally:
+            with self._lock:
+                self._flights.pop(flight.key, None)
+            if flight.waiters:
+                logger.info(f"Coalesced {flight.waiters} identical chat request(s) for {flight.key[0]}")
+
+    def do(self, key, generate, timeout=WAIT_TIMEOUT):
+        """(result, shared): run generate(emit) or wait for the identical flight in progress"""
+        flight, leader = self._join(key)
+        if leader:
+            return self._run(flight, generate), False
+        chat_coalesced_total.inc(website_id=key[0])
+        return flight.wait(timeout), True
+
+    def stream(self, key, generate, timeout=WAIT_TIMEOUT):
+        """Chunks of the generation for key, starting it in a background thread if needed"""
+        flight, leader = self._join(key)
+        if leader:
+            def run():
+                try:
+                    self._run(flight, generate)
+                except BaseException as e:
+                    logger.warning(f"Streamed generation {key[:2]} failed: {e}")
+            threading.Thread(target=run, name="single-flight", daemon=True).start()
+        else:
+            chat_coalesced_total.inc(website_id=key[0])
+        return flight.subscribe(timeout)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+group = SingleFlight()
@@ -0,0 +1,331 @@
+"""Incremental, content-addressed backups.
+
+A snapshot is a JSON manifest mapping logical paths ("uploads/default/a.pdf")
+to the SHA-256 of their content. File contents live once in a blob store
+(optionally zstd-compressed), so a backup after a small change only writes
+the files that changed. Hashes from the previous snapshot of the same scope
+are reused when a file's size and mtime are unchanged, so unchanged files
+are not even read. Chroma's SQLite database is copied with SQLite's online
+backup API to get a consistent image while the app keeps writing.
+"""
+import os
+import io
+import json
+import shutil
+import hashlib
+import sqlite3
+import logging
+import time
+import tempfile
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SNAPSHOT_ROOT = "backups/snapshots"
+
+# Set SNAPSHOT_COMPRESSION=none to store blobs uncompressed
+COMPRESS_BLOBS = zstandard is not None and os.getenv("SNAPSHOT_COMPRESSION", "zstd") != "none"
+ZSTD_LEVEL = 3
+
+# SQLite side files are folded into the online backup of the main database
+SQLITE_SUFFIXES = (".sqlite3", ".sqlite", ".db")
+SQLITE_SIDE_SUFFIXES = ("-wal", "-shm", "-journal")
+
+HASH_CHUNK = 1024 * 1024
+
+# Retention applied by prune() (run daily by scheduler.py): the newest SNAPSHOT_KEEP snapshots
+# per scope, minus those older than SNAPSHOT_MAX_AGE_DAYS (0 = no age limit); the newest
+# snapshot of a scope is always kept
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "20"))
+SNAPSHOT_MAX_AGE_DAYS = int(os.getenv("SNAPSHOT_MAX_AGE_DAYS", "90"))
+# Blobs this recent may belong to a snapshot whose manifest is not written yet
+BLOB_GRACE_SECONDS = 3600
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_sqlite(path):
+    if not path.endswith(SQLITE_SUFFIXES):
+        return False
+    try:
+        with open(path, "rb") as f:
+            return f.read(16) == b"SQLite format 3\x00"
+    except OSError:
+        return False
+
+
+def _sqlite_state(path):
+    """(size, mtime_ns) of a database including its WAL, for change detection"""
+    stat = os.stat(path)
+    state = [stat.st_size, stat.st_mtime_ns]
+    wal = path + "-wal"
+    if os.path.exists(wal):
+        wal_stat = os.stat(wal)
+        state += [wal_stat.st_size, wal_stat.st_mtime_ns]
+    return state
+
+
+class SnapshotStore:
+    """Blob store plus manifests under one backup root"""
+
+    def __init__(self, root=SNAPSHOT_ROOT, compress=COMPRESS_BLOBS):
+        self.root = root
+        self.compress = compress and zstandard is not None
+        self.blob_dir = os.path.join(root, "blobs")
+        self.manifest_dir = os.path.join(root, "manifests")
+
+    # ---------- blobs ----------
+
+    def _blob_base(self, sha):
+        return os.path.join(self.blob_dir, sha[:2], sha)
+
+    def blob_path(self, sha):
+        """Stored path of a blob, or None if it is missing"""
+        base = self._blob_base(sha)
+        for path in (base + ".zst", base):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def has_blob(self, sha):
+        return self.blob_path(sha) is not None
+
+    def put_file(self, path, known_sha=None):
+        """Store a file's content; returns (sha256, bytes written)"""
+        sha = known_sha or _hash_file(path)
+        if self.has_blob(sha):
+            # Mark the blob as in use, so collect_blobs() leaves it alone until the manifest exists
+            os.utime(self.blob_path(sha))
+            return sha, 0
+
+        os.makedirs(self.blob_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".tmp")
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb") as src, os.fdopen(fd, "wb") as raw:
+                out = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False) \
+                    if self.compress else raw
+                for chunk in iter(lambda: src.read(HASH_CHUNK), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+                if self.compress:
+                    out.close()
+            # Name the blob by what was actually copied; the file may have changed since hashing
+            sha = digest.hexdigest()
+            target = self._blob_base(sha) + (".zst" if self.compress else "")
+            if self.has_blob(sha):
+                os.remove(tmp_path)
+                return sha, 0
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            written = os.path.getsize(tmp_path)
+            os.replace(tmp_path, target)
+            return sha, written
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open_blob(self, sha):
+        """Readable binary stream of a blob's original content"""
+        path = self.blob_path(sha)
+        if path is None:
+            raise FileNotFoundError(f"Blob {sha} is missing from {self.blob_dir}")
+        f = open(path, "rb")
+        if path.endswith(".zst"):
+            if zstandard is None:
+                f.close()
+                raise RuntimeError("zstandard is required to read compressed snapshots")
+            return zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+        return f
+
+    def copy_blob(self, sha, destination):
+        """Write a blob's content to destination atomically"""
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        tmp_path = f"{destination}.{os.getpid()}.restore"
+        with self.open_blob(sha) as src, open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, HASH_CHUNK)
+        os.replace(tmp_path, destination)
+
+    # ---------- manifests ----------
+
+    def manifest_path(self, snapshot_id):
+        return os.path.join(self.manifest_dir, f"{snapshot_id}.json")
+
+    def load_manifest(self, snapshot_id):
+        with open(self.manifest_path(snapshot_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def list_manifests(self, scope=None):
+        """Manifests (without entries), newest first"""
+        if not os.path.isdir(self.manifest_dir):
+            return []
+        summaries = []
+        for name in os.listdir(self.manifest_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                manifest = self.load_manifest(name[:-5])
+            except Exception as e:
+                logger.warning(f"Unreadable snapshot manifest {name}: {e}")
+                continue
+            if scope is None or manifest.get("scope") == scope:
+                manifest.pop("entries", None)
+                summaries.append(manifest)
+        return sorted(summaries, key=lambda m: m["created_at"], reverse=True)
+
+    def latest_manifest(self, scope):
+        summaries = self.list_manifests(scope)
+        return self.load_manifest(summaries[0]["id"]) if summaries else None
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        path = self.manifest_path(manifest["id"])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, path)
+        return path
+
+    # ---------- snapshots ----------
+
+    def _snapshot_file(self, path, logical, previous, stats):
+        """Manifest entry for one file, storing its blob if it is new"""
+        old = previous.get(logical)
+
+        if _is_sqlite(path):
+            state = _sqlite_state(path)
+            if old and old.get("state") == state and self.has_blob(old["sha256"]):
+                stats["reused"] += 1
+                return old
+            fd, tmp_path = tempfile.mkstemp(suffix=".sqlite3")
+            os.close(fd)
+            try:
+                source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                target = sqlite3.connect(tmp_path)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                    source.close()
+                sha, written = self.put_file(tmp_path)
+                size = os.path.getsize(tmp_path)
+            finally:
+                os.remove(tmp_path)
+            entry = {"sha256": sha, "size": size, "state": state, "sqlite": True}
+        else:
+            stat = os.stat(path)
+            state = [stat.st_size, stat.st_mtime_ns]
+            known = old["sha256"] if old and old.get("state") == state else None
+            if known and self.has_blob(known):
+                stats["reused"] += 1
+                return old
+            sha, written = self.put_file(path, known_sha=known)
+            entry = {"sha256": sha, "size": stat.st_size, "state": state}
+
+        stats["bytes_written"] += written
+        stats["new_blobs"] += 1 if written else 0
+        return entry
+
+    def create_snapshot(self, sources, scope="global", label="", meta=None):
+        """Snapshot {logical_prefix: file_or_directory} and return the manifest"""
+        previous_manifest = self.latest_manifest(scope)
+        previous = previous_manifest["entries"] if previous_manifest else {}
+        created = datetime.now()
+        stats = {"files": 0, "reused": 0, "new_blobs": 0, "bytes_written": 0, "bytes_total": 0}
+        entries = {}
+
+        for prefix, source in sources.items():
+            if not source or not os.path.exists(source):
+                continue
+            if os.path.isfile(source):
+                files = [(source, prefix)]
+            else:
+                files = []
+                for dirpath, _, filenames in os.walk(source):
+                    for name in filenames:
+                        if name.endswith(SQLITE_SIDE_SUFFIXES):
+                            continue
+                        full = os.path.join(dirpath, name)
+                        rel = os.path.relpath(full, source).replace(os.sep, "/")
+                        files.append((full, f"{prefix}/{rel}"))
+            for path, logical in files:
+                try:
+                    entries[logical] = self._snapshot_file(path, logical, previous, stats)
+                except FileNotFoundError:
+                    continue  # removed while we were walking
+                stats["files"] += 1
+                stats["bytes_total"] += entries[logical]["size"]
+
+        manifest = {
+            "id": f"{scope}_{created.strftime('%Y%m%d_%H%M%S_%f')}",
+            "scope": scope,
+            "label": label,
+            "created_at": created.isoformat(),
+            "parent": previous_manifest["id"] if previous_manifest else None,
+            "sources": {prefix: source for prefix, source in sources.items() if source},
+            "meta": meta or {},
+            "stats": stats,
+            "entries": entries,
+        }
+        self._write_manifest(manifest)
+        logger.info(f"Snapshot {manifest['id']}: {stats}")
+        return manifest
+
+    # ---------- housekeeping ----------
+
+    def delete_snapshot(self, snapshot_id):
+        os.remove(self.manifest_path(snapshot_id))
+
+    def prune(self, keep=SNAPSHOT_KEEP, scope=None, max_age_days=SNAPSHOT_MAX_AGE_DAYS):
+        """Keep the newest `keep` snapshots per scope younger than max_age_days, then drop unreferenced blobs"""
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat() if max_age_days else None
+        by_scope = {}
+        for summary in self.list_manifests(scope):
+            by_scope.setdefault(summary["scope"], []).append(summary)
+        removed = []
+        for summaries in by_scope.values():
+            for index, summary in enumerate(summaries[1:], start=1):
+                if index >= keep or (cutoff and summary["created_at"] < cutoff):
+                    self.delete_snapshot(summary["id"])
+                    removed.append(summary["id"])
+        return {"snapshots_removed": removed, "blobs_removed": self.collect_blobs()}
+
+    def collect_blobs(self, grace=BLOB_GRACE_SECONDS):
+        """Delete blobs no manifest refers to, except those written or reused in the last `grace` seconds"""
+        referenced = set()
+        for summary in self.list_manifests():
+            referenced.update(entry["sha256"] for entry in self.load_manifest(summary["id"])["entries"].values())
+        removed = 0
+        if not os.path.isdir(self.blob_dir):
+            return removed
+        recent = time.time() - grace
+        for dirpath, _, filenames in os.walk(self.blob_dir):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue  # blob being written right now
+                sha = name.split(".")[0]
+                path = os.path.join(dirpath, name)
+                if sha not in referenced and os.path.getmtime(path) < recent:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+
+def read_text(store, sha, encoding="utf-8"):
+    """Decode a small text blob, e.g. a saved prompt"""
+    with store.open_blob(sha) as f:
+        return io.TextIOWrapper(f, encoding=encoding).read()
+
+
+default_store = SnapshotStore()
@@ -10,6 +10,11 @@
     zIndex: 999999,
   };
 
+  // Set by the /embed.js bootstrap: the chatbot's origin, website and theme
+  const SERVER_CONFIG = window.CHATBOT_CONFIG || {};
+  if (SERVER_CONFIG.apiBaseUrl) WIDGET_CONFIG.apiBaseUrl = SERVER_CONFIG.apiBaseUrl;
+  if (SERVER_CONFIG.primaryColor) WIDGET_CONFIG.primaryColor = SERVER_CONFIG.primaryColor;
+
   if (window.BobotWidget) {
     console.warn("Bobot Widget already loaded");
     return;
@@ -25,8 +30,7 @@
     }
 
     init() {
-      const urlParams = new URLSearchParams(window.location.search);
-      this.websiteId = urlParams.get("website_id") || "default";
+      this.websiteId = this.getWebsiteId();
 
       this.createStyles();
       this.createTriggerButton();
@@ -406,10 +410,14 @@
       }
     }
 
-    createWidget() {
-      // Extract website_id from URL parameters
+    getWebsiteId() {
+      // The bootstrap knows the website; a website_id on the host page is the fallback
       const urlParams = new URLSearchParams(window.location.search);
-      const websiteId = urlParams.get("website_id") || "default";
+      return SERVER_CONFIG.websiteId || urlParams.get("website_id") || "default";
+    }
+
+    createWidget() {
+      const websiteId = this.getWebsiteId();
 
       this.widget = document.createElement("div");
       this.widget.className = "bobot-widget-container";
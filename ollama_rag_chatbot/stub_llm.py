@@ -0,0 +1,228 @@
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Vocabulary for deterministic replies; the same prompt always gets the same answer
+REPLY_WORDS = (
+    "Thanks for reaching out! We offer web design, branding, digital marketing, "
+    "printing and photography services. Our team would love to help with your project. "
+    "Pricing depends on scope, so we usually start with a short free consultation. "
+    "Would you like me to connect you with someone from our team?"
+).split()
+
+
+class StubLLMConfig:
+    """Timing knobs for the stand-in LLM"""
+
+    def __init__(self, latency=0.2, tokens_per_second=50.0, reply_tokens=40, model="stub-model"):
+        self.latency = latency                  # seconds before the first token
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.model = model
+
+
+def stub_reply(prompt, reply_tokens):
+    """Deterministic reply tokens for a prompt"""
+    offset = int(hashlib.md5(prompt.encode("utf-8")).hexdigest(), 16) % len(REPLY_WORDS)
+    return [REPLY_WORDS[(offset + i) % len(REPLY_WORDS)] + " " for i in range(reply_tokens)]
+
+
+def _prompt_tokens(text):
+    return max(1, len(text.split()))
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Speaks enough of the OpenAI and Ollama HTTP APIs for the chatbot's clients"""
+
+    protocol_version = "HTTP/1.1"
+    config = StubLLMConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---------- helpers ----------
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        body = self.rfile.read(length) if length else b"{}"
+        try:
+            return json.loads(body or b"{}")
+        except ValueError:
+            return {}
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _generate(self, prompt):
+        """Yield reply tokens paced by the configured latency and token rate"""
+        config = self.config
+        time.sleep(config.latency)
+        delay = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+        for token in stub_reply(prompt, config.reply_tokens):
+            if delay:
+                time.sleep(delay)
+            yield token
+
+    # ---------- routes ----------
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            self._send_json({"models": [{"name": self.config.model, "model": self.config.model}]})
+        elif self.path.startswith("/v1/models"):
+            self._send_json({"object": "list", "data": [
+                {"id": self.config.model, "object": "model", "created": 0, "owned_by": "stub"}
+            ]})
+        elif self.path.startswith("/site"):
+            # Static pages for crawl benchmarks
+            page = self.path.strip("/").replace("/", " ")
+            body = (f"<html><head><title>{page}</title></head><body>"
+                    f"<h1>{page}</h1><p>{' '.join(REPLY_WORDS * 5)}</p></body></html>").encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        data = self._read_json()
+        if self.path.startswith("/api/generate"):
+            self._ollama_generate(data, data.get("prompt", ""), chat=False)
+        elif self.path.startswith("/api/chat"):
+            prompt = "\n".join(m.get("content", "") for m in data.get("messages", []))
+            self._ollama_generate(data, prompt, chat=True)
+        elif self.path.startswith("/v1/chat/completions"):
+            self._openai_chat(data)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _ollama_generate(self, data, prompt, chat):
+        model = data.get("model", self.config.model)
+        stream = data.get("stream", True)
+        tokens = []
+
+        def piece(token, done):
+            payload = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"), "done": done}
+            if chat:
+                payload["message"] = {"role": "assistant", "content": token}
+            else:
+                payload["response"] = token
+            if done:
+                payload.update({"prompt_eval_count": _prompt_tokens(prompt), "eval_count": len(tokens)})
+            return payload
+
+        if stream:
+            self._start_stream("application/x-ndjson")
+            for token in self._generate(prompt):
+                tokens.append(token)
+                self._write_chunk((json.dumps(piece(token, False)) + "\n").encode("utf-8"))
+            self._write_chunk((json.dumps(piece("", True)) + "\n").encode("utf-8"))
+            self._end_stream()
+        else:
+            tokens.extend(self._generate(prompt))
+            self._send_json(piece("".join(tokens), True))
+
+    def _openai_chat(self, data):
+        model = data.get("model", self.config.model)
+        prompt = "\n".join(str(m.get("content", "")) for m in data.get("messages", []))
+        created = int(time.time())
+        completion_id = "chatcmpl-stub-" + hashlib.md5(prompt.encode("utf-8")).hexdigest()[:12]
+        usage = {"prompt_tokens": _prompt_tokens(prompt), "completion_tokens": self.config.reply_tokens,
+                 "total_tokens": _prompt_tokens(prompt) + self.config.reply_tokens,
+                 "prompt_tokens_details": {"cached_tokens": 0}}
+
+        if data.get("stream"):
+            self._start_stream("text/event-stream")
+            for token in self._generate(prompt):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": model, "choices": [{"index": 0, "delta": {"content": token},
+                                                      "finish_reason": None}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            final = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                     "usage": usage}
+            self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._end_stream()
+            return
+
+        content = "".join(self._generate(prompt))
+        self._send_json({
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+
+class StubLLMServer:
+    """Local OpenAI/Ollama stand-in with configurable latency and token rate"""
+
+    def __init__(self, host="127.0.0.1", port=0, **config):
+        self.config = StubLLMConfig(**config)
+        handler = type("ConfiguredStubLLMHandler", (StubLLMHandler,), {"config": self.config})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a stub OpenAI/Ollama server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    args = parser.parse_args()
+
+    stub = StubLLMServer(args.host, args.port, latency=args.latency,
+                         tokens_per_second=args.tokens_per_second, reply_tokens=args.reply_tokens)
+    print(f"🧪 Stub LLM listening on {stub.url} (OpenAI: {stub.url}/v1, Ollama: {stub.url})")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,199 @@
+"""Persistent tenant (website) registry.
+
+Website configurations live in a small SQLite database
+(config/tenants.sqlite3), one row per tenant plus a registry version that
+every write bumps in the same transaction. Readers use an in-memory
+snapshot, so lookups on the chat path never touch disk. A background thread
+polls the version and reloads the snapshot when another process has
+changed it. Listeners then receive the ids of the tenants that actually
+changed, so callers can drop only those tenants' cached LLMs, chains and
+stores.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections.abc import Mapping
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_FILE = "config/tenants.sqlite3"
+# Written by older versions of the dashboard; imported once into a new registry
+LEGACY_CONFIG_FILE = "config/websites.json"
+# How often (seconds) the watcher checks for changes made by other processes
+RELOAD_CHECK_INTERVAL = 2.0
+
+
+class TenantRegistry(Mapping):
+    """Read-only mapping of website_id -> config backed by SQLite, with hot reload"""
+
+    def __init__(self, path=REGISTRY_FILE, seed=None, legacy_file=LEGACY_CONFIG_FILE,
+                 check_interval=RELOAD_CHECK_INTERVAL, watch=True):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._snapshot = {}
+        self._version = None
+        self._listeners = []
+        self._watcher = None
+        self._init_store(seed or {}, legacy_file)
+        self.reload()
+        if watch:
+            self._watcher = threading.Thread(target=self._watch, name="tenant-registry", daemon=True)
+            self._watcher.start()
+
+    # ---------- storage ----------
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _init_store(self, seed, legacy_file):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS tenants (
+                        website_id TEXT PRIMARY KEY,
+                        config TEXT NOT NULL,
+                        updated_at TEXT NOT NULL
+                    )
+                """)
+                conn.execute("CREATE TABLE IF NOT EXISTS registry_meta (key TEXT PRIMARY KEY, value INTEGER)")
+                created = conn.execute("INSERT OR IGNORE INTO registry_meta VALUES ('version', 0)").rowcount
+            if created:
+                initial = dict(seed)
+                if legacy_file and os.path.exists(legacy_file):
+                    try:
+                        with open(legacy_file, "r", encoding="utf-8") as f:
+                            initial.update(json.load(f))
+                        print(f"📥 Imported website configs from {legacy_file}")
+                    except Exception as e:
+                        print(f"⚠️ Could not import {legacy_file}: {e}")
+                self._write(conn, initial)
+        finally:
+            conn.close()
+
+    def _write(self, conn, upserts=None, deletes=()):
+        now = datetime.now().isoformat()
+        with conn:
+            for website_id, config in (upserts or {}).items():
+                conn.execute("""
+                    INSERT INTO tenants (website_id, config, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT(website_id) DO UPDATE SET config = excluded.config, updated_at = excluded.updated_at
+                """, (website_id, json.dumps(config, sort_keys=True), now))
+            for website_id in deletes:
+                conn.execute("DELETE FROM tenants WHERE website_id = ?", (website_id,))
+            conn.execute("UPDATE registry_meta SET value = value + 1 WHERE key = 'version'")
+
+    def _stored_version(self, conn):
+        return conn.execute("SELECT value FROM registry_meta WHERE key = 'version'").fetchone()[0]
+
+    # ---------- reload ----------
+
+    def reload(self):
+        """Re-read the store if its version changed; returns the ids of changed tenants"""
+        with self._reload_lock:
+            changed = self._reload()
+        if changed and self._listeners:
+            for listener in list(self._listeners):
+                try:
+                    listener(changed)
+                except Exception as e:
+                    logger.warning(f"Tenant registry listener failed: {e}")
+        return changed
+
+    def _reload(self):
+        conn = self._connect()
+        try:
+            version = self._stored_version(conn)
+            if version == self._version:
+                return set()
+            rows = conn.execute("SELECT website_id, config FROM tenants").fetchall()
+        finally:
+            conn.close()
+
+        snapshot = {website_id: json.loads(config) for website_id, config in rows}
+        with self._lock:
+            previous = self._snapshot
+            self._snapshot = snapshot
+            self._version = version
+        changed = {website_id for website_id in set(previous) | set(snapshot)
+                   if previous.get(website_id) != snapshot.get(website_id)}
+        if changed:
+            logger.info(f"Tenant registry v{version}: changed {sorted(changed)}")
+        return changed
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                logger.warning(f"Tenant registry reload failed: {e}")
+
+    def add_listener(self, listener):
+        """Call listener(changed_website_ids) after every reload that changed tenants"""
+        self._listeners.append(listener)
+
+    # ---------- writes ----------
+
+    def upsert(self, website_id, config):
+        """Create or replace one tenant's configuration"""
+        conn = self._connect()
+        try:
+            self._write(conn, {website_id: config})
+        finally:
+            conn.close()
+        return self.reload()
+
+    def update(self, website_id, **changes):
+        """Merge changes into an existing tenant's configuration"""
+        if website_id not in self._snapshot:
+            raise KeyError(website_id)
+        return self.upsert(website_id, {**self._snapshot[website_id], **changes})
+
+    def delete(self, website_id):
+        conn = self._connect()
+        try:
+            self._write(conn, deletes=[website_id])
+        finally:
+            conn.close()
+        return self.reload()
+
+    # ---------- Mapping (memory only) ----------
+
+    @property
+    def version(self):
+        return self._version
+
+    def __getitem__(self, website_id):
+        return self._snapshot[website_id]
+
+    def __contains__(self, website_id):
+        return website_id in self._snapshot
+
+    def __iter__(self):
+        return iter(self._snapshot)
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def get(self, website_id, default=None):
+        return self._snapshot.get(website_id, default)
+
+    # Views of one snapshot, so iteration is unaffected by a concurrent reload
+    def keys(self):
+        return self._snapshot.keys()
+
+    def items(self):
+        return self._snapshot.items()
+
+    def values(self):
+        return self._snapshot.values()
@@ -0,0 +1,447 @@
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+try:
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langchain_core.embeddings import Embeddings
+except ImportError:  # tracing still works without LangChain, only the adapters are lost
+    BaseCallbackHandler = object
+    Embeddings = object
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+
+# ================================
+# Prometheus-style metrics registry
+# ================================
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.label_names, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {entry['count']}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {entry['sum']}")
+                lines.append(f"{self.name}_count{labels} {entry['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, label_names=()):
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, help_text, label_names, buckets))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+chat_requests_total = registry.counter(
+    "chat_requests_total", "Chat requests handled",
+    ("website_id", "provider", "model", "status"))
+chat_request_duration = registry.histogram(
+    "chat_request_duration_seconds", "End-to-end chat request latency",
+    ("website_id", "provider", "model"))
+chat_stage_duration = registry.histogram(
+    "chat_stage_duration_seconds", "Latency of each chat pipeline stage",
+    ("stage", "website_id", "provider"))
+chat_tokens_total = registry.counter(
+    "chat_tokens_total", "LLM tokens consumed by chat requests",
+    ("direction", "website_id", "provider", "model"))
+chat_retrieved_documents = registry.histogram(
+    "chat_retrieved_documents", "Documents retrieved per chat request",
+    ("website_id",), buckets=COUNT_BUCKETS)
+
+
+# ================================
+# Per-request traces
+# ================================
+
+class ChatTrace:
+    """Stage spans and attributes collected for one request"""
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.spans = []
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.tokens_cached = 0
+        self.status = "ok"
+        self.start_time_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_span(self, stage, duration, start_time_ns=None, **attributes):
+        self.spans.append({
+            "stage": stage,
+            "duration": duration,
+            "start_time_ns": start_time_ns or (time.time_ns() - int(duration * 1e9)),
+            "attributes": attributes
+        })
+
+    @contextmanager
+    def span(self, stage, **attributes):
+        start_ns = time.time_ns()
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_span(stage, time.perf_counter() - started, start_ns, **attributes)
+
+    def add_tokens(self, tokens_in=0, tokens_out=0, tokens_cached=0):
+        self.tokens_in += tokens_in or 0
+        self.tokens_out += tokens_out or 0
+        self.tokens_cached += tokens_cached or 0
+
+    def stage_totals(self):
+        totals = {}
+        for span in self.spans:
+            totals[span["stage"]] = totals.get(span["stage"], 0.0) + span["duration"]
+        # Retrieval includes embedding the query; the remainder is the vector search
+        if "retrieval" in totals and "embedding" in totals:
+            totals["vector_search"] = max(0.0, totals["retrieval"] - totals["embedding"])
+        return totals
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "status": self.status,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "tokens_cached": self.tokens_cached,
+            "stages": self.stage_totals(),
+            "spans": self.spans
+        }
+
+    def finish(self, status=None):
+        if self.duration is not None:
+            return
+        if status:
+            self.status = status
+        self.duration = time.perf_counter() - self._started
+        _record(self)
+
+
+_local = threading.local()
+_exporters = []
+
+
+def start_trace(name="chat", **attributes):
+    """Start a trace bound to the current thread"""
+    trace = ChatTrace(name, **attributes)
+    _local.trace = trace
+    return trace
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+def end_trace(status=None):
+    trace = current_trace()
+    _local.trace = None
+    if trace is not None:
+        trace.finish(status)
+    return trace
+
+
+@contextmanager
+def span(stage, **attributes):
+    """Time a stage of the current trace; a no-op outside a trace"""
+    trace = current_trace()
+    if trace is None:
+        yield None
+        return
+    with trace.span(stage, **attributes):
+        yield trace
+
+
+def add_trace_exporter(exporter):
+    """Register a callable that receives every finished trace"""
+    _exporters.append(exporter)
+    return exporter
+
+
+def remove_trace_exporter(exporter):
+    if exporter in _exporters:
+        _exporters.remove(exporter)
+
+
+class InMemoryCollector:
+    """Keeps finished traces in process, e.g. for tests or a debug endpoint"""
+
+    def __init__(self, max_traces=1000):
+        self.max_traces = max_traces
+        self.traces = []
+        self._lock = threading.Lock()
+
+    def __call__(self, trace):
+        with self._lock:
+            self.traces.append(trace)
+            if len(self.traces) > self.max_traces:
+                del self.traces[:len(self.traces) - self.max_traces]
+
+    def clear(self):
+        with self._lock:
+            self.traces.clear()
+
+
+def _record(trace):
+    attrs = trace.attributes
+    website_id = attrs.get("website_id", "unknown")
+    provider = attrs.get("provider", "unknown")
+    model = attrs.get("model", "unknown")
+
+    chat_requests_total.inc(website_id=website_id, provider=provider, model=model, status=trace.status)
+    chat_request_duration.observe(trace.duration, website_id=website_id, provider=provider, model=model)
+    for stage, duration in trace.stage_totals().items():
+        chat_stage_duration.observe(duration, stage=stage, website_id=website_id, provider=provider)
+    if trace.tokens_in:
+        chat_tokens_total.inc(trace.tokens_in, direction="in", website_id=website_id, provider=provider, model=model)
+    if trace.tokens_out:
+        chat_tokens_total.inc(trace.tokens_out, direction="out", website_id=website_id, provider=provider, model=model)
+    if trace.tokens_cached:
+        chat_tokens_total.inc(trace.tokens_cached, direction="cached", website_id=website_id, provider=provider, model=model)
+    if "retrieved_docs" in attrs:
+        chat_retrieved_documents.observe(attrs["retrieved_docs"], website_id=website_id)
+
+    stages = ", ".join(f"{stage}={duration * 1000:.1f}ms" for stage, duration in trace.stage_totals().items())
+    logger.info(f"{trace.name} trace website={website_id} provider={provider} model={model} "
+                f"status={trace.status} total={trace.duration * 1000:.1f}ms "
+                f"tokens={trace.tokens_in}/{trace.tokens_out} cached={trace.tokens_cached} {stages}")
+
+    for exporter in list(_exporters):
+        try:
+            exporter(trace)
+        except Exception as e:
+            logger.warning(f"Trace exporter failed: {e}")
+
+
+# ================================
+# Optional OTLP export
+# ================================
+
+def configure_otlp(endpoint=None, service_name="ollama-rag-chatbot"):
+    """Mirror finished traces to an OTLP collector when opentelemetry is available"""
+    endpoint = endpoint or os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if not endpoint:
+        return False
+    try:
+        from opentelemetry import trace as otel_trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        logger.warning(f"OTLP export requested but opentelemetry is unavailable: {e}")
+        return False
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    tracer = provider.get_tracer(__name__)
+
+    def export(trace):
+        end_ns = trace.start_time_ns + int(trace.duration * 1e9)
+        attributes = {k: v for k, v in trace.attributes.items() if isinstance(v, (str, int, float, bool))}
+        attributes.update({"chat.tokens_in": trace.tokens_in, "chat.tokens_out": trace.tokens_out,
+                           "chat.tokens_cached": trace.tokens_cached, "chat.status": trace.status})
+        root = tracer.start_span(trace.name, start_time=trace.start_time_ns, attributes=attributes)
+        context = otel_trace.set_span_in_context(root)
+        for item in trace.spans:
+            child_attrs = {k: v for k, v in item["attributes"].items() if isinstance(v, (str, int, float, bool))}
+            child = tracer.start_span(item["stage"], context=context,
+                                      start_time=item["start_time_ns"], attributes=child_attrs)
+            child.end(end_time=item["start_time_ns"] + int(item["duration"] * 1e9))
+        root.end(end_time=end_ns)
+
+    add_trace_exporter(export)
+    logger.info(f"OTLP trace export enabled to {endpoint}")
+    return True
+
+
+# ================================
+# LangChain adapters
+# ================================
+
+def _usage_from_llm_result(response):
+    """(tokens_in, tokens_out, tokens_cached) from an LLMResult across OpenAI and Ollama response shapes.
+
+    tokens_cached is the part of the prompt served from the provider's prompt
+    cache, where the provider reports it (OpenAI).
+    """
+    tokens_in = tokens_out = tokens_cached = 0
+    usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+    tokens_in += usage.get("prompt_tokens", 0) or 0
+    tokens_out += usage.get("completion_tokens", 0) or 0
+    tokens_cached += (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+    if tokens_in or tokens_out:
+        return tokens_in, tokens_out, tokens_cached
+
+    for generations in getattr(response, "generations", []) or []:
+        for generation in generations:
+            info = getattr(generation, "generation_info", None) or {}
+            tokens_in += info.get("prompt_eval_count", 0) or 0
+            tokens_out += info.get("eval_count", 0) or 0
+            message = getattr(generation, "message", None)
+            usage_metadata = getattr(message, "usage_metadata", None) if message is not None else None
+            if usage_metadata and not (info.get("prompt_eval_count") or info.get("eval_count")):
+                tokens_in += usage_metadata.get("input_tokens", 0) or 0
+                tokens_out += usage_metadata.get("output_tokens", 0) or 0
+                tokens_cached += (usage_metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+    return tokens_in, tokens_out, tokens_cached
+
+
+def _prompt_eval_seconds(response):
+    """Time Ollama spent evaluating the prompt (shrinks when its prefix cache hits), or None"""
+    durations = [(getattr(generation, "generation_info", None) or {}).get("prompt_eval_duration")
+                 for generations in getattr(response, "generations", []) or [] for generation in generations]
+    durations = [duration for duration in durations if duration]
+    return sum(durations) / 1e9 if durations else None
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """Records retrieval and LLM spans of a LangChain run into a ChatTrace"""
+
+    def __init__(self, trace):
+        super().__init__()
+        self.trace = trace
+        self._starts = {}
+
+    def _start(self, run_id):
+        self._starts[run_id] = (time.time_ns(), time.perf_counter())
+
+    def _end(self, run_id, stage, **attributes):
+        started = self._starts.pop(run_id, None)
+        if started is not None:
+            start_ns, start = started
+            self.trace.add_span(stage, time.perf_counter() - start, start_ns, **attributes)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self.trace.set(retrieved_docs=self.trace.attributes.get("retrieved_docs", 0) + len(documents))
+        self._end(run_id, "retrieval", documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "retrieval", error=str(error))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        tokens_in, tokens_out, tokens_cached = _usage_from_llm_result(response)
+        self.trace.add_tokens(tokens_in, tokens_out, tokens_cached)
+        attributes = {"tokens_in": tokens_in, "tokens_out": tokens_out, "tokens_cached": tokens_cached}
+        prompt_eval = _prompt_eval_seconds(response)
+        if prompt_eval is not None:
+            attributes["prompt_eval"] = prompt_eval
+        self._end(run_id, "llm", **attributes)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "llm", error=str(error))
+
+
+class TimedEmbeddings(Embeddings):
+    """Wraps an embeddings model so query/document embedding shows up as a span"""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def embed_query(self, text):
+        with span("embedding"):
+            return self.embeddings.embed_query(text)
+
+    def embed_documents(self, texts):
+        with span("embedding", documents=len(texts)):
+            return self.embeddings.embed_documents(texts)
+
+    def __getattr__(self, name):
+        return getattr(self.embeddings, name)
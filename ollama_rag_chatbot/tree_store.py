@@ -0,0 +1,337 @@
+"""Conversation trees stored as materialized paths.
+
+Every conversation_nodes row carries its path from the root
+("000001/000002/000005"), its depth, its branch (the chain of user intents
+leading to it) and a child count. A whole subtree is then one range scan on
+(convo_id, path), and drop-off / conversion per branch is one GROUP BY on
+(topic, branch, depth) instead of recursive parent_id lookups.
+"""
+import uuid
+import time
+import logging
+from datetime import datetime, timedelta
+
+import db_model
+
+logger = logging.getLogger(__name__)
+
+PATH_SEPARATOR = "/"
+PATH_DIGITS = 6
+# Branch keys keep the first few user intents so their number stays bounded
+BRANCH_MAX_INTENTS = 8
+BRANCH_SEPARATOR = ">"
+
+# A user's conversation ends after this much inactivity
+SESSION_TIMEOUT = timedelta(minutes=30)
+# Deepest node whose path still fits conversation_nodes.path (VARCHAR(2048));
+# a conversation that reaches it continues under a new convo_id
+PATH_MAX_LENGTH = 2048
+MAX_DEPTH = (PATH_MAX_LENGTH + len(PATH_SEPARATOR)) // (PATH_DIGITS + len(PATH_SEPARATOR)) - 1
+# MySQL deadlock / lock wait timeout: append_turn retries these
+RETRYABLE_ERRORS = (1213, 1205)
+APPEND_ATTEMPTS = 3
+
+NODE_COLUMNS = ("convo_id", "node_id", "parent_id", "user_id", "message", "sender", "topic", "intent",
+                "sales_flag", "success_flag", "path", "depth", "branch")
+
+
+def path_segment(node_id):
+    return f"{int(node_id):0{PATH_DIGITS}d}"
+
+
+def child_path(parent_path, node_id):
+    return f"{parent_path}{PATH_SEPARATOR}{path_segment(node_id)}" if parent_path else path_segment(node_id)
+
+
+def child_branch(parent_branch, sender, intent):
+    """Branch of a node: user turns with an intent extend their parent's branch"""
+    if sender != "user" or not intent or intent == "None":
+        return parent_branch or ""
+    parts = parent_branch.split(BRANCH_SEPARATOR) if parent_branch else []
+    if len(parts) >= BRANCH_MAX_INTENTS:
+        return parent_branch
+    return BRANCH_SEPARATOR.join(parts + [str(intent)])
+
+
+# ---------- conversation ids ----------
+
+def _latest_node(cursor, user_id):
+    """(convo_id, node_id, depth, timestamp) of the user's most recent node, locked until commit"""
+    cursor.execute("""
+        SELECT convo_id, node_id, depth, timestamp FROM conversation_nodes
+        WHERE user_id = %s ORDER BY timestamp DESC, id DESC LIMIT 1
+        FOR UPDATE
+    """, (str(user_id),))
+    return cursor.fetchone()
+
+
+def _continues(latest, new_nodes, now):
+    """Whether new nodes join the latest conversation: it is recent and its paths have room"""
+    if latest is None:
+        return False
+    _, _, depth, last_seen = latest
+    return now - last_seen <= SESSION_TIMEOUT and depth + new_nodes <= MAX_DEPTH
+
+
+# ---------- writes ----------
+
+def _parent_rows(cursor, convo_id, parent_ids):
+    """{node_id: (path, depth, branch)} for existing parents, one indexed lookup"""
+    if not parent_ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(parent_ids))
+    cursor.execute(f"""
+        SELECT node_id, path, depth, branch FROM conversation_nodes
+        WHERE convo_id = %s AND node_id IN ({placeholders})
+    """, (convo_id, *parent_ids))
+    return {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()}
+
+
+def insert_nodes(convo_id, nodes, conn=None):
+    """Insert a batch of nodes with explicit node_id/parent_id in one statement.
+
+    Parents may be earlier nodes of the same batch or rows already stored.
+    Paths, depths, branches and parent child counts are filled in here.
+    """
+    own_connection = conn is None
+    conn = conn or db_model.get_connection()
+    cursor = conn.cursor()
+    try:
+        batch = {node["node_id"]: node for node in nodes}
+        stored_parents = {node.get("parent_id") for node in nodes
+                          if node.get("parent_id") and node.get("parent_id") not in batch}
+        known = _parent_rows(cursor, convo_id, sorted(stored_parents))
+
+        rows, child_counts = [], {}
+        for node in nodes:
+            parent_id = node.get("parent_id") or None
+            parent_path, parent_depth, parent_branch = known.get(parent_id, ("", -1, "")) if parent_id else ("", -1, "")
+            path = child_path(parent_path, node["node_id"])
+            depth = parent_depth + 1
+            branch = child_branch(parent_branch, node["sender"], node.get("intent"))
+            known[node["node_id"]] = (path, depth, branch)
+            if parent_id:
+                child_counts[parent_id] = child_counts.get(parent_id, 0) + 1
+            rows.append((
+                str(convo_id), node["node_id"], parent_id, str(node.get("user_id")), str(node["message"]),
+                str(node["sender"]), node.get("topic"), node.get("intent"),
+                bool(node.get("sales_flag")), bool(node.get("success_flag")), path, depth, branch,
+            ))
+
+        cursor.executemany(f"""
+            INSERT INTO conversation_nodes ({', '.join(NODE_COLUMNS)})
+            VALUES ({', '.join(['%s'] * len(NODE_COLUMNS))})
+        """, rows)
+        for parent_id, count in child_counts.items():
+            cursor.execute("""
+                UPDATE conversation_nodes SET child_count = child_count + %s
+                WHERE convo_id = %s AND node_id = %s
+            """, (count, convo_id, parent_id))
+        conn.commit()
+        return [row[1] for row in rows]
+    finally:
+        cursor.close()
+        if own_connection:
+            conn.close()
+
+
+def append_turn(user_id, turns, conn=None):
+    """Append a chain of turns (e.g. the user message and the bot reply) to the user's conversation.
+
+    The user's latest node is read FOR UPDATE in the same transaction as the
+    insert, so concurrent turns of one visitor (from any worker) queue up
+    instead of taking the same node_id. A conversation continues while it is
+    younger than SESSION_TIMEOUT and shallower than MAX_DEPTH; otherwise the
+    turns start a new one. Returns (convo_id, node_ids).
+    """
+    own_connection = conn is None
+    conn = conn or db_model.get_connection()
+    try:
+        for attempt in range(1, APPEND_ATTEMPTS + 1):
+            try:
+                cursor = conn.cursor()
+                try:
+                    latest = _latest_node(cursor, user_id)
+                finally:
+                    cursor.close()
+                if _continues(latest, len(turns), datetime.now()):
+                    convo_id, parent_id = latest[0], latest[1]
+                else:
+                    convo_id, parent_id = str(uuid.uuid4()), None
+                next_id = (parent_id or 0) + 1
+
+                nodes = []
+                for turn in turns:
+                    nodes.append({**turn, "node_id": next_id, "parent_id": parent_id, "user_id": user_id})
+                    parent_id, next_id = next_id, next_id + 1
+                # Commits, releasing the lock on the latest node
+                return convo_id, insert_nodes(convo_id, nodes, conn=conn)
+            except Exception as e:
+                conn.rollback()
+                if getattr(e, "errno", None) not in RETRYABLE_ERRORS or attempt == APPEND_ATTEMPTS:
+                    raise
+                logger.info(f"Retrying conversation turn for {user_id} after lock conflict: {e}")
+                time.sleep(0.05 * attempt)
+    finally:
+        if own_connection:
+            conn.close()
+
+
+# ---------- reads ----------
+
+def _build_forest(rows):
+    """Nest rows ordered by path into [{..., "children": [...]}]"""
+    roots, by_path = [], {}
+    for row in rows:
+        node = {**row, "children": []}
+        if isinstance(node.get("timestamp"), datetime):
+            node["timestamp"] = node["timestamp"].strftime("%Y-%m-%d %H:%M:%S")
+        by_path[row["path"]] = node
+        parent_path = row["path"].rpartition(PATH_SEPARATOR)[0]
+        parent = by_path.get(parent_path)
+        (parent["children"] if parent else roots).append(node)
+    return roots
+
+
+def subtree(convo_id, node_id=None):
+    """A conversation (or the subtree below one node) as nested nodes, from one range scan"""
+    conn = db_model.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        if node_id is None:
+            cursor.execute("""
+                SELECT convo_id, node_id, parent_id, user_id, message, sender, topic, intent,
+                       sales_flag, success_flag, path, depth, branch, child_count, timestamp
+                FROM conversation_nodes WHERE convo_id = %s ORDER BY path
+            """, (convo_id,))
+        else:
+            cursor.execute("SELECT path FROM conversation_nodes WHERE convo_id = %s AND node_id = %s",
+                           (convo_id, node_id))
+            row = cursor.fetchone()
+            if row is None:
+                return []
+            cursor.execute("""
+                SELECT convo_id, node_id, parent_id, user_id, message, sender, topic, intent,
+                       sales_flag, success_flag, path, depth, branch, child_count, timestamp
+                FROM conversation_nodes
+                WHERE convo_id = %s AND (path = %s OR path LIKE %s)
+                ORDER BY path
+            """, (convo_id, row["path"], row["path"] + PATH_SEPARATOR + "%"))
+        return _build_forest(cursor.fetchall())
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def topic_forest(topic=None, limit=50):
+    """{topic: {convo_id: [root nodes]}} for the most recent conversations, as tree_diagram.html expects"""
+    conn = db_model.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        where, params = ("WHERE topic = %s", [topic]) if topic else ("", [])
+        cursor.execute(f"""
+            SELECT n.convo_id, n.node_id, n.parent_id, n.message, n.sender, n.topic, n.intent,
+                   n.sales_flag, n.success_flag, n.path, n.depth, n.branch, n.child_count
+            FROM conversation_nodes n
+            JOIN (SELECT convo_id, MAX(timestamp) AS last_seen FROM conversation_nodes {where}
+                  GROUP BY convo_id ORDER BY last_seen DESC LIMIT %s) recent USING (convo_id)
+            ORDER BY n.convo_id, n.path
+        """, (*params, int(limit)))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+    by_convo = {}
+    for row in rows:
+        by_convo.setdefault(row["convo_id"], []).append(row)
+    grouped = {}
+    for convo_id, convo_rows in by_convo.items():
+        # A conversation is filed under the topic of its first message
+        grouped.setdefault(convo_rows[0]["topic"] or "general", {})[convo_id] = _build_forest(convo_rows)
+    return grouped
+
+
+def branch_stats(topic=None, max_depth=None, limit=200):
+    """Reach, drop-off and sales conversion per (topic, branch, depth) in one grouped query.
+
+    drop_off_rate is the share of nodes on the branch where the conversation
+    ended; conversion_rate is the share of conversations through the branch
+    that had a successful sale anywhere.
+    """
+    conditions, params = [], []
+    if topic:
+        conditions.append("n.topic = %s")
+        params.append(topic)
+    if max_depth is not None:
+        conditions.append("n.depth <= %s")
+        params.append(int(max_depth))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    conn = db_model.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"""
+            SELECT n.topic, n.branch, n.depth,
+                   COUNT(*) AS reached,
+                   SUM(n.child_count = 0) AS drop_offs,
+                   SUM(n.sales_flag) AS sales_flags,
+                   COUNT(DISTINCT n.convo_id) AS conversations,
+                   COUNT(DISTINCT CASE WHEN c.converted THEN n.convo_id END) AS converted
+            FROM conversation_nodes n
+            JOIN (SELECT convo_id, MAX(success_flag) AS converted FROM conversation_nodes
+                  GROUP BY convo_id) c USING (convo_id)
+            {where}
+            GROUP BY n.topic, n.branch, n.depth
+            ORDER BY reached DESC
+            LIMIT %s
+        """, (*params, int(limit)))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+    stats = []
+    for row in rows:
+        reached = int(row["reached"] or 0)
+        conversations = int(row["conversations"] or 0)
+        stats.append({
+            "topic": row["topic"],
+            "branch": row["branch"] or "",
+            "depth": row["depth"],
+            "reached": reached,
+            "drop_offs": int(row["drop_offs"] or 0),
+            "drop_off_rate": round(int(row["drop_offs"] or 0) / reached, 4) if reached else 0.0,
+            "sales_flags": int(row["sales_flags"] or 0),
+            "conversations": conversations,
+            "conversion_rate": round(int(row["converted"] or 0) / conversations, 4) if conversations else 0.0,
+        })
+    return stats
+
+
+# ---------- migration ----------
+
+def backfill_paths(cursor, batch_size=1000):
+    """Fill path/depth/branch/child_count for rows written before these columns existed"""
+    cursor.execute("SELECT DISTINCT convo_id FROM conversation_nodes WHERE path = ''")
+    convo_ids = [row[0] for row in cursor.fetchall()]
+    for convo_id in convo_ids:
+        cursor.execute("""
+            SELECT id, node_id, parent_id, sender, intent FROM conversation_nodes
+            WHERE convo_id = %s ORDER BY node_id
+        """, (convo_id,))
+        known, children, updates = {}, {}, []
+        for row_id, node_id, parent_id, sender, intent in cursor.fetchall():
+            parent_path, parent_depth, parent_branch = known.get(parent_id, ("", -1, ""))
+            known[node_id] = (child_path(parent_path, node_id), parent_depth + 1,
+                              child_branch(parent_branch, sender, intent))
+            if parent_id in known:
+                children[parent_id] = children.get(parent_id, 0) + 1
+            updates.append((row_id, node_id))
+        for start in range(0, len(updates), batch_size):
+            cursor.executemany("""
+                UPDATE conversation_nodes SET path = %s, depth = %s, branch = %s, child_count = %s
+                WHERE id = %s
+            """, [(*known[node_id], children.get(node_id, 0), row_id)
+                  for row_id, node_id in updates[start:start + batch_size]])
+    return len(convo_ids)
@@ -0,0 +1,418 @@
+"""HNSW settings, online rebuilds and recall/latency reports for Chroma indexes.
+
+Each knowledge base directory (./chroma_db_{website_id}, ./chroma_db, ./db)
+can be rebuilt with new HNSW parameters next to the live copy; a pointer
+file then switches readers over atomically. Writers hold write_lock()
+shared, and a rebuild holds it exclusively while it copies and switches,
+so no record is added to a copy that is about to be retired.
+
+Chroma keeps the HNSW metadata a collection was created with, so saved
+settings only take effect once the index is rebuilt; pending_settings()
+reports the difference and rebuild_pending() (run nightly by scheduler.py)
+applies it. From the command line:
+
+    python ollama_rag_chatbot/vector_index.py report --website sourceselect.ca
+    python ollama_rag_chatbot/vector_index.py rebuild --website sourceselect.ca --M 32 --ef-search 64
+"""
+import os
+import json
+import time
+import fcntl
+import random
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+INDEX_SETTINGS_FILE = "config/index_settings.json"
+
+# LangChain's Chroma wrapper stores everything in this collection by default
+COLLECTION_NAME = "langchain"
+
+# Chroma's own defaults, used when a website has no overrides
+DEFAULT_INDEX_SETTINGS = {
+    "space": "l2",
+    "M": 16,
+    "ef_construction": 100,
+    "ef_search": 10,
+}
+
+# Candidate settings compared by the report command
+REPORT_CANDIDATES = [
+    {"M": 8, "ef_construction": 64, "ef_search": 10},
+    {"M": 16, "ef_construction": 100, "ef_search": 10},
+    {"M": 16, "ef_construction": 200, "ef_search": 50},
+    {"M": 32, "ef_construction": 200, "ef_search": 100},
+]
+
+# Records copied per batch during a rebuild
+REBUILD_BATCH_SIZE = 1000
+# Stored vectors reused as queries when measuring recall
+REPORT_SAMPLE_QUERIES = 200
+REPORT_K = 5
+
+POINTER_SUFFIX = ".current"
+VERSION_MARKER = "__v"
+
+
+# ================================
+# Settings
+# ================================
+
+def load_index_settings():
+    """All saved settings: {"default": {...}, "<website_id>": {...}}"""
+    try:
+        if os.path.exists(INDEX_SETTINGS_FILE):
+            with open(INDEX_SETTINGS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        logger.warning(f"Could not load index settings: {e}")
+    return {}
+
+
+def save_index_settings(website_id, settings):
+    """Persist settings for one website"""
+    all_settings = load_index_settings()
+    all_settings[website_id] = {key: settings[key] for key in DEFAULT_INDEX_SETTINGS if key in settings}
+    os.makedirs(os.path.dirname(INDEX_SETTINGS_FILE), exist_ok=True)
+    tmp_path = INDEX_SETTINGS_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(all_settings, f, indent=2)
+    os.replace(tmp_path, INDEX_SETTINGS_FILE)
+
+
+def get_index_settings(website_id=None):
+    """Effective settings for a website: built-in defaults < saved default < website"""
+    saved = load_index_settings()
+    settings = dict(DEFAULT_INDEX_SETTINGS)
+    settings.update(saved.get("default", {}))
+    if website_id:
+        settings.update(saved.get(website_id, {}))
+    return settings
+
+
+def collection_metadata(settings):
+    """Chroma collection metadata for HNSW settings"""
+    return {
+        "hnsw:space": settings["space"],
+        "hnsw:M": int(settings["M"]),
+        "hnsw:construction_ef": int(settings["ef_construction"]),
+        "hnsw:search_ef": int(settings["ef_search"]),
+    }
+
+
+# Setting -> (collection metadata key, key in the collection's hnsw configuration)
+_SETTING_KEYS = {
+    "space": ("hnsw:space", "space"),
+    "M": ("hnsw:M", "max_neighbors"),
+    "ef_construction": ("hnsw:construction_ef", "ef_construction"),
+    "ef_search": ("hnsw:search_ef", "ef_search"),
+}
+
+
+def live_settings(base_path, collection_name=COLLECTION_NAME):
+    """HNSW settings the live collection was built with, or None if there is no index"""
+    path = resolve_index_path(base_path)
+    if not os.path.isdir(path):
+        return None
+    try:
+        collection = _client(path).get_collection(collection_name)
+    except Exception:
+        return None
+    metadata = collection.metadata or {}
+    configuration = (getattr(collection, "configuration_json", None) or {}).get("hnsw") or {}
+    settings = {}
+    for key, (metadata_key, configuration_key) in _SETTING_KEYS.items():
+        value = metadata.get(metadata_key, configuration.get(configuration_key))
+        settings[key] = DEFAULT_INDEX_SETTINGS[key] if value is None else value
+    return settings
+
+
+def pending_settings(base_path, settings=None, website_id=None, collection_name=COLLECTION_NAME):
+    """{setting: {"live": ..., "saved": ...}} the live index does not use yet; empty if none or no index"""
+    settings = settings or get_index_settings(website_id)
+    live = live_settings(base_path, collection_name)
+    if live is None:
+        return {}
+    return {key: {"live": live[key], "saved": settings[key]}
+            for key in DEFAULT_INDEX_SETTINGS if str(live[key]) != str(settings[key])}
+
+
+# ================================
+# Versioned directories
+# ================================
+
+def pointer_path(base_path):
+    return os.path.normpath(base_path) + POINTER_SUFFIX
+
+
+def resolve_index_path(base_path):
+    """Directory readers should open for a knowledge base"""
+    pointer = pointer_path(base_path)
+    try:
+        with open(pointer, "r", encoding="utf-8") as f:
+            target = f.read().strip()
+        if target and os.path.isdir(target):
+            return target
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not read index pointer {pointer}: {e}")
+    return base_path
+
+
+def switch_index(base_path, target_path):
+    """Atomically point readers of base_path at target_path"""
+    pointer = pointer_path(base_path)
+    tmp_path = f"{pointer}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(target_path)
+    os.replace(tmp_path, pointer)
+
+
+def index_versions(base_path):
+    """Versioned rebuild directories of a knowledge base, oldest first"""
+    base = os.path.normpath(base_path)
+    parent = os.path.dirname(base) or "."
+    prefix = os.path.basename(base) + VERSION_MARKER
+    if not os.path.isdir(parent):
+        return []
+    return sorted(os.path.join(parent, name) for name in os.listdir(parent)
+                  if name.startswith(prefix) and os.path.isdir(os.path.join(parent, name)))
+
+
+@contextmanager
+def write_lock(base_path, exclusive=False):
+    """Lock a knowledge base against rebuilds (shared) or against writers (exclusive), across processes"""
+    lock_file = os.path.normpath(base_path) + ".lock"
+    os.makedirs(os.path.dirname(lock_file) or ".", exist_ok=True)
+    with open(lock_file, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def drop_index(base_path):
+    """Remove a knowledge base with every rebuilt version and its pointer"""
+    for path in [base_path] + index_versions(base_path):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+    if os.path.exists(pointer_path(base_path)):
+        os.remove(pointer_path(base_path))
+
+
+def prune_versions(base_path, keep=1):
+    """Delete superseded rebuild directories, keeping the newest `keep` inactive ones"""
+    active = os.path.normpath(resolve_index_path(base_path))
+    inactive = [path for path in index_versions(base_path) if os.path.normpath(path) != active]
+    removed = inactive[:-keep] if keep else inactive
+    for path in removed:
+        shutil.rmtree(path, ignore_errors=True)
+    return removed
+
+
+# ================================
+# Rebuild
+# ================================
+
+def _client(path):
+    import chromadb
+    return chromadb.PersistentClient(path=path)
+
+
+def iter_records(collection, batch_size=REBUILD_BATCH_SIZE):
+    """Yield batches of stored ids, embeddings, documents and metadatas"""
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        batch = collection.get(limit=batch_size, offset=offset,
+                               include=["embeddings", "documents", "metadatas"])
+        if batch["ids"]:
+            yield batch
+
+
+def copy_collection(source, target, batch_size=REBUILD_BATCH_SIZE):
+    """Copy every record, reusing stored embeddings instead of re-embedding"""
+    copied = 0
+    for batch in iter_records(source, batch_size):
+        target.add(ids=batch["ids"], embeddings=batch["embeddings"],
+                   documents=batch["documents"], metadatas=batch["metadatas"])
+        copied += len(batch["ids"])
+    return copied
+
+
+def rebuild_index(base_path, settings, collection_name=COLLECTION_NAME, keep_versions=1):
+    """Build a new index with `settings` next to the live one and switch to it.
+
+    Writers wait on write_lock() until the new index is live, so none of
+    their records end up only in the retired copy.
+    """
+    started = time.perf_counter()
+    with write_lock(base_path, exclusive=True):
+        source_path = resolve_index_path(base_path)
+        if not os.path.isdir(source_path):
+            raise FileNotFoundError(f"No knowledge base at {source_path}")
+
+        version = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        target_path = f"{os.path.normpath(base_path)}{VERSION_MARKER}{version}"
+
+        source = _client(source_path).get_collection(collection_name)
+        target = _client(target_path).create_collection(collection_name, metadata=collection_metadata(settings))
+        try:
+            copied = copy_collection(source, target)
+            if copied != source.count():
+                raise RuntimeError(f"Copied {copied} of {source.count()} records; source changed during rebuild")
+        except Exception:
+            shutil.rmtree(target_path, ignore_errors=True)
+            raise
+
+        switch_index(base_path, target_path)
+    removed = prune_versions(base_path, keep=keep_versions)
+    result = {
+        "base_path": base_path,
+        "previous_path": source_path,
+        "active_path": target_path,
+        "records": copied,
+        "settings": settings,
+        "pruned": removed,
+        "duration_seconds": round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"Rebuilt index: {result}")
+    return result
+
+
+def rebuild_pending(website_ids):
+    """Rebuild every website index whose saved settings differ from the live ones"""
+    rebuilt = {}
+    for website_id in website_ids:
+        base_path = website_base_path(website_id)
+        settings = get_index_settings(website_id)
+        if pending_settings(base_path, settings):
+            try:
+                rebuilt[website_id] = rebuild_index(base_path, settings)["active_path"]
+            except Exception as e:
+                logger.warning(f"Could not rebuild index of {website_id}: {e}")
+    return rebuilt
+
+
+# ================================
+# Recall / latency report
+# ================================
+
+def _exact_top_k(matrix, queries, k, space):
+    """Brute-force neighbours used as ground truth"""
+    import numpy as np
+
+    if space == "cosine":
+        matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        scores = queries @ matrix.T
+    elif space == "ip":
+        scores = queries @ matrix.T
+    else:
+        scores = -(np.sum(queries ** 2, axis=1, keepdims=True) - 2 * queries @ matrix.T
+                   + np.sum(matrix ** 2, axis=1))
+    k = min(k, matrix.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return top
+
+
+def evaluate_settings(base_path, candidates=REPORT_CANDIDATES, k=REPORT_K,
+                      sample_queries=REPORT_SAMPLE_QUERIES, collection_name=COLLECTION_NAME, space=None):
+    """Recall@k against exact search and query latency for each candidate setting"""
+    import numpy as np
+
+    source = _client(resolve_index_path(base_path)).get_collection(collection_name)
+    ids, vectors = [], []
+    for batch in iter_records(source):
+        ids.extend(batch["ids"])
+        vectors.extend(batch["embeddings"])
+    if not ids:
+        return {"base_path": base_path, "records": 0, "results": []}
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    rng = random.Random(42)
+    query_rows = rng.sample(range(len(ids)), min(sample_queries, len(ids)))
+    queries = matrix[query_rows]
+    live_space = (source.metadata or {}).get("hnsw:space", DEFAULT_INDEX_SETTINGS["space"])
+
+    results = []
+    for candidate in candidates:
+        settings = dict(DEFAULT_INDEX_SETTINGS, space=space or live_space)
+        settings.update(candidate)
+        truth = _exact_top_k(matrix, queries, k, settings["space"])
+
+        workdir = tempfile.mkdtemp(prefix="index-report-")
+        try:
+            started = time.perf_counter()
+            target = _client(workdir).create_collection(collection_name, metadata=collection_metadata(settings))
+            copy_collection(source, target)
+            build_seconds = time.perf_counter() - started
+
+            latencies, hits = [], 0
+            for row, query in enumerate(queries):
+                started = time.perf_counter()
+                found = target.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+                latencies.append(time.perf_counter() - started)
+                expected = {ids[i] for i in truth[row]}
+                hits += len(expected & set(found["ids"][0]))
+            latencies.sort()
+            results.append({
+                "settings": settings,
+                "recall_at_k": round(hits / (len(queries) * min(k, len(ids))), 4),
+                "query_ms_p50": round(latencies[len(latencies) // 2] * 1000, 3),
+                "query_ms_p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 3),
+                "build_seconds": round(build_seconds, 3),
+            })
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {"base_path": base_path, "records": len(ids), "k": k, "queries": len(queries), "results": results}
+
+
+def website_base_path(website_id):
+    """Unversioned knowledge base directory of a website (see app.get_knowledge_base_path)"""
+    return f"./chroma_db_{website_id}"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tune and rebuild Chroma HNSW indexes")
+    parser.add_argument("command", choices=["show", "report", "rebuild"])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--website", help="Website id (uses ./chroma_db_<id>)")
+    target.add_argument("--path", help="Knowledge base directory, e.g. ./chroma_db or ./db")
+    parser.add_argument("--space", choices=["l2", "cosine", "ip"])
+    parser.add_argument("--M", type=int)
+    parser.add_argument("--ef-construction", type=int)
+    parser.add_argument("--ef-search", type=int)
+    parser.add_argument("--k", type=int, default=REPORT_K)
+    parser.add_argument("--no-save", action="store_true", help="Rebuild without saving the settings")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    base_path = website_base_path(args.website) if args.website else args.path
+    settings_key = args.website or "default"
+    overrides = {key: value for key, value in {
+        "space": args.space, "M": args.M,
+        "ef_construction": args.ef_construction, "ef_search": args.ef_search,
+    }.items() if value is not None}
+
+    if args.command == "show":
+        print(json.dumps({"active_path": resolve_index_path(base_path),
+                          "settings": get_index_settings(args.website),
+                          "pending_rebuild": pending_settings(base_path, website_id=args.website)}, indent=2))
+    elif args.command == "report":
+        candidates = [overrides] if overrides else REPORT_CANDIDATES
+        print(json.dumps(evaluate_settings(base_path, candidates, k=args.k), indent=2))
+    else:
+        settings = get_index_settings(args.website)
+        settings.update(overrides)
+        print(json.dumps(rebuild_index(base_path, settings), indent=2))
+        if not args.no_save:
+            save_index_settings(settings_key, settings)
@@ -0,0 +1,60 @@
+import json
+import os
+
+import keyword_matcher
+from keyword_matcher import KeywordMatcher, ReloadableMatcher
+
+
+def test_keywords_match_at_word_starts():
+    matcher = KeywordMatcher({"product": ["service"], "company": ["about"]})
+    assert matcher.match("Which services do you have?") == ["product"]
+    assert matcher.match("Take the second exit at the roundabout") == []
+
+
+def test_labels_in_order_of_first_occurrence():
+    matcher = KeywordMatcher({"sales": ["price"], "company": ["contact"], "legal": ["refund"]})
+    assert matcher.match("Refund policy, and who do I contact about the price?") == ["legal", "company", "sales"]
+
+
+def test_phrases_and_overlapping_keywords():
+    matcher = KeywordMatcher({"product": ["what can you do"], "sales": ["buy", "buying power"]})
+    assert matcher.match("So, what can you do?") == ["product"]
+    assert [keyword for _, keyword in matcher.iter_matches("more buying power")] == ["buy", "buying power"]
+
+
+def test_punctuation_and_curly_quotes_are_normalized():
+    matcher = KeywordMatcher({"sales": ["what's the cost"]})
+    assert matcher.match("Hi!What’s the COST?") == ["sales"]
+
+
+def test_blank_keywords_are_ignored():
+    matcher = KeywordMatcher({"sales": ["", "  ", "quote"]})
+    assert matcher.match("anything at all") == []
+    assert matcher.match("a quote please") == ["sales"]
+
+
+def test_determine_query_categories_follows_routes():
+    assert keyword_matcher.determine_query_categories("How much does it cost?") == ["sales_training", "product_info"]
+    assert keyword_matcher.determine_query_categories("What is your refund policy and price?") == \
+        ["sales_training", "product_info", "policies_legal"]
+    assert keyword_matcher.determine_query_categories("Hello there") is None
+
+
+def test_reloadable_matcher_picks_up_config_changes(tmp_path):
+    config_file = tmp_path / "intent_keywords.json"
+    matcher = ReloadableMatcher("intents", {"sales": ["price"]}, config_file=str(config_file), check_interval=0)
+    assert matcher.match("what is the price") == ["sales"]
+
+    config_file.write_text(json.dumps({"intents": {"sales": ["quote"], "support": ["broken"]}}))
+    assert matcher.match("what is the price") == []
+    assert matcher.match("it is broken, send a quote") == ["support", "sales"]
+
+    os.remove(config_file)
+    assert matcher.match("what is the price") == ["sales"]
+
+
+def test_unreadable_config_falls_back_to_defaults(tmp_path):
+    config_file = tmp_path / "intent_keywords.json"
+    config_file.write_text("{not json")
+    matcher = ReloadableMatcher("intents", {"sales": ["price"]}, config_file=str(config_file), check_interval=0)
+    assert matcher.match("the price") == ["sales"]
@@ -0,0 +1,129 @@
+import threading
+
+import pytest
+from langchain_core.outputs import Generation, LLMResult
+
+import tracing
+import llm_router
+
+
+class FakeClient:
+    """Stands in for an LLM client; blocks on `release` when given one"""
+
+    def __init__(self, text="", usage=None, error=None, release=None):
+        self.text = text
+        self.usage = usage
+        self.error = error
+        self.release = release
+        self.calls = 0
+
+    def generate_prompt(self, prompts, stop=None):
+        self.calls += 1
+        if self.release is not None:
+            self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return LLMResult(generations=[[Generation(text=self.text or prompts[0].to_string())]],
+                         llm_output={"token_usage": self.usage} if self.usage else None)
+
+
+@pytest.fixture
+def release():
+    event = threading.Event()
+    yield event
+    event.set()  # let blocked fake backends finish
+
+
+def make_router(clients, **policy):
+    pool = llm_router.BackendPool()
+    pool.configure({name: {"name": name} for name in clients}, lambda spec: clients[spec["name"]])
+    policy = {**llm_router.DEFAULT_POLICY, "backends": list(clients), "strategy": "ordered",
+              "hedge_after": 0, **policy}
+    return llm_router.Router(policy, backend_pool=pool)
+
+
+def test_first_backend_answers():
+    router = make_router({"a": FakeClient("from a"), "b": FakeClient("from b")})
+    (generation, _), backend = router.call("hello")
+    assert (generation.text, backend) == ("from a", "a")
+
+
+def test_failover_to_next_backend():
+    clients = {"a": FakeClient(error=ConnectionError("refused")), "b": FakeClient("from b")}
+    router = make_router(clients)
+    (generation, _), backend = router.call("hello")
+    assert (generation.text, backend) == ("from b", "b")
+    assert router.pool.get("a").consecutive_failures == 1
+
+
+def test_all_backends_failing_raises():
+    clients = {"a": FakeClient(error=ConnectionError("refused")), "b": FakeClient(error=ValueError("bad"))}
+    with pytest.raises(RuntimeError, match="All LLM backends failed: a: refused; b: bad"):
+        make_router(clients).call("hello")
+
+
+def test_max_attempts_limits_failover():
+    clients = {"a": FakeClient(error=ConnectionError("refused")), "b": FakeClient("from b")}
+    with pytest.raises(RuntimeError):
+        make_router(clients, max_attempts=1).call("hello")
+    assert clients["b"].calls == 0
+
+
+def test_slow_backend_is_hedged(release):
+    clients = {"a": FakeClient("from a", release=release), "b": FakeClient("from b")}
+    router = make_router(clients, hedge_after=0.05)
+    (generation, _), backend = router.call("hello")
+    assert (generation.text, backend) == ("from b", "b")
+    assert clients["a"].calls == 1
+
+
+def test_no_hedge_without_hedge_after(release):
+    clients = {"a": FakeClient("from a", release=release), "b": FakeClient("from b")}
+    router = make_router(clients, hedge_after=0, timeout=0.2)
+    with pytest.raises(TimeoutError, match="a"):
+        router.call("hello")
+    assert clients["b"].calls == 0
+
+
+def test_timeout_names_pending_backends(release):
+    clients = {"a": FakeClient(release=release), "b": FakeClient(release=release)}
+    router = make_router(clients, hedge_after=0.02, timeout=0.2)
+    with pytest.raises(TimeoutError, match="a, b"):
+        router.call("hello")
+
+
+def test_hedges_per_backend_are_bounded(release):
+    clients = {"a": FakeClient(release=release), "b": FakeClient(release=release)}
+    router = make_router(clients, hedge_after=0.01, timeout=0.1)
+    backend = router.pool.get("b")
+    for _ in range(llm_router.MAX_HEDGES_PER_BACKEND):
+        assert backend.try_hedge()
+    with pytest.raises(TimeoutError):
+        router.call("hello")
+    assert clients["b"].calls == 0
+
+
+def test_routed_llm_sums_token_usage():
+    usage = {"prompt_tokens": 10, "completion_tokens": 4, "prompt_tokens_details": {"cached_tokens": 8}}
+    llm = llm_router.RoutedLLM(router=make_router({"a": FakeClient("ok", usage=usage)}))
+    result = llm.generate(["one", "two"])
+    assert result.llm_output["token_usage"] == {
+        "prompt_tokens": 20, "completion_tokens": 8, "prompt_tokens_details": {"cached_tokens": 16}}
+    assert [generations[0].generation_info["backend"] for generations in result.generations] == ["a", "a"]
+
+
+def test_routed_llm_without_usage_reports_none():
+    llm = llm_router.RoutedLLM(router=make_router({"a": FakeClient("ok")}))
+    assert not llm.generate(["one"]).llm_output
+
+
+def test_routed_llm_usage_reaches_trace():
+    usage = {"prompt_tokens": 10, "completion_tokens": 4}
+    llm = llm_router.RoutedLLM(router=make_router({"a": FakeClient("ok", usage=usage)}))
+    trace = tracing.start_trace("chat")
+    try:
+        llm.invoke("one", config={"callbacks": [tracing.TraceCallbackHandler(trace)]})
+    finally:
+        tracing.end_trace()
+    assert (trace.tokens_in, trace.tokens_out) == (10, 4)
+    assert trace.attributes["backend"] == "a"
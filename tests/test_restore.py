@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+import restore
+import snapshots
+import vector_index
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Website stores live at paths relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return snapshots.SnapshotStore(str(tmp_path / "snapshots"), compress=False)
+
+
+def test_website_snapshot_restores_and_retires_missing_stores(store):
+    write("src/kb/chroma.sqlite3", "vectors")
+    write("src/uploads/a.txt", "A")
+    write("src/prompt.txt", "Be brief.")
+    manifest = store.create_snapshot({"knowledge_base": "src/kb", "uploads": "src/uploads",
+                                      "prompt.txt": "src/prompt.txt"}, scope="acme")
+    # State after the snapshot: a NumPy store appeared and the uploads changed
+    write("numpy_db_acme/docs.json", "[]")
+    write("uploads/acme/a.txt", "changed")
+    write("uploads/acme/b.txt", "B")
+
+    result = restore.restore_website(manifest["id"], "acme", store=store)
+
+    assert result["retired"] == ["numpy_knowledge_base"]
+    assert not os.path.exists("numpy_db_acme")
+    active = vector_index.resolve_index_path(vector_index.website_base_path("acme"))
+    assert vector_index.VERSION_MARKER in active
+    assert read(os.path.join(active, "chroma.sqlite3")) == "vectors"
+    assert result["uploads"] == {"written": 1, "unchanged": 0, "removed": 1}
+    assert os.listdir("uploads/acme") == ["a.txt"] and read("uploads/acme/a.txt") == "A"
+    assert result["prompt"] == "Be brief."
+
+
+def test_website_snapshot_without_chroma_drops_the_index(store):
+    write("src/numpy/docs.json", "[]")
+    manifest = store.create_snapshot({"numpy_knowledge_base": "src/numpy"}, scope="acme")
+    write("chroma_db_acme/chroma.sqlite3", "stale")
+
+    result = restore.restore_website(manifest["id"], "acme", store=store)
+
+    assert result["retired"] == ["knowledge_base"]
+    assert not os.path.exists("chroma_db_acme")
+    assert read("numpy_db_acme/docs.json") == "[]"
+
+
+def test_snapshot_of_another_website_is_rejected(store):
+    write("src/uploads/a.txt", "A")
+    manifest = store.create_snapshot({"uploads": "src/uploads"}, scope="other")
+    with pytest.raises(ValueError, match="belongs to other"):
+        restore.restore_website(manifest["id"], "acme", store=store)
+
+
+def test_old_global_snapshot_leaves_knowledge_bases_alone(store):
+    write("src/uploads/acme/a.txt", "A")
+    write("src/uploads/globex/g.txt", "G")
+    manifest = store.create_snapshot({"uploads": "src/uploads"}, scope="global")
+    write("numpy_db_acme/docs.json", "[]")
+    write("chroma_db_acme/chroma.sqlite3", "live")
+
+    result = restore.restore_website(manifest["id"], "acme", store=store)
+
+    assert "retired" not in result
+    assert os.path.exists("numpy_db_acme/docs.json")
+    assert read("chroma_db_acme/chroma.sqlite3") == "live"
+    assert os.listdir("uploads/acme") == ["a.txt"]
+    assert not os.path.exists("uploads/globex")
+
+
+def test_global_snapshot_with_websites_restores_their_knowledge_bases(store):
+    write("src/uploads/acme/a.txt", "A")
+    write("src/kb_acme/chroma.sqlite3", "acme vectors")
+    manifest = store.create_snapshot({"uploads": "src/uploads", "websites/acme/knowledge_base": "src/kb_acme"},
+                                     scope="global", meta={"websites": ["acme", "globex"]})
+    write("numpy_db_acme/docs.json", "[]")
+    write("numpy_db_globex/docs.json", "[]")
+
+    acme = restore.restore_website(manifest["id"], "acme", store=store)
+    globex = restore.restore_website(manifest["id"], "globex", store=store)
+
+    active = vector_index.resolve_index_path(vector_index.website_base_path("acme"))
+    assert read(os.path.join(active, "chroma.sqlite3")) == "acme vectors"
+    assert acme["retired"] == ["numpy_knowledge_base"]
+    assert globex["retired"] == ["numpy_knowledge_base"]
+    assert globex["uploads"] == {"written": 0, "unchanged": 0, "removed": 0}
+    assert not os.path.exists("numpy_db_acme") and not os.path.exists("numpy_db_globex")
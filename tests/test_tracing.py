@@ -0,0 +1,82 @@
+import pytest
+from langchain_core.outputs import Generation, LLMResult
+
+import tracing
+
+
+@pytest.fixture
+def collector():
+    collector = tracing.add_trace_exporter(tracing.InMemoryCollector())
+    yield collector
+    tracing.remove_trace_exporter(collector)
+
+
+def test_finished_trace_reaches_exporters_with_stage_totals(collector):
+    trace = tracing.start_trace("chat", website_id="acme", provider="ollama", model="llama3")
+    trace.add_span("retrieval", 0.30)
+    trace.add_span("embedding", 0.10)
+    with tracing.span("llm"):
+        pass
+    trace.add_tokens(12, 5, 4)
+
+    assert tracing.end_trace() is trace
+    assert tracing.current_trace() is None
+    assert collector.traces == [trace]
+
+    exported = trace.to_dict()
+    assert exported["tokens_in"] == 12 and exported["tokens_out"] == 5 and exported["tokens_cached"] == 4
+    assert exported["stages"]["vector_search"] == pytest.approx(0.20)
+    assert set(exported["stages"]) == {"retrieval", "embedding", "vector_search", "llm"}
+
+
+def test_span_outside_a_trace_is_a_noop(collector):
+    with tracing.span("retrieval") as trace:
+        assert trace is None
+    assert collector.traces == []
+
+
+def test_trace_is_recorded_once():
+    trace = tracing.start_trace("chat", website_id="trace-once")
+    tracing.end_trace("error")
+    trace.finish("ok")
+    assert trace.status == "error"
+    assert 'chat_requests_total{website_id="trace-once",provider="unknown",model="unknown",status="error"} 1' \
+        in tracing.registry.render()
+
+
+def test_failing_exporter_does_not_break_others(collector):
+    def broken(trace):
+        raise RuntimeError("collector down")
+
+    tracing.add_trace_exporter(broken)
+    try:
+        tracing.start_trace("chat")
+        tracing.end_trace()
+    finally:
+        tracing.remove_trace_exporter(broken)
+    assert len(collector.traces) == 1
+
+
+def test_usage_from_openai_result():
+    result = LLMResult(generations=[[Generation(text="hi")]], llm_output={"token_usage": {
+        "prompt_tokens": 100, "completion_tokens": 20, "prompt_tokens_details": {"cached_tokens": 64}}})
+    assert tracing._usage_from_llm_result(result) == (100, 20, 64)
+
+
+def test_usage_from_ollama_result():
+    result = LLMResult(generations=[[Generation(text="hi", generation_info={
+        "prompt_eval_count": 30, "eval_count": 7, "prompt_eval_duration": 250_000_000})]])
+    assert tracing._usage_from_llm_result(result) == (30, 7, 0)
+    assert tracing._prompt_eval_seconds(result) == pytest.approx(0.25)
+
+
+def test_callback_handler_records_llm_span_and_tokens():
+    trace = tracing.ChatTrace("chat")
+    handler = tracing.TraceCallbackHandler(trace)
+    handler.on_llm_start({}, ["prompt"], run_id="run-1")
+    handler.on_llm_end(LLMResult(generations=[[Generation(text="hi")]],
+                                 llm_output={"token_usage": {"prompt_tokens": 9, "completion_tokens": 3}}),
+                       run_id="run-1")
+    assert (trace.tokens_in, trace.tokens_out) == (9, 3)
+    assert [span["stage"] for span in trace.spans] == ["llm"]
+    assert trace.spans[0]["attributes"]["tokens_in"] == 9